@@ -0,0 +1,139 @@
+import logging
+import threading
+from typing import Optional
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveBatcher:
+    """
+    Picks the batch size for one phase of the pipeline from how its recent
+    batches went, instead of a fixed size.
+    
+    After every batch the caller reports how many rows it handled, how
+    long the whole batch took and how long its commit took. The size then:
+    
+    - shrinks when resident memory is above max_rss_bytes
+    - shrinks toward the target when the commit (how long locks are held)
+      took longer than target_commit_seconds, or the whole batch took
+      longer than max_batch_seconds (e.g. a fraction of a job lease)
+    - otherwise climbs toward the best rows/sec: it grows while throughput
+      holds up, shrinks only while that pays off, and takes smaller steps
+      after every turn so it settles on one size
+    
+    The size always stays within [min_size, max_size]. A batcher is shared
+    by every caller of its phase in the process and is thread-safe.
+    """
+    
+    def __init__(self, name: str, initial_size: int = 1000, min_size: int = 100, max_size: int = 20000,
+                 target_commit_seconds: float = 1.0, max_batch_seconds: Optional[float] = None,
+                 max_rss_bytes: Optional[int] = None, growth: float = 1.5, min_growth: float = 1.05,
+                 tolerance: float = 0.05, reexplore_every: int = 50):
+        self.name = name
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.target_commit_seconds = target_commit_seconds
+        self.max_batch_seconds = max_batch_seconds
+        self.max_rss_bytes = max_rss_bytes
+        self.initial_growth = growth
+        self.min_growth = min_growth
+        # Relative throughput change treated as noise
+        self.tolerance = tolerance
+        self.reexplore_every = reexplore_every
+        
+        self._size = self._clamp(initial_size)
+        self._growth = growth
+        self._direction = 1
+        self._best_rate = None
+        self._best_size = self._size
+        self._probes = 0
+        self._lock = threading.Lock()
+        metrics.BATCH_SIZE.labels(self.name).set(self._size)
+    
+    def _clamp(self, size: float) -> int:
+        return int(min(self.max_size, max(self.min_size, size)))
+    
+    @property
+    def size(self) -> int:
+        """Current batch size."""
+        return self._size
+    
+    def record(self, rows: int, seconds: float, commit_seconds: Optional[float] = None) -> int:
+        """
+        Report a finished batch and adjust the batch size.
+        
+        Args:
+            rows: Rows (URLs) the batch handled
+            seconds: Duration of the whole batch
+            commit_seconds: Duration of its database writes and commit
+                (the whole batch if not given)
+        
+        Returns:
+            The batch size to use next
+        """
+        commit_seconds = seconds if commit_seconds is None else commit_seconds
+        
+        with self._lock:
+            size = self._size
+            # A short final batch says little about the size being tuned
+            if rows < size // 2 or seconds <= 0:
+                return size
+            
+            rate = rows / seconds
+            rss = metrics.current_rss_bytes()
+            
+            # Durations grow about linearly with the batch size, so this is
+            # how much larger a batch could be and stay within the limits
+            headroom = self.target_commit_seconds / commit_seconds if commit_seconds > 0 else float('inf')
+            if self.max_batch_seconds:
+                headroom = min(headroom, self.max_batch_seconds / seconds)
+            
+            if self.max_rss_bytes and rss and rss > self.max_rss_bytes:
+                new_size = size / 2
+                reason = f"resident memory {rss // (1024 * 1024)}MB over the limit"
+                self._reset_climb()
+            elif headroom < 1:
+                # Scale back under the limits, but by at most half at once
+                new_size = size * max(0.5, headroom * 0.9)
+                reason = f"batch took {seconds:.2f}s (commit {commit_seconds:.2f}s)"
+                self._reset_climb()
+            else:
+                # Pattern search around the best size measured so far: a
+                # probe that beats it becomes the new best, one that does not
+                # sends the next probe the other way with a smaller step. A
+                # larger batch within tolerance of the best also wins, as it
+                # means fewer commits for about the same throughput.
+                if self._best_rate is None or rate > self._best_rate or (
+                        size > self._best_size and rate >= self._best_rate * (1 - self.tolerance)):
+                    self._best_size = size
+                    self._best_rate = max(rate, self._best_rate or 0.0)
+                else:
+                    self._direction = -self._direction
+                    self._growth = max(self.min_growth, 1 + (self._growth - 1) / 2)
+                
+                if self._direction > 0:
+                    # Grow, but not past what the limits allow
+                    new_size = min(self._best_size * self._growth, size * headroom * 0.9)
+                else:
+                    new_size = self._best_size / self._growth
+                
+                # Conditions change (database load, proxies), so the search
+                # starts over from time to time
+                self._probes += 1
+                if self._probes >= self.reexplore_every:
+                    self._probes = 0
+                    self._best_rate = None
+                    self._growth = max(self._growth, 1 + (self.initial_growth - 1) / 4)
+                reason = f"{rate:.0f} rows/s"
+            
+            self._size = self._clamp(new_size)
+            if self._size != size:
+                logger.debug(f"Batch size for {self.name}: {size} -> {self._size} ({reason})")
+                metrics.BATCH_SIZE.labels(self.name).set(self._size)
+            return self._size
+    
+    def _reset_climb(self) -> None:
+        """Start throughput climbing afresh after a limit forced a shrink (lock held)."""
+        self._best_rate = None
+        self._direction = 1
+        self._growth = self.initial_growth
@@ -1,11 +1,16 @@
 import os
 import io
 import csv
+import json
 import logging
+import threading
+import time
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from itertools import chain, islice
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, text
+from sqlalchemy import func, text, select, bindparam, case, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -39,12 +44,14 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
     "pool_size": 20,
     "max_overflow": 40,
-    "pool_timeout": 60,
-    "connect_args": {
+    "pool_timeout": 60
+}
+if app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql"):
+    # These connection arguments are only understood by psycopg2
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {
         "client_encoding": 'utf8',
         "options": "-c timezone=utc"
     }
-}
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 def check_db_connection():
@@ -69,269 +76,925 @@ def health_check():
         return jsonify({'status': 'healthy', 'database': 'connected'}), 200
     return jsonify({'status': 'unhealthy', 'database': 'disconnected'}), 503
 
+def _queue_gauges():
+    """Queue depth for /metrics, read from the jobs and job_shards tables."""
+    try:
+        jobs = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+        shards = dict(db.session.query(JobShard.status, func.count(JobShard.id))
+                      .group_by(JobShard.status).all())
+        pending_urls = db.session.query(
+            func.coalesce(func.sum(Job.total_urls - Job.checked_urls), 0)
+        ).filter(Job.status.in_([Job.QUEUED, Job.RUNNING])).scalar()
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error reading queue depth: {str(e)}")
+        return []
+    
+    return [
+        ('indexing_jobs', 'Jobs by status',
+         'status', {status: jobs.get(status, 0) for status in (Job.QUEUED, Job.RUNNING, Job.COMPLETED, Job.FAILED)}),
+        ('indexing_job_shards', 'Shards of jobs by status',
+         'status', {status: shards.get(status, 0) for status in (JobShard.QUEUED, JobShard.RUNNING, JobShard.COMPLETED)}),
+        ('indexing_pending_urls', 'URLs of queued and running jobs still to be checked',
+         'queue', {'jobs': pending_urls})
+    ]
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics of every process on this node (see metrics.py)"""
+    output = metrics.generate_latest(_queue_gauges)
+    if output is None:
+        return Response('prometheus_client is not installed\n', 503, mimetype='text/plain')
+    return Response(output, 200, {'Content-Type': metrics.CONTENT_TYPE})
 
 # Initialize the app with the extension
 db.init_app(app)
 
 # Import models and routes
-from models import URL, CheckResult, Report
+from models import URL, URLCounters, CheckResult, Report, Job, JobURL, JobShard
 from proxy_manager import ProxyManager
 from indexing_checker import IndexingChecker
 from report_generator import ReportGenerator
+from freshness_cache import FreshnessCache
+from report_stats import report_domain_stats, save_report_snapshot, get_report_snapshot
+from pagination import keyset_paginate
+import metrics
+from adaptive_batcher import AdaptiveBatcher
+from url_ingest import (normalize_url, url_host, is_allowed_upload, spool_upload, remove_spooled_file,
+                        iter_url_lines, iter_unique_urls, count_lines)
+from job_queue import (LEASE_SECONDS, LeaseLostError, make_worker_id, enqueue_job, claim_next_job,
+                       checkpoint_job, finish_job, fail_job, split_job, claim_next_shard,
+                       checkpoint_shard, add_job_progress, complete_job_if_done, record_shard_error,
+                       SHARD_MAX_ATTEMPTS, LeaseHeartbeat)
+
+# URLs checked within this many hours can be answered from the freshness cache
+FRESHNESS_TTL_HOURS = float(os.environ.get('FRESHNESS_TTL_HOURS', 24))
+FRESHNESS_CACHE_SIZE = int(os.environ.get('FRESHNESS_CACHE_SIZE', 100000))
 
 # Initialize components with demo mode settings
 proxy_manager = ProxyManager(use_direct_connection=True)
-indexing_checker = IndexingChecker(proxy_manager, demo_mode=True)
+freshness_cache = FreshnessCache(FRESHNESS_TTL_HOURS * 3600, FRESHNESS_CACHE_SIZE)
+indexing_checker = IndexingChecker(proxy_manager, demo_mode=True, freshness_cache=freshness_cache)
 report_generator = ReportGenerator()
 
-# Shared state for tracking background process progress
-# since we can't directly access Flask session in background threads
-background_process_state = {
-    'total_urls': 0,
-    'processed_urls': 0,
-    'is_processing': False
-}
+# Upload and submission limits
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024  # 100MB limit for file uploads
+MAX_URLS = 1000000  # Very high limit for URL checking (1 million)
+LARGE_DATASET_THRESHOLD = 10000  # Larger submissions are processed in the background
 
-# Utility function to sanitize URLs
-def sanitize_url(url_str):
+# Uploads for background jobs are kept here until the job finishes; with
+# workers on several hosts this must be shared storage
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', os.path.join(app.instance_path, 'uploads'))
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Run a job worker thread inside each web process unless workers run separately
+EMBEDDED_WORKER = os.environ.get('EMBEDDED_WORKER', '1') == '1'
+WORKER_POLL_SECONDS = 5
+
+# Progress event stream: how often the job row is polled, how long one
+# stream lasts before the browser reconnects, and the reconnect delay
+SSE_POLL_SECONDS = 1
+SSE_MAX_SECONDS = 300
+SSE_RETRY_MS = 3000
+SSE_KEEPALIVE_SECONDS = 15
+# Open streams per process; each holds a Gunicorn thread, so this leaves
+# the others to normal requests. Pages over the limit poll instead.
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 4))
+event_stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+# Throughput is measured over this trailing window
+RATE_WINDOW_SECONDS = 30
+
+# Bounds for the adaptive batch sizes of the storage and checking phases,
+# the commit duration they aim to stay under, and the resident memory
+# above which batches shrink
+BATCH_MIN_SIZE = int(os.environ.get('BATCH_MIN_SIZE', 100))
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 20000))
+BATCH_COMMIT_SECONDS = float(os.environ.get('BATCH_COMMIT_SECONDS', 1.0))
+BATCH_MAX_RSS_MB = int(os.environ.get('BATCH_MAX_RSS_MB', 1024))
+
+# Each phase converges on its own batch size, shared by all its callers in
+# this process. A checked batch must also finish well within a shard lease.
+storage_batcher = AdaptiveBatcher('storage', 1000, BATCH_MIN_SIZE, BATCH_MAX_SIZE,
+                                  target_commit_seconds=BATCH_COMMIT_SECONDS,
+                                  max_rss_bytes=BATCH_MAX_RSS_MB * 1024 * 1024)
+check_batcher = AdaptiveBatcher('check', 1000, BATCH_MIN_SIZE, BATCH_MAX_SIZE,
+                                target_commit_seconds=BATCH_COMMIT_SECONDS,
+                                max_batch_seconds=LEASE_SECONDS / 4,
+                                max_rss_bytes=BATCH_MAX_RSS_MB * 1024 * 1024)
+
+# Maximum number of bound parameters per IN lookup (older SQLite builds cap at 999)
+LOOKUP_CHUNK_SIZE = 500
+
+def _lookup_url_ids(url_strs):
     """
-    Sanitize a URL string to prevent encoding issues.
+    Resolve URL strings to their database ids with chunked IN lookups.
     
     Args:
-        url_str: The URL string to sanitize
-        
+        url_strs: List of URL strings already present in the database
+    
     Returns:
-        Sanitized URL string or None if the URL has encoding issues
+        Dictionary mapping URL strings to ids
     """
-    try:
-        # Skip empty URLs
-        if not url_str or not url_str.strip():
-            return None
-            
-        # Basic sanitization
-        sanitized_url = url_str.strip()
-        
-        # Test that URL can be properly encoded/decoded
-        sanitized_url.encode('utf-8').decode('utf-8')
-        
-        return sanitized_url
-    except (UnicodeError, UnicodeDecodeError, UnicodeEncodeError) as e:
-        # Log URLs with encoding issues
-        logger.warning(f"URL encoding issue: {repr(url_str)[:100]}... Error: {str(e)}")
-        return None
+    url_ids = {}
+    for i in range(0, len(url_strs), LOOKUP_CHUNK_SIZE):
+        chunk = url_strs[i:i+LOOKUP_CHUNK_SIZE]
+        rows = db.session.execute(
+            select(URL.url, URL.id).where(URL.url.in_(chunk))
+        )
+        url_ids.update(rows.tuples().all())
+    return url_ids
+
+def add_url_counters(**deltas):
+    """
+    Add to the global URL counters (total_urls, indexed, not_indexed,
+    never_checked), as part of the caller's transaction. The increments
+    happen in the database, so concurrent batches do not overwrite each
+    other.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    counters = URLCounters.__table__
+    db.session.execute(
+        counters.update()
+        .where(counters.c.id == URLCounters.SINGLETON_ID)
+        .values(updated_at=datetime.utcnow(),
+                **{name: counters.c[name] + delta for name, delta in deltas.items()})
+    )
+
+def _count_latest_states(url_ids):
+    """
+    Count URLs by their current latest check state, locking their rows
+    (where the database supports it) until the caller commits, so a
+    concurrent batch cannot count the same transition twice. The lock is
+    FOR NO KEY UPDATE, which does not conflict with the key-share locks
+    that inserts referencing the URLs take.
+    
+    Args:
+        url_ids: Sorted list of URL ids
+    
+    Returns:
+        Dictionary mapping last_is_indexed (True, False or None) to a count
+    """
+    counts = {}
+    for i in range(0, len(url_ids), LOOKUP_CHUNK_SIZE):
+        chunk = url_ids[i:i+LOOKUP_CHUNK_SIZE]
+        states = db.session.execute(
+            select(URL.last_is_indexed).where(URL.id.in_(chunk)).order_by(URL.id)
+            .with_for_update(key_share=True)
+        ).scalars()
+        for state in states:
+            counts[state] = counts.get(state, 0) + 1
+    return counts
+
+def read_url_counters():
+    """
+    The global URL counters as a dictionary. If the counters row is
+    missing, the counts are aggregated from urls instead.
+    """
+    counters = db.session.get(URLCounters, URLCounters.SINGLETON_ID)
+    if counters is not None:
+        return {
+            'total_urls': counters.total_urls,
+            'indexed': counters.indexed,
+            'not_indexed': counters.not_indexed,
+            'never_checked': counters.never_checked
+        }
+    
+    logger.warning("url_counters row is missing; counting URLs instead")
+    total, indexed, not_indexed = db.session.execute(
+        select(func.count(URL.id),
+               func.sum(case((URL.last_is_indexed.is_(True), 1), else_=0)),
+               func.sum(case((URL.last_is_indexed.is_(False), 1), else_=0)))
+    ).one()
+    indexed, not_indexed = indexed or 0, not_indexed or 0
+    return {
+        'total_urls': total,
+        'indexed': indexed,
+        'not_indexed': not_indexed,
+        'never_checked': total - indexed - not_indexed
+    }
+
+def _load_fresh_results(url_strs, fresh_after):
+    """
+    Database tier of the freshness cache: read the latest result of each
+    URL from the materialized columns on URL.
+    
+    Args:
+        url_strs: URL strings as submitted
+        fresh_after: Only results checked at or after this time are returned
+    
+    Returns:
+        Dictionary mapping URL strings to (is_indexed, checked_at)
+    """
+    url_strs = list(url_strs)
+    fresh = {}
+    for i in range(0, len(url_strs), LOOKUP_CHUNK_SIZE):
+        chunk = url_strs[i:i+LOOKUP_CHUNK_SIZE]
+        rows = db.session.execute(
+            select(URL.url, URL.last_is_indexed, URL.last_checked_at)
+            .where(URL.url.in_(chunk), URL.last_checked_at >= fresh_after)
+        )
+        for url_str, is_indexed, checked_at in rows:
+            fresh[url_str] = (is_indexed, checked_at)
+    return fresh
+
+freshness_cache.loader = _load_fresh_results
+
+def _bulk_upsert_urls(url_strs):
+    """
+    Insert a batch of URLs, skipping ones that already exist, and resolve
+    the ids of the whole batch with set-based statements.
+    
+    Args:
+        url_strs: List of unique, sanitized URL strings
+    
+    Returns:
+        Tuple of (dictionary mapping URL strings to ids, number of new URLs)
+    """
+    table = URL.__table__
+    now = datetime.utcnow()
+    rows = [{'url': url_str, 'host': url_host(url_str), 'created_at': now} for url_str in url_strs]
+    dialect = db.engine.dialect.name
+    
+    if dialect == 'postgresql':
+        # ON CONFLICT DO NOTHING RETURNING only returns the rows it inserted,
+        # so ids of pre-existing URLs are fetched with a follow-up IN lookup
+        stmt = pg_insert(table).on_conflict_do_nothing(index_elements=['url']) \
+            .returning(table.c.url, table.c.id)
+        url_ids = dict(db.session.execute(stmt, rows).tuples().all())
+        new_count = len(url_ids)
+        missing = [url_str for url_str in url_strs if url_str not in url_ids]
+        if missing:
+            url_ids.update(_lookup_url_ids(missing))
+    elif dialect == 'sqlite':
+        result = db.session.execute(table.insert().prefix_with('OR IGNORE'), rows)
+        new_count = result.rowcount
+        url_ids = _lookup_url_ids(url_strs)
+    else:
+        # Generic fallback: look up existing URLs, then insert the rest
+        url_ids = _lookup_url_ids(url_strs)
+        new_rows = [row for row in rows if row['url'] not in url_ids]
+        if new_rows:
+            db.session.execute(table.insert(), new_rows)
+            url_ids.update(_lookup_url_ids([row['url'] for row in new_rows]))
+        new_count = len(new_rows)
+    
+    # New URLs have not been checked yet
+    add_url_counters(total_urls=new_count, never_checked=new_count)
+    
+    # Keep the caller's ordering
+    return {url_str: url_ids[url_str] for url_str in url_strs if url_str in url_ids}, new_count
 
 # Utility function to store URLs in database with sanitization
-def store_urls_in_database(urls, batch_size=1000):
+def store_urls_in_database(urls, batch_size=None):
     """
     Store URLs in the database after sanitization.
     Skip any URLs with encoding issues.
     
+    Each batch is written with a bulk insert that ignores existing URLs,
+    followed by a set-based id lookup, instead of one query per URL.
+    
     Args:
-        urls: List of URLs to store
-        batch_size: Number of URLs to process in each batch
-        
+        urls: Iterable of URLs to store (consumed lazily, one batch at a time)
+        batch_size: Fixed number of URLs per batch; by default the storage
+            phase's adaptive batch size is used
+    
     Returns:
-        List of successfully stored URL objects
+        Dictionary mapping each stored URL string to its database id
     """
-    stored_urls = []
-    new_urls = []
+    url_ids = {}
+    url_iter = iter(urls)
     
-    for i in range(0, len(urls), batch_size):
-        batch = urls[i:i+batch_size]
+    while True:
+        batch = list(islice(url_iter, batch_size or storage_batcher.size))
+        if not batch:
+            break
         
-        # Process this batch with proper URL sanitization
-        for url_str in batch:
-            # Apply sanitization to handle encoding issues
-            sanitized_url = sanitize_url(url_str)
-            if not sanitized_url:
-                continue  # Skip invalid URLs
-                
-            # Check if URL already exists
-            url = URL.query.filter_by(url=sanitized_url).first()
-            if not url:
-                url = URL(url=sanitized_url)
-                db.session.add(url)
-                new_urls.append(url)
-            
-            stored_urls.append(url)
+        # Sanitize and canonicalize, skipping invalid and duplicate URLs
+        normalized = (normalize_url(url_str) for url_str in batch)
+        unique_urls = [url_str for url_str in dict.fromkeys(normalized)
+                       if url_str and url_str not in url_ids]
+        if not unique_urls:
+            continue
+        
+        started = time.monotonic()
+        batch_ids, new_count = _bulk_upsert_urls(unique_urls)
+        url_ids.update(batch_ids)
         
         # Commit this batch to avoid large transactions
-        if new_urls:
-            db.session.commit()
-            logger.debug(f"Added batch of {len(new_urls)} new URLs to the database")
-            new_urls = []
+        db.session.commit()
+        elapsed = time.monotonic() - started
+        metrics.observe_db_batch('store_urls', len(unique_urls), elapsed)
+        if batch_size is None:
+            storage_batcher.record(len(batch), elapsed)
+        logger.debug(f"Stored batch of {len(batch_ids)} URLs ({new_count} new)")
     
-    return stored_urls
+    return url_ids
 
-# Function to process URLs in a background thread
-def process_url_dataset(urls, batch_size):
+def create_report(total_urls):
     """
-    Process a large URL dataset in batches using the indexing checker.
-    This function is intended to be run in a background thread for large datasets.
+    Create the report for a check run up front, so each result can be
+    linked to the run that produced it. The report is added as part of
+    the caller's transaction (the caller commits).
     
     Args:
-        urls: List of URLs to process
-        batch_size: Number of URLs to process in each batch
-    """
-    global background_process_state
+        total_urls: Number of URLs submitted for the run
     
+    Returns:
+        The new Report, flushed so that it has an id
+    """
+    now = datetime.utcnow()
+    report = Report(
+        name=f"Report {now.strftime('%Y-%m-%d %H:%M:%S')}",
+        created_at=now,
+        total_urls=total_urls,
+        indexed_urls=0,
+        cache_hits=0
+    )
+    db.session.add(report)
+    db.session.flush()
+    return report
+
+def store_report_snapshot(report_id):
+    """
+    Snapshot the aggregates of a finished report (see report_stats). A
+    failure is only logged: the report is then aggregated when viewed.
+    """
     try:
-        # Set initial state
-        background_process_state['total_urls'] = len(urls)
-        background_process_state['processed_urls'] = 0
-        background_process_state['is_processing'] = True
+        save_report_snapshot(report_id)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Could not store snapshot of report {report_id}: {str(e)}")
+
+def save_check_results(url_batch, batch_results, report_id, cached_urls=None):
+    """
+    Persist a batch of check results with one bulk insert, keyed by the URL
+    ids resolved at ingest instead of re-querying each URL.
+    
+    Args:
+        url_batch: List of (url string, url id) pairs that were checked
+        batch_results: Dictionary returned by IndexingChecker.check_urls;
+            URLs missing from it (blocked or failed checks) are not saved
+        report_id: Id of the report (check run) the results belong to
+        cached_urls: URL strings answered from the freshness cache
+    
+    Returns:
+        Number of URLs in the batch found to be indexed
+    
+    The latest-result columns on URL are updated in the same transaction,
+    so read paths never need a per-URL "latest CheckResult" query. Cached
+    results leave them alone, so a URL's freshness still dates from the
+    query that actually checked it.
+    
+    The global URL counters are updated last, and callers should commit
+    soon after: every saving worker updates that one row, so it is locked
+    for as short a time as possible.
+    """
+    cached_urls = cached_urls or set()
+    checked_at = datetime.utcnow()
+    rows = []
+    for url_str, url_id in url_batch:
+        # check_urls keys results by the URL with a scheme added
+        is_indexed = batch_results.get(indexing_checker.prepare_url(url_str))
+        if is_indexed is None:
+            continue
+        rows.append({
+            'url_id': url_id,
+            'is_indexed': is_indexed,
+            'checked_at': checked_at,
+            'report_id': report_id,
+            'cached': url_str in cached_urls
+        })
+    
+    # Lock the checked URLs in id order and read their old state before
+    # inserting results: the foreign keys of the inserts take key-share
+    # locks on the same rows, so locking after them would let two
+    # overlapping batches deadlock
+    checked_rows = [row for row in rows if not row['cached']]
+    if checked_rows:
+        new_states = {row['url_id']: row['is_indexed'] for row in checked_rows}
+        old_counts = _count_latest_states(sorted(new_states))
+    
+    if rows:
+        results_table = CheckResult.__table__
+        inserted = db.session.execute(
+            results_table.insert().returning(results_table.c.id, results_table.c.url_id),
+            rows
+        ).tuples().all()
+        
+        # Point each URL at the result just written for it
+        latest_ids = {url_id: result_id for result_id, url_id in inserted}
+    
+    if checked_rows:
+        urls_table = URL.__table__
+        db.session.execute(
+            urls_table.update()
+            .where(urls_table.c.id == bindparam('b_url_id'))
+            .values(
+                last_is_indexed=bindparam('b_is_indexed'),
+                last_checked_at=bindparam('b_checked_at'),
+                latest_result_id=bindparam('b_result_id')
+            ),
+            [{
+                'b_url_id': row['url_id'],
+                'b_is_indexed': row['is_indexed'],
+                'b_checked_at': row['checked_at'],
+                'b_result_id': latest_ids[row['url_id']]
+            } for row in checked_rows]
+        )
+        
+        # Move each URL between the global counters by its old and new state
+        indexed_now = sum(1 for is_indexed in new_states.values() if is_indexed)
+        add_url_counters(
+            indexed=indexed_now - old_counts.get(True, 0),
+            not_indexed=len(new_states) - indexed_now - old_counts.get(False, 0),
+            never_checked=-old_counts.get(None, 0)
+        )
+    
+    return sum(1 for row in rows if row['is_indexed'])
+
+def _iter_job_urls(job):
+    """
+    Replay a job's source as a stream of sanitized, de-duplicated URLs.
+    The stream is deterministic, so a resumed job can skip what it stored.
+    """
+    file_lines = iter_url_lines(job.source_path) if job.source_path else ()
+    text_lines = (job.source_text or '').splitlines()
+    return islice(iter_unique_urls(chain(file_lines, text_lines)), MAX_URLS)
+
+def _store_job_urls(job, worker_id):
+    """
+    Storage phase: upsert the job's URLs and record them as job URLs, one
+    committed batch (and checkpoint) at a time, sized by storage_batcher.
+    
+    Returns:
+        Number of URLs stored for the job
+    """
+    stored = job.stored_urls or 0
+    
+    # Skip everything stored before a restart
+    url_stream = islice(_iter_job_urls(job), stored, None)
+    
+    while True:
+        batch = list(islice(url_stream, storage_batcher.size))
+        if not batch:
+            break
         
-        logger.info(f"Background processing started for {len(urls)} URLs")
+        started = time.monotonic()
+        batch_ids, new_count = _bulk_upsert_urls(batch)
+        db.session.execute(JobURL.__table__.insert(), [
+            {'job_id': job.id, 'position': stored + offset, 'url_id': url_id}
+            for offset, url_id in enumerate(batch_ids.values())
+        ])
+        stored += len(batch)
+        
+        # The checkpoint commits together with the batch
+        checkpoint_job(job.id, worker_id, stored_urls=stored, total_urls=max(stored, job.total_urls or 0))
+        db.session.commit()
+        elapsed = time.monotonic() - started
+        metrics.observe_db_batch('store_urls', len(batch), elapsed)
+        metrics.record_memory()
+        storage_batcher.record(len(batch), elapsed)
+        logger.debug(f"Job {job.id}: stored {stored} URLs ({new_count} new in this batch)")
+    
+    checkpoint_job(job.id, worker_id, stored_urls=stored, total_urls=stored, storage_complete=True)
+    db.session.commit()
+    return stored
+
+# Function to process URLs for a queued job
+def process_url_dataset(job_id, worker_id):
+    """
+    Run the storage phase of a large URL dataset job and split it into
+    shards for checking. This function is run by a job worker that holds
+    the job's lease.
+    
+    Storage commits a checkpoint with every batch, so a job picked up
+    again after a crash resumes from its last committed batch.
+    
+    Args:
+        job_id: Id of the claimed job
+        worker_id: Id of the worker holding the job's lease
+    """
+    job = db.session.get(Job, job_id)
+    
+    try:
+        logger.info(f"Processing job {job.id} (about {job.total_urls} URLs)")
         
-        # Store URLs in database with sanitization
-        stored_urls = store_urls_in_database(urls, batch_size)
+        # Storage phase
+        if not job.storage_complete:
+            total_urls = _store_job_urls(job, worker_id)
+            logger.debug(f"Job {job.id}: storage phase completed, {total_urls} valid URLs stored")
+        db.session.refresh(job)
         
-        # Update progress to 50% after storage phase
-        processed = len(urls) // 2
-        background_process_state['processed_urls'] = processed
-        logger.debug(f"Storage phase completed: {len(stored_urls)} valid URLs stored in database")
+        # Create the report up front so results from every shard are linked to this run;
+        # it is committed together with report_id, so a resumed job never makes a second one
+        if job.report_id is None:
+            report = create_report(job.total_urls)
+            checkpoint_job(job.id, worker_id, report_id=report.id)
+        split_job(job.id, worker_id, job.total_urls)
+        db.session.commit()
         
-        # Process URLs in batches to handle large numbers efficiently
-        all_results = {}
+        # A job without URLs has no shards to wait for
+        if complete_job_if_done(job.id):
+            remove_spooled_file(job.source_path)
+            store_report_snapshot(job.report_id)
+    
+    except LeaseLostError as e:
+        # Another worker resumed the job after our lease expired; leave it to them
+        db.session.rollback()
+        logger.warning(str(e))
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error in background URL processing for job {job_id}: {str(e)}")
+        try:
+            finish_job(job_id, worker_id, Job.FAILED, error=str(e))
+            remove_spooled_file(job.source_path)
+        except Exception as finish_error:
+            db.session.rollback()
+            logger.error(f"Could not mark job {job_id} as failed: {str(finish_error)}")
+
+def process_job_shard(shard_id, worker_id, checker=None):
+    """
+    Check the URLs of one job shard in batches. This function is run by a
+    job worker that holds the shard's lease; any number of workers can
+    check different shards of the same job at once.
+    
+    Every batch of results is committed together with the shard's
+    checkpoint, so a shard picked up again after a crash resumes from its
+    last committed batch. Batches are sized by check_batcher.
+    
+    URLs whose check was blocked or failed get no result and are not
+    counted as checked: the checkpoint stays at the first of them and the
+    next batch checks them again. A batch in which nothing could be
+    checked counts as a failed attempt.
+    
+    A failed attempt is rolled back and keeps its lease, so the shard is
+    retried from its checkpoint once the lease expires; the job only fails
+    after SHARD_MAX_ATTEMPTS attempts at the same shard.
+    
+    Args:
+        shard_id: Id of the claimed shard
+        worker_id: Id of the worker holding the shard's lease
+        checker: IndexingChecker to use (defaults to this process's checker)
+    """
+    checker = checker or indexing_checker
+    shard = db.session.get(JobShard, shard_id)
+    job = db.session.get(Job, shard.job_id)
+    
+    if shard.attempts > SHARD_MAX_ATTEMPTS:
+        logger.error(f"Giving up on job {job.id}: shard {shard.id} failed {shard.attempts - 1} times")
+        fail_job(job.id, shard.error or f"Shard {shard.id} failed {shard.attempts - 1} times")
+        remove_spooled_file(job.source_path)
+        return
+    
+    try:
+        position = shard.next_position
         
-        for i in range(0, len(urls), batch_size):
-            batch = urls[i:i+batch_size]
-            batch_results = indexing_checker.check_urls(batch)
-            all_results.update(batch_results)
+        while position < shard.end_position:
+            # URLs left unchecked hold the checkpoint back, so URLs after
+            # them may already have a result in this run
+            rows = db.session.execute(
+                select(JobURL.position, URL.url, URL.id)
+                .join(URL, URL.id == JobURL.url_id)
+                .where(JobURL.job_id == job.id,
+                       JobURL.position >= position,
+                       JobURL.position < shard.end_position,
+                       ~exists().where(CheckResult.report_id == job.report_id,
+                                       CheckResult.url_id == JobURL.url_id))
+                .order_by(JobURL.position)
+                .limit(check_batcher.size)
+            ).all()
+            if not rows:
+                break
             
-            # Save this batch of results to database
-            for url_str, is_indexed in batch_results.items():
-                url = URL.query.filter_by(url=url_str).first()
-                if url:
-                    result = CheckResult(
-                        url_id=url.id,
-                        is_indexed=is_indexed,
-                        checked_at=datetime.utcnow()
-                    )
-                    db.session.add(result)
+            batch_started = time.monotonic()
+            batch = [(row.url, row.id) for row in rows]
+            cached_urls = set()
+            # Checking takes as long as the rate limits make it, so the lease
+            # is kept alive meanwhile
+            with LeaseHeartbeat(shard.id, worker_id) as heartbeat:
+                batch_results = checker.check_urls([url_str for url_str, _ in batch],
+                                                   stale_only=job.recheck_stale_only,
+                                                   cached_urls=cached_urls)
             
-            # Commit after each batch
-            db.session.commit()
+            # Blocked and failed checks have no result; they are retried by
+            # the next batch, which starts at the first of them
+            unchecked = [row.position for row in rows if checker.prepare_url(row.url) not in batch_results]
+            checked = len(rows) - len(unchecked)
             
-            # Update progress in global state
-            # We're in the second phase, so we calculate progress from 50% to 100%
-            base_progress = len(urls) // 2  # 50% already done in storage phase
-            batch_progress = min(i + batch_size, len(urls)) // 2  # Up to another 50%
-            processed = base_progress + batch_progress
-            background_process_state['processed_urls'] = processed
+            # Save this batch of results and its checkpoint in one transaction
+            started = time.monotonic()
+            try:
+                if heartbeat.lost:
+                    raise LeaseLostError(f"Worker {worker_id} no longer holds shard {shard.id}")
+                if not checked:
+                    # Leave the shard to be retried once the lease expires
+                    raise RuntimeError(f"No URL of the batch at position {position} could be checked "
+                                       f"({len(unchecked)} blocked or failed)")
+                position = unchecked[0] if unchecked else rows[-1].position + 1
+                checkpoint_shard(shard.id, worker_id, next_position=position)
+                # The global counters are updated at the end of this, so the
+                # remaining statements only touch this job's own rows
+                indexed = save_check_results(batch, batch_results, job.report_id, cached_urls)
+                db.session.execute(
+                    Report.__table__.update()
+                    .where(Report.__table__.c.id == job.report_id)
+                    .values(indexed_urls=Report.__table__.c.indexed_urls + indexed,
+                            cache_hits=Report.__table__.c.cache_hits + len(cached_urls))
+                )
+                run_stats = checker.last_run_stats
+                add_job_progress(job.id, checked, indexed,
+                                 blocked=run_stats['blocked'], errors=run_stats['errors'])
+                db.session.commit()
+            except LeaseLostError:
+                # The lease was lost during the batch; record it so the next one is smaller
+                check_batcher.record(len(batch), time.monotonic() - batch_started)
+                raise
+            now = time.monotonic()
+            metrics.observe_db_batch('save_results', len(batch), now - started)
+            metrics.record_memory()
+            check_batcher.record(len(batch), now - batch_started, commit_seconds=now - started)
             
-            percent = (processed / len(urls)) * 100
-            logger.debug(f"Processing phase progress: {processed}/{len(urls)} URLs processed ({percent:.1f}%)")
+            logger.debug(f"Job {job.id}: shard {shard.id} checked up to position {position}/{shard.end_position}")
         
-        # Create a report
-        report = Report(
-            name=f"Report {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}",
-            created_at=datetime.utcnow(),
-            total_urls=len(urls),
-            indexed_urls=sum(1 for is_indexed in all_results.values() if is_indexed)
-        )
-        db.session.add(report)
+        checkpoint_shard(shard.id, worker_id, status=JobShard.COMPLETED, lease_expires_at=None)
         db.session.commit()
         
-        # Ensure progress shows 100% when complete
-        background_process_state['processed_urls'] = len(urls)
-        logger.info(f"Successfully processed {len(urls)} URLs in background")
+        # Whoever finishes the last shard completes the job
+        if complete_job_if_done(job.id):
+            remove_spooled_file(job.source_path)
+            store_report_snapshot(job.report_id)
+            logger.info(f"Successfully processed {job.total_urls} URLs for job {job.id}")
     
+    except LeaseLostError as e:
+        # Another worker resumed the shard after our lease expired; leave it to them
+        db.session.rollback()
+        logger.warning(str(e))
     except Exception as e:
-        logger.error(f"Error in background URL processing: {str(e)}")
-    finally:
-        # Make sure to update the state even in case of error
-        background_process_state['is_processing'] = False
+        # Keep the lease so the shard is retried after it expires
+        db.session.rollback()
+        logger.error(f"Error checking shard {shard_id} of job {job.id} "
+                     f"(attempt {shard.attempts}/{SHARD_MAX_ATTEMPTS}): {str(e)}")
+        try:
+            record_shard_error(shard_id, worker_id, str(e))
+        except Exception as record_error:
+            db.session.rollback()
+            logger.error(f"Could not record the error of shard {shard_id}: {str(record_error)}")
+
+def run_worker(worker_id=None, stop_event=None, poll_interval=WORKER_POLL_SECONDS, checker=None):
+    """
+    Claim and process job shards and queued jobs until stop_event is set.
+    Shards of jobs already being checked are preferred, so started jobs
+    finish first. Work whose worker died is picked up again once its lease
+    expires.
+    
+    Args:
+        worker_id: Id for this worker (generated if omitted)
+        stop_event: threading.Event that stops the loop when set
+        poll_interval: Seconds to wait when there is no work
+        checker: IndexingChecker to use (defaults to this process's checker)
+    """
+    worker_id = worker_id or make_worker_id()
+    logger.info(f"Job worker {worker_id} started")
+    
+    while not (stop_event and stop_event.is_set()):
+        found_work = False
+        try:
+            shard_id = claim_next_shard(worker_id)
+            if shard_id is not None:
+                found_work = True
+                process_job_shard(shard_id, worker_id, checker)
+            else:
+                job_id = claim_next_job(worker_id)
+                if job_id is not None:
+                    found_work = True
+                    process_url_dataset(job_id, worker_id)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Job worker error: {str(e)}")
+        finally:
+            db.session.remove()
+        
+        if not found_work:
+            if stop_event:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+def start_embedded_worker():
+    """Run a job worker on a daemon thread inside this process."""
+    
+    def worker_thread():
+        with app.app_context():
+            run_worker()
+    
+    thread = threading.Thread(target=worker_thread, name='job-worker', daemon=True)
+    thread.start()
+    return thread
 
 # Create database tables
 with app.app_context():
     db.create_all()
     logger.debug("Database tables created")
+    
+    # Bring existing tables up to date with the models
+    from migrations import run_migrations
+    run_migrations()
+
+if EMBEDDED_WORKER:
+    start_embedded_worker()
 
 # Routes
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def _get_progress_job():
+    """The job named by ?job_id=, or else the most recent active job."""
+    job_id = request.args.get('job_id', type=int)
+    if job_id is not None:
+        return db.session.get(Job, job_id)
+    return Job.query.filter(Job.status.in_([Job.QUEUED, Job.RUNNING])) \
+        .order_by(Job.id.desc()).first()
+
 @app.route('/processing')
 def processing():
     """Show processing status for large URL sets"""
-    global background_process_state
+    job = _get_progress_job()
     
-    # Check if there's an ongoing process
-    is_processing = background_process_state['is_processing']
-    total_urls = background_process_state['total_urls']
-    processed_urls = background_process_state['processed_urls']
+    # If there is no job or it is complete, redirect to results
+    if job is None or job.status == Job.COMPLETED:
+        return redirect(url_for('results'))
     
-    # Log the current state for debugging
-    logger.debug(f"Processing status: is_processing={is_processing}, total={total_urls}, processed={processed_urls}")
+    progress = _job_progress(job)
     
-    # If not processing or complete, redirect to results
-    if not is_processing and processed_urls >= total_urls and total_urls > 0:
-        return redirect(url_for('results'))
+    # Log the current state for debugging
+    logger.debug(f"Processing status: job={job.id} stage={progress['stage']}, total={progress['total']}, processed={progress['processed']}")
     
     return render_template('processing.html', 
-                          total_urls=total_urls,
-                          processed_urls=processed_urls)
+                          job=job,
+                          progress=progress)
 
-@app.route('/api/progress')
-def get_progress():
-    """AJAX endpoint for getting real-time progress updates"""
-    global background_process_state
+def _job_progress(job, checks_per_second=None):
+    """
+    Build the progress payload of a job.
+    
+    Args:
+        job: The Job
+        checks_per_second: Recent checking throughput; the average since
+            checking started is used when not given
+    
+    Returns:
+        Dictionary with per-stage counts, percentage, throughput, error and
+        block rates and the estimated seconds left (None when unknown)
+    """
+    total = job.total_urls or 0
+    stored = job.stored_urls or 0
+    checked = job.checked_urls or 0
+    stage = job.stage
     
-    total = background_process_state['total_urls']
-    processed = background_process_state['processed_urls']
-    is_processing = background_process_state['is_processing']
+    # The percentage is of the current stage: storing, then checking
+    if stage == 'completed':
+        processed = total
+    elif stage == 'checking':
+        processed = checked
+    else:
+        processed = stored
+    percentage = min(100.0, processed / total * 100) if total > 0 else 0
     
-    # Calculate percentage
-    percentage = (processed / total * 100) if total > 0 else 0
+    if checks_per_second is None and stage == 'checking' and job.check_started_at:
+        elapsed = (datetime.utcnow() - job.check_started_at).total_seconds()
+        checks_per_second = checked / elapsed if elapsed > 0 else None
     
-    # If processing complete, redirect to results page
-    done = False
-    if not is_processing and processed >= total and total > 0:
-        done = True
+    eta_seconds = None
+    if stage == 'checking' and checks_per_second:
+        eta_seconds = int(max(0, total - checked) / checks_per_second)
     
-    return jsonify({
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'stage': stage,
         'total': total,
+        'stored': stored,
+        'checked': checked,
+        'indexed': job.indexed_urls or 0,
         'processed': processed,
         'percentage': round(percentage, 1),
-        'is_processing': is_processing,
-        'done': done
+        'checks_per_second': round(checks_per_second, 1) if checks_per_second else None,
+        'error_rate': round((job.error_checks or 0) / checked * 100, 1) if checked else 0,
+        'block_rate': round((job.blocked_checks or 0) / checked * 100, 1) if checked else 0,
+        'eta_seconds': eta_seconds,
+        'is_processing': job.is_active,
+        'done': job.status == Job.COMPLETED,
+        'error': job.error
+    }
+
+@app.route('/api/progress')
+def get_progress():
+    """Progress snapshot for clients that cannot use the event stream"""
+    job = _get_progress_job()
+    if job is None:
+        return jsonify({'total': 0, 'processed': 0, 'percentage': 0,
+                        'is_processing': False, 'done': False, 'status': None})
+    
+    return jsonify(_job_progress(job))
+
+@app.route('/api/jobs/<int:job_id>/events')
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a job's progress.
+    
+    Every worker writes its progress to the job row, so this stream polls
+    that row server-side and pushes a "progress" event whenever it changes,
+    with a comment line as keepalive in between. A final "done" event is
+    sent once the job has completed or failed. Streams end after
+    SSE_MAX_SECONDS; EventSource reconnects by itself.
+    
+    At most SSE_MAX_STREAMS streams are open at once in a process; past
+    that the request gets a 503 and the page polls /api/progress instead.
+    """
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if not event_stream_slots.acquire(blocking=False):
+        retry_seconds = max(1, SSE_RETRY_MS // 1000)
+        return jsonify({'error': 'Too many open progress streams', 'retry': SSE_RETRY_MS}), 503, \
+            {'Retry-After': str(retry_seconds)}
+    
+    def generate():
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        samples = []
+        last_state = None
+        last_sent = time.monotonic()
+        
+        while time.monotonic() < deadline:
+            current = db.session.get(Job, job_id, populate_existing=True)
+            # End the read transaction so the next poll sees new commits
+            db.session.rollback()
+            if current is None:
+                break
+            
+            # Windowed throughput from (time, checked) samples
+            now = time.monotonic()
+            samples.append((now, current.checked_urls or 0))
+            while len(samples) > 2 and now - samples[0][0] > RATE_WINDOW_SECONDS:
+                samples.pop(0)
+            rate = None
+            if len(samples) > 1 and samples[-1][1] > samples[0][1]:
+                rate = (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+            
+            progress = _job_progress(current, rate)
+            state = (current.status, current.stored_urls, current.checked_urls, current.total_urls)
+            
+            if not current.is_active:
+                yield f"event: done\ndata: {json.dumps(progress)}\n\n"
+                return
+            if state != last_state:
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+                last_state = state
+                last_sent = now
+            elif now - last_sent >= SSE_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = now
+            
+            time.sleep(SSE_POLL_SECONDS)
+    
+    response = Response(stream_with_context(generate()), 200, {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        # Stop reverse proxies such as nginx from buffering the stream
+        'X-Accel-Buffering': 'no'
     })
+    # Called by the server once the stream is over or the client has gone
+    response.call_on_close(event_stream_slots.release)
+    return response
 
 @app.route('/check', methods=['POST'])
 def check_urls():
-    global background_process_state
-    
     # Configure app for large file uploads
-    app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB limit for file uploads
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
     
-    # Get URLs from either form textarea or uploaded file
-    urls = []
+    # Uploads are spooled to disk and parsed lazily instead of being read into memory
+    upload_path = None
     
     # Check if a file was uploaded - use a safer approach
     try:
         if request.files and 'url_file' in request.files:
             file = request.files['url_file']
             
-            # Check if it's a valid file with a name
-            if file and file.filename and (file.filename.endswith('.txt') or file.filename.endswith('.csv')):
+            # Check if it's a valid file with a name (.txt/.csv, optionally gzip-compressed)
+            if file and file.filename and is_allowed_upload(file.filename):
                 try:
-                    # Read file content as text with a smaller buffer size
-                    max_file_size = 100 * 1024 * 1024  # 100MB limit
-                    file_content = ""
-                    total_size = 0
-                    
-                    for chunk in iter(lambda: file.stream.read(8192).decode('utf-8', errors='ignore'), ""):
-                        total_size += len(chunk.encode('utf-8'))
-                        if total_size > max_file_size:
-                            flash('File size exceeds maximum limit of 100MB', 'danger')
-                            return redirect(url_for('index'))
-                        file_content += chunk
-                        
-                    file_urls = [url.strip() for url in file_content.split('\n') if url.strip()]
-                    urls.extend(file_urls)
-                    logger.info(f"Loaded {len(file_urls)} URLs from uploaded file {file.filename}")
+                    upload_path = spool_upload(file.stream, MAX_UPLOAD_BYTES, directory=UPLOAD_DIR)
+                    logger.info(f"Received uploaded file {file.filename}")
+                except ValueError as e:
+                    flash(str(e), 'danger')
+                    return redirect(url_for('index'))
                 except Exception as e:
                     logger.error(f"Error reading uploaded file: {str(e)}")
                     flash(f'Error reading file: {str(e)}', 'danger')
@@ -343,101 +1006,107 @@ def check_urls():
     
     # Also check the textarea for URLs
     urls_text = request.form.get('urls', '')
-    if urls_text:
-        textarea_urls = [url.strip() for url in urls_text.split('\n') if url.strip()]
-        urls.extend(textarea_urls)
-        logger.info(f"Added {len(textarea_urls)} URLs from form textarea")
+    textarea_lines = urls_text.splitlines()
+    
+    # Stream file lines and textarea lines through validation and de-duplication,
+    # capped at a very high limit for URL checking (1 million)
+    file_lines = iter_url_lines(upload_path) if upload_path else ()
+    url_stream = islice(iter_unique_urls(chain(file_lines, textarea_lines)), MAX_URLS)
+    
+    # Only the first part of the stream is read here; that is enough to tell
+    # small submissions (checked inline) from large ones (background)
+    try:
+        urls = list(islice(url_stream, LARGE_DATASET_THRESHOLD + 1))
+    except Exception as e:
+        remove_spooled_file(upload_path)
+        logger.error(f"Error reading uploaded file: {str(e)}")
+        flash(f'Error reading file: {str(e)}', 'danger')
+        return redirect(url_for('index'))
     
     # Make sure we have at least one URL
     if not urls:
+        remove_spooled_file(upload_path)
         flash('Please enter at least one URL to check or upload a file with URLs.', 'danger')
         return redirect(url_for('index'))
     
-    # Set a very high limit for URL checking (1 million)
-    max_urls = 1000000
-    
-    # Truncate if there are too many URLs
-    if len(urls) > max_urls:
-        urls = urls[:max_urls]
-        flash(f'Processing the first {max_urls} URLs.', 'warning')
-    
-    # Check if batch processing is enabled
-    batch_process = request.form.get('batch_process') == 'true'
-    
-    # Use larger batch size if batch processing is disabled
-    batch_size = 1000 if batch_process else 10000
+    # Optionally reuse results checked within the freshness TTL
+    stale_only = request.form.get('recheck_stale_only') == 'true'
     
-    # For large datasets, use background processing
-    is_large_dataset = len(urls) > 10000
+    # For large datasets, queue a background job
+    is_large_dataset = len(urls) > LARGE_DATASET_THRESHOLD
     if is_large_dataset:
-        # If already processing, don't start another job
-        if background_process_state['is_processing']:
-            flash('Another batch of URLs is currently being processed. Please wait for it to complete.', 'warning')
-            return redirect(url_for('processing'))
+        # Estimate the total from the line count, reading no further than the
+        # URL limit; the job sets the exact number once it has stored its URLs
+        estimated_total = len(textarea_lines)
+        if upload_path:
+            estimated_total += count_lines(upload_path, limit=MAX_URLS)
+        estimated_total = min(max(estimated_total, len(urls)), MAX_URLS)
+        
+        # The job re-reads its source itself, so it survives restarts of this process
+        try:
+            job = enqueue_job(estimated_total,
+                              source_path=upload_path,
+                              source_text=urls_text if textarea_lines else None,
+                              recheck_stale_only=stale_only)
+        except Exception as e:
+            remove_spooled_file(upload_path)
+            logger.error(f"Error queueing job: {str(e)}")
+            flash(f'Error queueing URLs: {str(e)}', 'danger')
+            return redirect(url_for('index'))
         
         # For large datasets, redirect to the processing page immediately
         # The actual processing will happen while the user watches the progress
-        logger.info(f"Starting to process {len(urls)} URLs in batches of {batch_size}")
-        flash(f'Processing {len(urls)} URLs. This may take some time for large datasets.', 'info')
-        
-        # Start processing in a background thread
-        def process_urls_background():
-            with app.app_context():
-                try:
-                    process_url_dataset(urls, batch_size)
-                except Exception as e:
-                    logger.error(f"Background processing error: {str(e)}")
-                
-        # Import threading only when needed
-        import threading
-        processing_thread = threading.Thread(target=process_urls_background)
-        processing_thread.daemon = True
-        processing_thread.start()
+        logger.info(f"Queued job {job.id} to process about {estimated_total} URLs")
+        flash(f'Processing about {estimated_total} URLs. This may take some time for large datasets.', 'info')
         
-        return redirect(url_for('processing'))
+        return redirect(url_for('processing', job_id=job.id))
+    
+    # The whole (small) submission has been read
+    remove_spooled_file(upload_path)
     
-    logger.info(f"Starting to process {len(urls)} URLs in batches of {batch_size}")
+    logger.info(f"Starting to process {len(urls)} URLs")
     flash(f'Processing {len(urls)} URLs. This may take some time for large datasets.', 'info')
     
     try:
         # Use our utility function to store URLs with sanitization
-        stored_urls = store_urls_in_database(urls, batch_size)
-        logger.debug(f"Added {len(stored_urls)} sanitized URLs to the database")
+        url_ids = store_urls_in_database(urls)
+        logger.debug(f"Added {len(url_ids)} sanitized URLs to the database")
         
-        # Process URLs in batches to handle large numbers efficiently
-        all_results = {}
+        # Create the report up front so results are linked to this run
+        report = create_report(len(url_ids))
+        db.session.commit()
+        
+        # Process URLs in batches sized by check_batcher, like job shards
+        url_items = list(url_ids.items())
         
-        for i in range(0, len(urls), batch_size):
-            batch = urls[i:i+batch_size]
-            batch_results = indexing_checker.check_urls(batch)
-            all_results.update(batch_results)
+        i = 0
+        while i < len(url_items):
+            batch = url_items[i:i+check_batcher.size]
+            batch_started = time.monotonic()
+            cached_urls = set()
+            batch_results = indexing_checker.check_urls([url_str for url_str, _ in batch],
+                                                        stale_only=stale_only,
+                                                        cached_urls=cached_urls)
             
             # Save this batch of results to database
-            for url_str, is_indexed in batch_results.items():
-                url = URL.query.filter_by(url=url_str).first()
-                if url:
-                    result = CheckResult(
-                        url_id=url.id,
-                        is_indexed=is_indexed,
-                        checked_at=datetime.utcnow()
-                    )
-                    db.session.add(result)
+            started = time.monotonic()
+            report.indexed_urls += save_check_results(batch, batch_results, report.id, cached_urls)
+            report.cache_hits += len(cached_urls)
             
             # Commit after each batch
             db.session.commit()
-            logger.debug(f"Saved batch of check results ({i+1}-{min(i+batch_size, len(urls))} of {len(urls)})")
+            now = time.monotonic()
+            metrics.observe_db_batch('save_results', len(batch), now - started)
+            check_batcher.record(len(batch), now - batch_started, commit_seconds=now - started)
+            i += len(batch)
+            logger.debug(f"Saved batch of check results ({i} of {len(url_items)})")
         
-        # Create a report
-        report = Report(
-            name=f"Report {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}",
-            created_at=datetime.utcnow(),
-            total_urls=len(urls),
-            indexed_urls=sum(1 for is_indexed in all_results.values() if is_indexed)
-        )
-        db.session.add(report)
-        db.session.commit()
+        store_report_snapshot(report.id)
         
-        flash(f'Successfully checked {len(urls)} URLs.', 'success')
+        if report.cache_hits:
+            flash(f'Successfully checked {len(urls)} URLs ({report.cache_hits} recently checked URLs were answered from cache).', 'success')
+        else:
+            flash(f'Successfully checked {len(urls)} URLs.', 'success')
         return redirect(url_for('results'))
     
     except Exception as e:
@@ -448,163 +1117,156 @@ def check_urls():
 @app.route('/results')
 def results():
     # Pagination parameters
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 100  # Show 100 results per page
     
-    # Get total count for pagination
-    total_urls = URL.query.count()
-    
-    # Get the URLs for this page with pagination
-    paginated_urls = URL.query.order_by(URL.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False)
-    
-    # Get the latest check results for the URLs on this page only
-    latest_results = []
-    for url in paginated_urls.items:
-        latest_result = CheckResult.query.filter_by(url_id=url.id).order_by(CheckResult.checked_at.desc()).first()
-        if latest_result:
-            latest_results.append({
-                'url': url.url,
-                'is_indexed': latest_result.is_indexed,
-                'checked_at': latest_result.checked_at
-            })
-    
-    # Calculate summary statistics
-    recent_results = CheckResult.query.join(URL).order_by(CheckResult.checked_at.desc()).limit(10000).all()
-    indexed_count = sum(1 for result in recent_results if result.is_indexed)
-    not_indexed_count = len(recent_results) - indexed_count
-    index_rate = (indexed_count / len(recent_results)) * 100 if recent_results else 0
+    # Summary of every URL by its latest check state, kept up to date as
+    # URLs and results are written
+    counters = read_url_counters()
+    
+    # Get the URLs for this page, newest first, by keyset pagination
+    paginated_urls = keyset_paginate(
+        select(URL.id, URL.created_at, URL.url, URL.last_is_indexed, URL.last_checked_at),
+        (URL.created_at, URL.id), cursor, per_page,
+        descending=True, total=counters['total_urls'])
     
+    # The latest check state is stored on each URL, so no per-URL query is needed
+    latest_results = [{
+        'url': url.url,
+        'is_indexed': url.last_is_indexed,
+        'checked_at': url.last_checked_at
+    } for url in paginated_urls.items if url.last_checked_at is not None]
+    
+    checked_count = counters['indexed'] + counters['not_indexed']
     stats = {
-        'total_urls': total_urls,
-        'indexed_count': indexed_count,
-        'not_indexed_count': not_indexed_count,
-        'index_rate': index_rate
+        'total_urls': counters['total_urls'],
+        'indexed_count': counters['indexed'],
+        'not_indexed_count': counters['not_indexed'],
+        'never_checked_count': counters['never_checked'],
+        'index_rate': (counters['indexed'] / checked_count * 100) if checked_count > 0 else 0
     }
     
     return render_template('results.html', 
                           results=latest_results, 
                           pagination=paginated_urls,
                           stats=stats,
-                          page=page)
+                          cursor=cursor)
 
 @app.route('/reports')
 def reports():
     all_reports = Report.query.order_by(Report.created_at.desc()).all()
     return render_template('reports.html', reports=all_reports)
 
+# Domains per page of a report's domain breakdown
+DOMAIN_STATS_PER_PAGE = 25
+
 @app.route('/reports/<int:report_id>')
 def report_detail(report_id):
     report = Report.query.get_or_404(report_id)
     
     # Pagination parameters
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 100  # Show 100 results per page
     
-    # Get URLs with pagination
-    urls = URL.query.order_by(URL.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False)
-    
-    # Get results for this report time period
-    # For simplicity, we'll get results checked around the report creation time
-    # In a real implementation, you'd associate results with specific reports
-    paginated_results = []
-    for url in urls.items:
-        result = CheckResult.query.filter_by(url_id=url.id).filter(
-            CheckResult.checked_at <= report.created_at
-        ).order_by(CheckResult.checked_at.desc()).first()
-        
-        if result:
-            paginated_results.append({
-                'url': url.url,
-                'is_indexed': result.is_indexed,
-                'checked_at': result.checked_at
-            })
-    
-    # For the report_data, we need to get all results
-    # This is used for calculating the overall statistics and charts
-    all_results = []
-    # Use a more efficient query to get the relevant results for statistics
-    result_stats = db.session.query(CheckResult.is_indexed, func.count(CheckResult.id)) \
-        .join(URL) \
-        .filter(CheckResult.checked_at <= report.created_at) \
-        .group_by(CheckResult.is_indexed) \
-        .all()
-    
-    # Build the statistics from the aggregated query results
-    indexed_count = 0
-    not_indexed_count = 0
-    for is_indexed, count in result_stats:
-        if is_indexed:
-            indexed_count = count
-        else:
-            not_indexed_count = count
+    # Overall statistics, charts and domains come from the report's snapshot
+    snapshot = get_report_snapshot(report)
     
-    total_count = indexed_count + not_indexed_count
+    # Get this report's results by keyset pagination; the URL is read in the same query
+    paginated = keyset_paginate(
+        select(CheckResult.id, CheckResult.checked_at, CheckResult.is_indexed, CheckResult.cached, URL.url)
+        .join(URL, URL.id == CheckResult.url_id)
+        .where(CheckResult.report_id == report.id),
+        (CheckResult.checked_at, CheckResult.id), cursor, per_page,
+        total=snapshot['total'])
+    
+    paginated_results = [{
+        'url': result.url,
+        'is_indexed': result.is_indexed,
+        'checked_at': result.checked_at,
+        'cached': result.cached
+    } for result in paginated.items]
     
-    # Create a stats dictionary for the template
     stats = {
-        'total_urls': total_count,
-        'indexed_count': indexed_count,
-        'not_indexed_count': not_indexed_count,
-        'index_rate': (indexed_count / total_count * 100) if total_count > 0 else 0
+        'total_urls': snapshot['total'],
+        'indexed_count': snapshot['indexed'],
+        'not_indexed_count': snapshot['not_indexed'],
+        'index_rate': snapshot['index_rate']
     }
     
+    # Domain breakdown of the whole report, paged separately from the results;
+    # pages past the domains kept in the snapshot are aggregated live
+    domain_page = max(1, request.args.get('domain_page', 1, type=int))
+    domain_offset = (domain_page - 1) * DOMAIN_STATS_PER_PAGE
+    domain_count = snapshot['domain_count']
+    if domain_offset + DOMAIN_STATS_PER_PAGE <= len(snapshot['domains']) or len(snapshot['domains']) == domain_count:
+        domain_rows = snapshot['domains'][domain_offset:domain_offset + DOMAIN_STATS_PER_PAGE]
+    else:
+        domain_rows, domain_count = report_domain_stats(report.id, limit=DOMAIN_STATS_PER_PAGE, offset=domain_offset)
+    domain_pages = -(-domain_count // DOMAIN_STATS_PER_PAGE)
+    
     # Generate detailed report data
-    report_data = report_generator.generate_report(report, paginated_results)
+    report_data = report_generator.generate_report(report, paginated_results, domain_rows)
     
     return render_template('report_detail.html', 
                           report=report, 
                           results=paginated_results, 
                           report_data=report_data,
-                          pagination=urls,
+                          pagination=paginated,
                           stats=stats,
-                          page=page)
+                          cursor=cursor,
+                          domain_count=domain_count,
+                          domain_page=domain_page,
+                          domain_pages=domain_pages,
+                          status_changes=snapshot['status_changes'],
+                          histogram=snapshot['checked_at_histogram'])
+
+# Rows buffered before a chunk of the CSV export is sent to the client
+EXPORT_CHUNK_ROWS = 1000
+
+def _iter_report_results(report_id):
+    """
+    Stream the check results of one report, indexed URLs first, reading
+    from a server-side cursor.
+    
+    Args:
+        report_id: Id of the report to export
+    
+    Yields:
+        Tuples of (url string, is_indexed, checked_at)
+    """
+    stmt = select(URL.url, CheckResult.is_indexed, CheckResult.checked_at) \
+        .join(URL, URL.id == CheckResult.url_id) \
+        .where(CheckResult.report_id == report_id) \
+        .order_by(CheckResult.is_indexed.desc(), CheckResult.id) \
+        .execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS)
+    
+    for row in db.session.execute(stmt):
+        yield row.url, row.is_indexed, row.checked_at
 
 @app.route('/export_report/<int:report_id>')
 def export_report(report_id):
-    from sqlalchemy import text
-    BATCH_SIZE = 1000
     try:
         # First verify database connection
         db.session.execute(text('SELECT 1'))
         db.session.commit()
         # Fetch the report
         report = Report.query.get_or_404(report_id)
-        
-        # Process URLs in batches
-        indexed_urls = []
-        not_indexed_urls = []
-        
-        # Get total URL count
-        total_urls = URL.query.count()
-        processed = 0
-        
-        while processed < total_urls:
-            urls_batch = URL.query.offset(processed).limit(BATCH_SIZE).all()
-            if not urls_batch:
-                break
-                
-            for url in urls_batch:
-                check_result = CheckResult.query.filter_by(url_id=url.id).order_by(CheckResult.checked_at.desc()).limit(1).first()
-                if check_result:
-                    url_data = [
-                        url.url,
-                        "Yes" if check_result.is_indexed else "No",
-                        check_result.checked_at.strftime('%Y-%m-%d %H:%M:%S')
-                    ]
-                    if check_result.is_indexed:
-                        indexed_urls.append(url_data)
-                    else:
-                        not_indexed_urls.append(url_data)
-            
-            processed += len(urls_batch)
-            db.session.expire_all()
-        
-        # Create a CSV string buffer
+    except Exception as e:
+        logger.error(f"Error exporting report: {str(e)}")
+        flash(f'Error exporting report: {str(e)}', 'danger')
+        return redirect(url_for('report_detail', report_id=report_id))
+    
+    def generate():
+        """Write the CSV in chunks as rows come off the cursor."""
         buffer = io.StringIO()
         writer = csv.writer(buffer)
         
+        def flush():
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            return data
+        
         # Add report header information
         writer.writerow([f"Report: {report.name}"])
         writer.writerow([f"Generated on: {report.created_at.strftime('%Y-%m-%d %H:%M:%S')}"])
@@ -613,71 +1275,37 @@ def export_report(report_id):
         
         # Add CSV headers
         writer.writerow(["URL", "Indexed", "Checked At"])
+        yield flush()
         
-        # To prevent encoding issues, we'll use a different query approach
-        # Fetch and process in small batches
-        
-        # Create the lists for indexed and non-indexed URLs
-        indexed_urls = []
-        not_indexed_urls = []
-        
-        # Process URLs and check results in small batches to avoid memory issues
-        # Get all URLs first
+        # Indexed URLs come first, so a section header is written whenever the status changes
+        current_section = None
+        rows_in_buffer = 0
         try:
-            urls = URL.query.all()
-            
-            for url in urls:
-                try:
-                    # Get the latest check result for this URL
-                    check_result = CheckResult.query.filter_by(url_id=url.id).order_by(CheckResult.checked_at.desc()).first()
-                    
-                    if check_result:
-                        # Basic data for the URL
-                        url_data = [
-                            url.url,
-                            "Yes" if check_result.is_indexed else "No",
-                            check_result.checked_at.strftime('%Y-%m-%d %H:%M:%S')
-                        ]
-                        
-                        # Separate indexed and non-indexed URLs
-                        if check_result.is_indexed:
-                            indexed_urls.append(url_data)
-                        else:
-                            not_indexed_urls.append(url_data)
-                except Exception as inner_e:
-                    # Log and continue if there's an issue with a specific URL
-                    logger.warning(f"Error processing URL ID {url.id}: {str(inner_e)}")
-                    continue
-                    
+            for url_str, is_indexed, checked_at in _iter_report_results(report.id):
+                if is_indexed != current_section:
+                    current_section = is_indexed
+                    writer.writerow([])  # Add spacing
+                    writer.writerow(["INDEXED URLS:" if is_indexed else "NOT INDEXED URLS:"])
+                
+                writer.writerow([
+                    url_str,
+                    "Yes" if is_indexed else "No",
+                    checked_at.strftime('%Y-%m-%d %H:%M:%S')
+                ])
+                rows_in_buffer += 1
+                
+                if rows_in_buffer >= EXPORT_CHUNK_ROWS:
+                    yield flush()
+                    rows_in_buffer = 0
         except Exception as e:
             logger.error(f"Error querying database: {str(e)}")
-            # If we encounter an error, add a message to the CSV
+            # The response has already started, so report the problem inside the CSV
             writer.writerow(["Error retrieving data from database. Some URLs may be missing."])
         
-        # Add indexed URLs section if any exist
-        if indexed_urls:
-            writer.writerow([])  # Add spacing
-            writer.writerow(["INDEXED URLS:"])
-            for url_data in indexed_urls:
-                writer.writerow(url_data)
-        
-        # Add non-indexed URLs section if any exist
-        if not_indexed_urls:
-            writer.writerow([])  # Add spacing
-            writer.writerow(["NOT INDEXED URLS:"])
-            for url_data in not_indexed_urls:
-                writer.writerow(url_data)
-                
-        # Get the completed CSV data
-        csv_data = buffer.getvalue()
-        
-        # Return the CSV data with appropriate headers
-        return csv_data, 200, {
-            'Content-Type': 'text/csv', 
-            'Content-Disposition': f'attachment; filename=report_{report_id}.csv'
-        }
-        
-    except Exception as e:
-        logger.error(f"Error exporting report: {str(e)}")
-        flash(f'Error exporting report: {str(e)}', 'danger')
-        return redirect(url_for('report_detail', report_id=report_id))
+        yield flush()
+    
+    # Stream the CSV so large exports start downloading immediately
+    return Response(stream_with_context(generate()), 200, {
+        'Content-Type': 'text/csv', 
+        'Content-Disposition': f'attachment; filename=report_{report_id}.csv'
+    })
@@ -0,0 +1,304 @@
+"""
+Local stand-ins for the search engine and HTTP proxies, so the benchmarks
+run offline and reproducibly.
+
+The fake search engine answers site: queries from a synthetic Corpus and
+the fake proxies forward requests to it; both add latency drawn from a
+log-normal distribution and inject faults (429s, CAPTCHA pages, hung
+connections) at configurable rates.
+"""
+import hashlib
+import http.client
+import logging
+import random
+import threading
+import time
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Fault kinds a server can inject
+RATE_LIMITED = 'rate_limited'
+CAPTCHA = 'captcha'
+TIMEOUT = 'timeout'
+SERVER_ERROR = 'server_error'
+
+CAPTCHA_PAGE = (
+    '<html><head><title>Sorry...</title></head><body>'
+    '<script src="https://www.google.com/recaptcha/api.js"></script>'
+    '<form id="captcha-form" action="/sorry/index"></form>'
+    '<p>Our systems have detected unusual traffic from your computer network.</p>'
+    '</body></html>'
+)
+
+class Corpus:
+    """
+    A deterministic set of benchmark URLs, spread over hosts with
+    urls_per_host pages each. Which URLs count as indexed depends only on
+    the URL and the seed, so every run sees the same answers.
+    """
+    
+    def __init__(self, size: int, urls_per_host: int = 50, indexed_ratio: float = 0.6,
+                 namespace: str = 'bench', seed: int = 0):
+        self.size = size
+        self.urls_per_host = max(1, urls_per_host)
+        self.indexed_ratio = indexed_ratio
+        self.namespace = namespace
+        self._key = str(seed).encode()
+    
+    def host(self, host_index: int) -> str:
+        return f'{self.namespace}-h{host_index}.example'
+    
+    def url(self, i: int) -> str:
+        page = i % self.urls_per_host
+        return f'https://{self.host(i // self.urls_per_host)}/section-{page % 5}/page-{page}'
+    
+    def __iter__(self) -> Iterator[str]:
+        return (self.url(i) for i in range(self.size))
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def is_indexed(self, url: str) -> bool:
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8, key=self._key).digest()
+        return int.from_bytes(digest, 'big') / 2 ** 64 < self.indexed_ratio
+    
+    def search(self, scope: str) -> List[str]:
+        """
+        Indexed URLs matching a site: scope (a host, optionally followed by
+        a path prefix, with or without scheme), in corpus order.
+        """
+        scope = scope.split('://', 1)[-1]
+        host, _, path = scope.partition('/')
+        prefix = f'https://{host}/{path}'
+        
+        # Hosts are named <namespace>-h<index>.example
+        try:
+            host_index = int(host[len(self.namespace) + 2:-len('.example')])
+        except ValueError:
+            return []
+        if host != self.host(host_index):
+            return []
+        
+        first = host_index * self.urls_per_host
+        urls = (self.url(i) for i in range(first, min(first + self.urls_per_host, self.size)))
+        return [url for url in urls if url.startswith(prefix) and self.is_indexed(url)]
+
+class ServerProfile:
+    """
+    Response behaviour of a fake server: log-normal latency around
+    median_ms, plus faults injected at the given rates (each between 0 and
+    1): 429s, CAPTCHA pages, hung requests (held for hang_seconds, then
+    dropped) and server errors (503 from the search engine, 502 from a
+    proxy).
+    """
+    
+    def __init__(self, median_ms: float = 20.0, sigma: float = 0.5, rate_limit_rate: float = 0.0,
+                 captcha_rate: float = 0.0, timeout_rate: float = 0.0, error_rate: float = 0.0,
+                 hang_seconds: float = 5.0, seed: int = 0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.faults = [(RATE_LIMITED, rate_limit_rate), (CAPTCHA, captcha_rate),
+                       (TIMEOUT, timeout_rate), (SERVER_ERROR, error_rate)]
+        self.hang_seconds = hang_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def sample(self) -> Tuple[float, Optional[str]]:
+        """Draw one request's delay in seconds and fault (None for a normal answer)."""
+        with self._lock:
+            delay = self.median_ms / 1000 * self._random.lognormvariate(0, self.sigma) if self.median_ms > 0 else 0.0
+            roll = self._random.random()
+        for fault, rate in self.faults:
+            if roll < rate:
+                return delay, fault
+            roll -= rate
+        return delay, None
+
+class _FakeServer:
+    """A threaded HTTP server on a free local port, run on a daemon thread."""
+    
+    handler_class = None
+    
+    def __init__(self, profile: Optional[ServerProfile] = None):
+        self.profile = profile or ServerProfile()
+        self.stats = {'requests': 0, RATE_LIMITED: 0, CAPTCHA: 0, TIMEOUT: 0, SERVER_ERROR: 0}
+        self._stats_lock = threading.Lock()
+        self._httpd = None
+    
+    def count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] += 1
+    
+    def start(self) -> '_FakeServer':
+        handler = type('Handler', (self.handler_class,), {'server_state': self})
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True,
+                         name=f'{type(self).__name__}-{self.port}').start()
+        return self
+    
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+    
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+    
+    @property
+    def address(self) -> str:
+        return f'127.0.0.1:{self.port}'
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_state = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def send_body(self, status: int, body: bytes, content_type: str = 'text/html; charset=utf-8') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def hang(self) -> None:
+        """Hold the connection without answering, then drop it."""
+        time.sleep(self.server_state.profile.hang_seconds)
+        self.close_connection = True
+
+class _SearchHandler(_QuietHandler):
+    def do_GET(self):
+        state = self.server_state
+        state.count('requests')
+        delay, fault = state.profile.sample()
+        time.sleep(delay)
+        
+        if fault == TIMEOUT:
+            state.count(TIMEOUT)
+            return self.hang()
+        if fault == SERVER_ERROR:
+            state.count(SERVER_ERROR)
+            return self.send_body(503, b'')
+        if fault == RATE_LIMITED:
+            state.count(RATE_LIMITED)
+            return self.send_body(429, b'')
+        if fault == CAPTCHA:
+            state.count(CAPTCHA)
+            return self.send_body(200, CAPTCHA_PAGE.encode())
+        
+        params = parse_qs(urlsplit(self.path).query)
+        query = params.get('q', [''])[0]
+        start = int(params.get('start', ['0'])[0])
+        num = state.page_size or int(params.get('num', ['10'])[0])
+        scope = query[len('site:'):] if query.startswith('site:') else ''
+        listing = state.listing(scope)
+        next_start = start + num if start + num < len(listing) else None
+        self.send_body(200, state.results_page(query, listing[start:start + num], next_start))
+
+class FakeSearchServer(_FakeServer):
+    """
+    Fake search engine answering /search?q=site:...&start=&num= from a
+    Corpus. Result pages carry page_bytes of filler before the results,
+    like the scripts and styles at the top of a real results page. Like a
+    real search engine, it lists at most max_listing results per query
+    when given, and serves page_size results per page whatever num asks
+    for when given.
+    """
+    
+    handler_class = _SearchHandler
+    
+    def __init__(self, corpus: Corpus, profile: Optional[ServerProfile] = None, page_bytes: int = 50000,
+                 max_listing: Optional[int] = None, page_size: Optional[int] = None):
+        super().__init__(profile)
+        self.corpus = corpus
+        self.page_bytes = page_bytes
+        self.max_listing = max_listing
+        self.page_size = page_size
+    
+    def listing(self, scope: str) -> List[str]:
+        """Results of a site: query, cut off at max_listing."""
+        return self.corpus.search(scope)[:self.max_listing]
+    
+    @property
+    def search_url(self) -> str:
+        return f'http://{self.address}/search'
+    
+    def results_page(self, query: str, urls: List[str], next_start: Optional[int] = None) -> bytes:
+        head = (f'<html><head><title>{escape(query)} - Search</title></head><body>'
+                f'<input name="q" value="{escape(query)}">')
+        filler = f'<script>/*{"x" * max(0, self.page_bytes - 20)}*/</script>'
+        # Alternate plain and redirect-wrapped links, as real result pages do
+        results = ''.join(
+            f'<div class="g"><a href="/url?q={quote(url)}&amp;sa=U">{escape(url)}</a></div>' if i % 2
+            else f'<div class="g"><a href="{escape(url)}">{escape(url)}</a></div>'
+            for i, url in enumerate(urls)
+        )
+        if next_start is not None:
+            results += f'<a id="pnnext" href="/search?q={quote(query)}&amp;start={next_start}">Next</a>'
+        return (head + filler + results + '</body></html>').encode()
+
+class _ProxyHandler(_QuietHandler):
+    def do_GET(self):
+        state = self.server_state
+        state.count('requests')
+        delay, fault = state.profile.sample()
+        time.sleep(delay)
+        
+        if fault == TIMEOUT:
+            state.count(TIMEOUT)
+            return self.hang()
+        if fault == SERVER_ERROR:
+            state.count(SERVER_ERROR)
+            return self.send_body(502, b'')
+        
+        # Requests for http:// URLs reach a proxy with the absolute URL as path
+        target = urlsplit(self.path)
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() not in ('proxy-connection', 'connection')}
+        try:
+            connection = http.client.HTTPConnection(target.hostname, target.port or 80,
+                                                    timeout=state.upstream_timeout)
+            path = target.path + (f'?{target.query}' if target.query else '')
+            connection.request('GET', path, headers=headers)
+            upstream = connection.getresponse()
+            body = upstream.read()
+            connection.close()
+        except (OSError, http.client.HTTPException):
+            return self.send_body(504, b'')
+        self.send_body(upstream.status, body, upstream.getheader('Content-Type', 'text/html'))
+
+class FakeProxyServer(_FakeServer):
+    """
+    Fake forward proxy for plain-HTTP targets. It adds its own latency and
+    faults (502s and hung connections) on top of the upstream's.
+    """
+    
+    handler_class = _ProxyHandler
+    
+    def __init__(self, profile: Optional[ServerProfile] = None, upstream_timeout: float = 30.0):
+        super().__init__(profile)
+        self.upstream_timeout = upstream_timeout
+
+def start_servers(corpus: Corpus, search_profile: ServerProfile, proxy_profiles: List[ServerProfile],
+                  page_bytes: int = 50000) -> Tuple[FakeSearchServer, List[FakeProxyServer]]:
+    """Start a fake search server and one fake proxy per profile."""
+    search = FakeSearchServer(corpus, search_profile, page_bytes).start()
+    proxies = [FakeProxyServer(profile).start() for profile in proxy_profiles]
+    logger.info(f"Fake search server on {search.address}, proxies on "
+                f"{', '.join(proxy.address for proxy in proxies) or 'none'}")
+    return search, proxies
+
+def collect_stats(search: FakeSearchServer, proxies: List[FakeProxyServer]) -> Dict[str, Dict[str, int]]:
+    """Request and fault counts of the fake servers."""
+    stats = {'search': dict(search.stats)}
+    for proxy in proxies:
+        stats[f'proxy {proxy.address}'] = dict(proxy.stats)
+    return stats
@@ -0,0 +1,352 @@
+"""
+Offline throughput benchmarks for the check pipeline.
+
+Runs the pipeline's hot paths against local fake search and proxy servers
+(see fake_servers.py) and a scratch database, at several dataset sizes,
+and writes the measurements as JSON so runs can be compared over time:
+
+    python -m benchmarks.run_benchmarks --sizes 10000 100000 --output bench.json
+
+Benchmarks: check_urls (real mode against the fake search engine),
+make_request, store_urls_in_database, process_url_dataset (storage, then
+checking every shard with the app's demo-mode checker) and export_report.
+The database benchmarks use a scratch SQLite file unless --database-url
+points them elsewhere.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Optional
+from urllib.parse import quote_plus
+
+from benchmarks.fake_servers import Corpus, ServerProfile, start_servers, collect_stats
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = ('check_urls', 'make_request', 'store_urls', 'process_url_dataset', 'export_report')
+DEFAULT_SIZES = (10000, 100000, 1000000)
+
+def _percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p90/p99/max of latency samples, in milliseconds."""
+    if not samples:
+        return {'p50_ms': None, 'p90_ms': None, 'p99_ms': None, 'max_ms': None}
+    ordered = sorted(samples)
+    
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 2)
+    
+    return {'p50_ms': pick(0.5), 'p90_ms': pick(0.9), 'p99_ms': pick(0.99),
+            'max_ms': round(ordered[-1] * 1000, 2)}
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class BenchmarkRunner:
+    """Runs the selected benchmarks against fake servers and a scratch database."""
+    
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+        # Reports created by process_url_dataset, reused by export_report
+        self.report_ids = {}
+        
+        from proxy_manager import ProxyManager
+        from rate_limiter import RateScheduler
+        self.ProxyManager = ProxyManager
+        self.RateScheduler = RateScheduler
+    
+    def _search_profile(self) -> ServerProfile:
+        args = self.args
+        return ServerProfile(args.latency_ms, args.latency_sigma, args.rate_limit_rate,
+                             args.captcha_rate, args.timeout_rate, args.error_rate,
+                             hang_seconds=args.request_timeout * 2, seed=args.seed)
+    
+    def _proxy_profiles(self) -> List[ServerProfile]:
+        args = self.args
+        return [ServerProfile(args.proxy_latency_ms, args.latency_sigma, timeout_rate=args.proxy_timeout_rate,
+                              error_rate=args.proxy_error_rate, hang_seconds=args.request_timeout * 2,
+                              seed=args.seed + i + 1)
+                for i in range(args.proxies)]
+    
+    def _proxy_manager(self, proxies):
+        """A ProxyManager routing through the fake proxies (direct if there are none)."""
+        args = self.args
+        manager = self.ProxyManager(
+            use_direct_connection=not proxies,
+            max_concurrent_per_proxy=max(1, args.concurrency // max(1, len(proxies))),
+            rate_scheduler=self.RateScheduler(global_rate=args.global_rate, per_proxy_rate=args.per_proxy_rate)
+        )
+        if proxies:
+            manager.default_proxies = [proxy.address for proxy in proxies]
+            manager.proxies = list(manager.default_proxies)
+        return manager
+    
+    def _record(self, benchmark: str, size: int, elapsed: float, items: int, **extra) -> None:
+        result = {
+            'benchmark': benchmark,
+            'size': size,
+            'elapsed_seconds': round(elapsed, 3),
+            'items_per_second': round(items / elapsed, 1) if elapsed > 0 else None
+        }
+        result.update(extra)
+        self.results.append(result)
+        logger.info(f"{benchmark} @ {size}: {elapsed:.2f}s ({result['items_per_second']}/s)")
+    
+    # Network benchmarks
+    
+    def bench_check_urls(self, size: int) -> None:
+        from indexing_checker import IndexingChecker
+        args = self.args
+        corpus = Corpus(size, args.urls_per_host, args.indexed_ratio, f'check{size}', args.seed)
+        search, proxies = start_servers(corpus, self._search_profile(), self._proxy_profiles(), args.page_bytes)
+        try:
+            checker = IndexingChecker(self._proxy_manager(proxies), demo_mode=False,
+                                      max_concurrency=args.concurrency, search_url=search.search_url,
+                                      grouped_queries=not args.no_grouped_queries,
+                                      request_timeout=args.request_timeout)
+            totals = {'search_requests': 0, 'blocked': 0, 'errors': 0}
+            correct = 0
+            started = time.monotonic()
+            for batch in _batched(corpus, args.batch_size or 1000):
+                results = checker.check_urls(batch)
+                correct += sum(1 for url in batch if results.get(url) == corpus.is_indexed(url))
+                for key in totals:
+                    totals[key] += checker.last_run_stats[key]
+            elapsed = time.monotonic() - started
+            self._record('check_urls', size, elapsed, size, accuracy=round(correct / size, 4),
+                         servers=collect_stats(search, proxies), **totals)
+        finally:
+            search.stop()
+            for proxy in proxies:
+                proxy.stop()
+    
+    def bench_make_request(self, size: int) -> None:
+        args = self.args
+        corpus = Corpus(size, args.urls_per_host, args.indexed_ratio, f'request{size}', args.seed)
+        search, proxies = start_servers(corpus, self._search_profile(), self._proxy_profiles(), args.page_bytes)
+        manager = self._proxy_manager(proxies)
+        outcomes = {'ok': 0, 'failed': 0}
+        
+        def one_request(url):
+            started = time.monotonic()
+            response = manager.make_request(f'{search.search_url}?q={quote_plus("site:" + url)}',
+                                            max_retries=args.max_retries, timeout=args.request_timeout)
+            latency = time.monotonic() - started
+            if response is None:
+                return latency, False
+            response.close()
+            return latency, True
+        
+        try:
+            latencies = []
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                # Submit in batches so a 1M run does not queue a million futures at once
+                for batch in _batched(corpus, args.batch_size or 1000):
+                    for latency, ok in executor.map(one_request, batch):
+                        latencies.append(latency)
+                        outcomes['ok' if ok else 'failed'] += 1
+            elapsed = time.monotonic() - started
+            self._record('make_request', size, elapsed, size, latency=_percentiles(latencies),
+                         outcomes=outcomes, servers=collect_stats(search, proxies))
+        finally:
+            search.stop()
+            for proxy in proxies:
+                proxy.stop()
+    
+    # Database benchmarks
+    
+    def bench_store_urls(self, size: int) -> None:
+        from app import app, store_urls_in_database, storage_batcher
+        args = self.args
+        corpus = Corpus(size, args.urls_per_host, args.indexed_ratio, f'store{size}', args.seed)
+        with app.app_context():
+            started = time.monotonic()
+            url_ids = store_urls_in_database(iter(corpus), args.batch_size)
+            elapsed = time.monotonic() - started
+        self._record('store_urls', size, elapsed, size, stored=len(url_ids),
+                     batch_size=args.batch_size or storage_batcher.size)
+    
+    def _run_dataset(self, size: int) -> Dict:
+        """Queue a job for a fresh corpus and run it to completion with one worker."""
+        import app as app_module
+        from app import app, db
+        from models import Job
+        from job_queue import enqueue_job, claim_next_job, claim_next_shard
+        args = self.args
+        corpus = Corpus(size, args.urls_per_host, args.indexed_ratio, f'dataset{size}', args.seed)
+        
+        with app.app_context():
+            # Spool the corpus like an upload (not timed)
+            fd, path = tempfile.mkstemp(prefix='urls-', suffix='.upload', dir=app_module.UPLOAD_DIR)
+            with os.fdopen(fd, 'w') as spool:
+                for url in corpus:
+                    spool.write(url + '\n')
+            
+            job = enqueue_job(size, source_path=path)
+            worker_id = 'benchmark'
+            job_id = claim_next_job(worker_id)
+            
+            started = time.monotonic()
+            app_module.process_url_dataset(job_id, worker_id)
+            storage_seconds = time.monotonic() - started
+            
+            shards = 0
+            started = time.monotonic()
+            while True:
+                shard_id = claim_next_shard(worker_id)
+                if shard_id is None:
+                    break
+                app_module.process_job_shard(shard_id, worker_id)
+                shards += 1
+            check_seconds = time.monotonic() - started
+            
+            job = db.session.get(Job, job.id, populate_existing=True)
+            result = {
+                'storage_seconds': storage_seconds,
+                'check_seconds': check_seconds,
+                'shards': shards,
+                'status': job.status,
+                'report_id': job.report_id
+            }
+            db.session.remove()
+        self.report_ids[size] = result['report_id']
+        return result
+    
+    def bench_process_url_dataset(self, size: int) -> None:
+        import app as app_module
+        result = self._run_dataset(size)
+        elapsed = result['storage_seconds'] + result['check_seconds']
+        self._record('process_url_dataset', size, elapsed, size,
+                     storage_seconds=round(result['storage_seconds'], 3),
+                     check_seconds=round(result['check_seconds'], 3),
+                     shards=result['shards'], status=result['status'],
+                     storage_batch_size=app_module.storage_batcher.size,
+                     check_batch_size=app_module.check_batcher.size)
+    
+    def bench_export_report(self, size: int) -> None:
+        from app import app
+        if size not in self.report_ids:
+            self._run_dataset(size)
+        report_id = self.report_ids[size]
+        
+        client = app.test_client()
+        started = time.monotonic()
+        response = client.get(f'/export_report/{report_id}', buffered=False)
+        exported_bytes = sum(len(chunk) for chunk in response.response)
+        elapsed = time.monotonic() - started
+        response.close()
+        self._record('export_report', size, elapsed, size, status_code=response.status_code,
+                     bytes=exported_bytes)
+    
+    def run(self, benchmarks: List[str], sizes: List[int]) -> List[Dict]:
+        for size in sizes:
+            for benchmark in benchmarks:
+                getattr(self, f'bench_{benchmark}')(size)
+        return self.results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the URL Indexing Checker')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS),
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES),
+                        help='Dataset sizes in URLs (default: 10000 100000 1000000)')
+    parser.add_argument('--output', default='benchmark-results.json',
+                        help="JSON file to write ('-' for stdout)")
+    parser.add_argument('--database-url', default=None,
+                        help='Database to benchmark against (default: a scratch SQLite file)')
+    
+    pipeline = parser.add_argument_group('pipeline')
+    pipeline.add_argument('--batch-size', type=int, default=None,
+                          help='Fixed batch size (default: adaptive for storage, 1000 for network benchmarks)')
+    pipeline.add_argument('--concurrency', type=int, default=16, help='Checks in flight at once')
+    pipeline.add_argument('--proxies', type=int, default=3, help='Fake proxies to route through (0 for direct)')
+    pipeline.add_argument('--global-rate', type=float, default=10000.0, help='Requests/sec for the rate scheduler')
+    pipeline.add_argument('--per-proxy-rate', type=float, default=5000.0)
+    pipeline.add_argument('--request-timeout', type=float, default=2.0, help='Seconds before a request times out')
+    pipeline.add_argument('--max-retries', type=int, default=3)
+    pipeline.add_argument('--no-grouped-queries', action='store_true', help='Check every URL with its own query')
+    
+    corpus = parser.add_argument_group('corpus')
+    corpus.add_argument('--urls-per-host', type=int, default=50)
+    corpus.add_argument('--indexed-ratio', type=float, default=0.6)
+    corpus.add_argument('--seed', type=int, default=0)
+    
+    search = parser.add_argument_group('fake search engine')
+    search.add_argument('--latency-ms', type=float, default=20.0, help='Median response latency')
+    search.add_argument('--latency-sigma', type=float, default=0.5, help='Spread of the log-normal latency')
+    search.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests answered with 429')
+    search.add_argument('--captcha-rate', type=float, default=0.0, help='Share of requests answered with a CAPTCHA page')
+    search.add_argument('--timeout-rate', type=float, default=0.0, help='Share of requests left hanging')
+    search.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 503')
+    search.add_argument('--page-bytes', type=int, default=50000, help='Filler bytes before the results')
+    
+    proxy = parser.add_argument_group('fake proxies')
+    proxy.add_argument('--proxy-latency-ms', type=float, default=2.0)
+    proxy.add_argument('--proxy-timeout-rate', type=float, default=0.0)
+    proxy.add_argument('--proxy-error-rate', type=float, default=0.0, help='Share of requests answered with 502')
+    
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scratch_dir = tempfile.mkdtemp(prefix='indexing-benchmark-')
+    
+    # The app reads its settings at import time
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(scratch_dir, "benchmark.db")}'
+    os.environ['EMBEDDED_WORKER'] = '0'
+    os.environ.setdefault('UPLOAD_DIR', os.path.join(scratch_dir, 'uploads'))
+    os.environ.setdefault('SESSION_SECRET', 'benchmark')
+    
+    # Only the benchmark summaries, not the app's per-batch logs
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    logger.setLevel(logging.INFO)
+    
+    started_at = datetime.utcnow()
+    results = BenchmarkRunner(args).run(args.benchmarks, args.sizes)
+    
+    output = {
+        'started_at': started_at.isoformat() + 'Z',
+        'finished_at': datetime.utcnow().isoformat() + 'Z',
+        'environment': {
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'database': os.environ['DATABASE_URL'].split(':', 1)[0]
+        },
+        # Only the database's kind, never its credentials
+        'config': dict(vars(args), database_url=os.environ['DATABASE_URL'].split(':', 1)[0]),
+        'results': results
+    }
+    text = json.dumps(output, indent=2)
+    if args.output == '-':
+        sys.stdout.write(text + '\n')
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        logger.info(f"Wrote {len(results)} results to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Loads stored results for URLs checked at or after a cutoff:
+# loader(urls, fresh_after) -> {url: (is_indexed, checked_at)}
+ResultLoader = Callable[[Iterable[str], datetime], Dict[str, Tuple[bool, datetime]]]
+
+class FreshnessCache:
+    """
+    Remembers recent check results so URLs checked within the TTL are not
+    queried again.
+    
+    Lookups go through two tiers: an in-process LRU of recent results, then
+    an optional loader that reads the latest stored results (e.g. from the
+    database) for the URLs the LRU does not know. Times are naive UTC, like
+    the checked_at columns.
+    """
+    
+    def __init__(self, ttl_seconds: float, max_entries: int = 100000,
+                 loader: Optional[ResultLoader] = None):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self.loader = loader
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # Lookup counters since startup
+        self.stats = {
+            'memory_hits': 0,
+            'loader_hits': 0,
+            'misses': 0
+        }
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl.total_seconds() > 0 and self.max_entries > 0
+    
+    def _remember(self, url: str, is_indexed: bool, checked_at: datetime) -> None:
+        """Add or refresh an LRU entry, evicting the oldest if full (lock held)."""
+        self._entries[url] = (is_indexed, checked_at)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def get_fresh(self, urls: Iterable[str]) -> Dict[str, bool]:
+        """
+        Look up the URLs that were checked within the TTL.
+        
+        Args:
+            urls: URLs to look up
+        
+        Returns:
+            Dictionary mapping each fresh URL to its indexing status;
+            URLs that are unknown or stale are left out
+        """
+        if not self.enabled:
+            return {}
+        
+        fresh_after = datetime.utcnow() - self.ttl
+        fresh = {}
+        missing = []
+        
+        with self._lock:
+            for url in urls:
+                entry = self._entries.get(url)
+                if entry is not None and entry[1] >= fresh_after:
+                    fresh[url] = entry[0]
+                    self._entries.move_to_end(url)
+                else:
+                    if entry is not None:
+                        del self._entries[url]
+                    missing.append(url)
+            self.stats['memory_hits'] += len(fresh)
+        
+        if missing and self.loader is not None:
+            try:
+                loaded = self.loader(missing, fresh_after)
+            except Exception as e:
+                logger.error(f"Error loading cached results: {str(e)}")
+                loaded = {}
+            
+            with self._lock:
+                for url, (is_indexed, checked_at) in loaded.items():
+                    if checked_at is not None and checked_at >= fresh_after:
+                        fresh[url] = is_indexed
+                        self._remember(url, is_indexed, checked_at)
+                        self.stats['loader_hits'] += 1
+        
+        with self._lock:
+            self.stats['misses'] += sum(1 for url in missing if url not in fresh)
+        
+        return fresh
+    
+    def put_many(self, results: Dict[str, bool], checked_at: Optional[datetime] = None) -> None:
+        """
+        Remember freshly checked results.
+        
+        Args:
+            results: Dictionary mapping URLs to their indexing status
+            checked_at: When the URLs were checked (now by default)
+        """
+        if not self.enabled:
+            return
+        
+        checked_at = checked_at or datetime.utcnow()
+        with self._lock:
+            for url, is_indexed in results.items():
+                self._remember(url, is_indexed, checked_at)
+    
+    def clear(self) -> None:
+        """Forget all in-process entries."""
+        with self._lock:
+            self._entries.clear()
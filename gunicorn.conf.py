@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for the web app.
+
+Every worker process keeps its own Prometheus metrics, so they are written
+to files in PROMETHEUS_MULTIPROC_DIR, which /metrics aggregates. The
+directory is set here, before the workers start, and cleared when the
+server starts; worker.py processes on the same machine can share it.
+"""
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Progress event streams hold a thread each (see SSE_MAX_STREAMS)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), 'indexing-checker-metrics'))
+
+def on_starting(server):
+    """Start from an empty metrics directory, dropping files of an earlier run."""
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that has exited."""
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -1,27 +1,71 @@
 import logging
+import os
 import time
 import re
 import requests
 import hashlib
-import random
-from typing import Dict, List, Tuple, Optional, Union
-from urllib.parse import quote_plus, urlparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional, Set, Union
+from urllib.parse import quote_plus
 from proxy_manager import ProxyManager
+from serp_parser import (SerpResult, parse_result_page, link_key,
+                         INDEXED, NOT_INDEXED, BLOCKED, ERROR)
+import metrics
+
+# Use try/except for numpy import in case it's not available
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 logger = logging.getLogger(__name__)
 
+# Demo-mode heuristics: popular domains and content words raise the
+# simulated likelihood that a URL is indexed
+POPULAR_DOMAINS = (
+    "example.com", "github.com", "wikipedia.org", "wordpress.com",
+    "blogspot.com", "medium.com", "amazon.com", "facebook.com",
+    "twitter.com", "linkedin.com", "google.com", "apple.com"
+)
+CONTENT_KEYWORDS = ("blog", "news", "article", "product", "about")
+
+# Precompiled once instead of scanning the lists for every URL
+_POPULAR_DOMAIN_RE = re.compile('|'.join(re.escape(domain) for domain in POPULAR_DOMAINS))
+_CONTENT_KEYWORD_RE = re.compile('|'.join(CONTENT_KEYWORDS))
+# Splits a URL into host and path without a full urlparse
+_URL_PARTS_RE = re.compile(r'^(?:[A-Za-z][A-Za-z0-9+.-]*:)?(?://([^/?#]*))?([^?#]*)')
+
 class IndexingChecker:
     """
     Checks if URLs are indexed on Google by making search requests.
     In demo mode, it simulates checking without making actual Google requests.
     """
     
-    def __init__(self, proxy_manager=None, demo_mode=True):
+    def __init__(self, proxy_manager=None, demo_mode=True, max_concurrency=16, freshness_cache=None,
+                 demo_seed=0, search_url="https://www.google.com/search", grouped_queries=True,
+                 group_min_urls=3, group_max_pages=10, results_per_page=100, request_timeout=10):
         # Always use direct connection in demo mode to avoid timeouts
         self.proxy_manager = proxy_manager or ProxyManager(use_direct_connection=True)
-        self.search_url = "https://www.google.com/search"
-        # Force demo mode to True to prevent actual Google queries which can be blocked
-        self.demo_mode = True
+        # Search endpoint; point it at a local stub server for testing
+        self.search_url = search_url
+        # Seconds to wait for the search engine before retrying a request
+        self.request_timeout = request_timeout
+        # Grouped mode: URLs sharing a domain are resolved with paginated
+        # site:domain queries, falling back to per-URL queries for the rest
+        self.grouped_queries = grouped_queries
+        self.group_min_urls = max(2, group_min_urls)
+        self.group_max_pages = max(1, group_max_pages)
+        self.results_per_page = results_per_page
+        # Demo mode is on by default to prevent actual Google queries which can be blocked
+        self.demo_mode = demo_mode
+        # Simulated results depend only on the URL and this seed, so runs are reproducible
+        self._demo_hasher = hashlib.blake2b(digest_size=8, key=str(demo_seed).encode())
+        # Global cap on checks in flight; the proxy manager caps each proxy separately
+        self.max_concurrency = max(1, max_concurrency)
+        # Optional FreshnessCache of recent results, keyed by URL as submitted
+        self.freshness_cache = freshness_cache
         self.user_agents = [
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15",
@@ -29,90 +73,157 @@ class IndexingChecker:
             "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36"
         ]
         self.current_user_agent_index = 0
+        self._user_agent_lock = threading.Lock()
+        
+        # Stats of the most recent check_urls call, kept per calling thread so
+        # concurrent callers (e.g. a job worker and a web request) each see their own
+        self._run_stats = threading.local()
+        self._search_requests = 0
+        self._search_requests_lock = threading.Lock()
         
         if self.demo_mode:
             logger.info("Running in demo mode (no actual Google queries)")
     
     def _get_next_user_agent(self) -> str:
         """Get the next user agent in rotation."""
-        agent = self.user_agents[self.current_user_agent_index]
-        self.current_user_agent_index = (self.current_user_agent_index + 1) % len(self.user_agents)
+        with self._user_agent_lock:
+            agent = self.user_agents[self.current_user_agent_index]
+            self.current_user_agent_index = (self.current_user_agent_index + 1) % len(self.user_agents)
         return agent
     
-    def _is_likely_indexed(self, url: str) -> bool:
+    @staticmethod
+    def prepare_url(url: str) -> str:
         """
-        In demo mode, determine if a URL is likely to be indexed based on 
-        heuristic factors. This simulates real indexing patterns.
-        
-        Args:
-            url: The URL to check
-            
-        Returns:
-            Simulated indexing status (True/False)
+        Returns the form of a URL that check_urls uses as its result key
+        (a scheme is added if missing). URLs canonicalized at ingest already
+        have a scheme, so for them the key is the stored URL itself.
         """
-        # Parse the URL
-        parsed_url = urlparse(url)
-        domain = parsed_url.netloc
-        path = parsed_url.path
-        
-        # Domain-based likelihood - popular domains are more likely to be indexed
-        popular_domains = [
-            "example.com", "github.com", "wikipedia.org", "wordpress.com", 
-            "blogspot.com", "medium.com", "amazon.com", "facebook.com",
-            "twitter.com", "linkedin.com", "google.com", "apple.com"
-        ]
-        
-        # Base likelihood 50%
-        likelihood = 50
-        
-        # Popular domains get a boost
-        if any(pop_domain in domain for pop_domain in popular_domains):
-            likelihood += 30
+        return url if url.startswith('http') else 'https://' + url
+    
+    @property
+    def last_run_stats(self) -> Dict[str, float]:
+        """
+        Stats of the calling thread's most recent check_urls call: URLs,
+        elapsed time, checks/sec, cache hits, search requests (counted
+        across all threads), blocked pages and failed checks.
+        """
+        return getattr(self._run_stats, 'stats', {
+            'total_urls': 0,
+            'elapsed_seconds': 0.0,
+            'checks_per_second': 0.0,
+            'cache_hits': 0,
+            'search_requests': 0,
+            'blocked': 0,
+            'errors': 0
+        })
+    
+    @property
+    def checks_per_second(self) -> float:
+        """Throughput of the most recent check_urls call."""
+        return self.last_run_stats['checks_per_second']
+    
+    def _demo_hashes(self, urls: List[str]) -> List[bytes]:
+        """Seeded 64-bit digests of the URLs, as raw little-endian bytes."""
+        hashes = []
+        for url in urls:
+            hasher = self._demo_hasher.copy()
+            hasher.update(url.encode())
+            hashes.append(hasher.digest())
+        return hashes
+    
+    def score_urls(self, urls: List[str]) -> List[bool]:
+        """
+        In demo mode, determine for a whole batch of URLs whether each is
+        likely to be indexed, based on heuristic factors that simulate real
+        indexing patterns:
         
-        # Homepage or short paths are more likely to be indexed
-        if path == "/" or path == "" or len(path) < 10:
-            likelihood += 20
-        elif len(path) > 50:  # Very long paths are less likely
-            likelihood -= 20
+        - base likelihood of 50%
+        - +30 for popular domains
+        - +20 for homepages and short paths, -20 for very long paths
+        - +15 for common content words in the path
+        - -20 for URLs with query parameters
+        - a pseudo-random -10..+10 adjustment and the final draw, both taken
+          from a seeded hash of the URL so the same URL always gets the same
+          result
         
-        # URLs with common content indicators
-        if any(word in path.lower() for word in ["blog", "news", "article", "product", "about"]):
-            likelihood += 15
+        The likelihood math runs on NumPy arrays when NumPy is available and
+        falls back to plain Python otherwise, with identical results.
         
-        # URLs with parameters are less likely to be indexed
-        if "?" in url:
-            likelihood -= 20
+        Args:
+            urls: The URLs to score
         
-        # Calculate pseudo-random but deterministic result based on URL
-        # This ensures the same URL always gets the same result
-        url_hash = int(hashlib.md5(url.encode()).hexdigest(), 16)
-        random_factor = (url_hash % 20) - 10  # -10 to +10 random adjustment
+        Returns:
+            Simulated indexing status for each URL, in input order
+        """
+        if not urls:
+            return []
         
-        final_likelihood = max(0, min(100, likelihood + random_factor))
-        is_indexed = random.randint(1, 100) <= final_likelihood
+        popular, short_path, long_path, has_keyword, has_query = [], [], [], [], []
+        for url in urls:
+            host, path = _URL_PARTS_RE.match(url).groups()
+            path_length = len(path)
+            popular.append(_POPULAR_DOMAIN_RE.search(host or '') is not None)
+            # Homepage or short paths are more likely to be indexed, very long paths less
+            short_path.append(path_length < 10)
+            long_path.append(path_length > 50)
+            has_keyword.append(_CONTENT_KEYWORD_RE.search(path.lower()) is not None)
+            has_query.append('?' in url)
+        hashes = self._demo_hashes(urls)
         
-        logger.debug(f"Demo mode: {url} has {final_likelihood}% indexing likelihood -> {'indexed' if is_indexed else 'not indexed'}")
+        if np is not None:
+            url_hash = np.frombuffer(b''.join(hashes), dtype='<u8')
+            likelihood = (50
+                          + 30 * np.array(popular, dtype=np.int64)
+                          + 20 * np.array(short_path, dtype=np.int64)
+                          - 20 * np.array(long_path, dtype=np.int64)
+                          + 15 * np.array(has_keyword, dtype=np.int64)
+                          - 20 * np.array(has_query, dtype=np.int64))
+            random_factor = (url_hash % 20).astype(np.int64) - 10
+            draw = ((url_hash // 20) % 100).astype(np.int64) + 1
+            final_likelihood = np.clip(likelihood + random_factor, 0, 100)
+            return (draw <= final_likelihood).tolist()
         
-        return is_indexed
+        results = []
+        for i, digest in enumerate(hashes):
+            url_hash = int.from_bytes(digest, 'little')
+            likelihood = (50 + 30 * popular[i] + 20 * short_path[i] - 20 * long_path[i]
+                          + 15 * has_keyword[i] - 20 * has_query[i])
+            random_factor = (url_hash % 20) - 10
+            draw = (url_hash // 20) % 100 + 1
+            results.append(draw <= max(0, min(100, likelihood + random_factor)))
+        return results
     
-    def is_url_indexed(self, url: str) -> bool:
+    def _is_likely_indexed(self, url: str) -> bool:
         """
-        Check if a URL is indexed on Google.
+        In demo mode, determine if a single URL is likely to be indexed
+        (see score_urls).
         
         Args:
             url: The URL to check
-            
+        
         Returns:
-            True if the URL is indexed, False otherwise
+            Simulated indexing status (True/False)
         """
-        # In demo mode, use our simulated indexing check
-        if self.demo_mode:
-            return self._is_likely_indexed(url)
+        return self.score_urls([url])[0]
+    
+    def _search(self, query: str, start: int = 0, num: Optional[int] = None):
+        """
+        Run one search query through the proxy manager. The body is
+        streamed, so callers can stop reading it early.
         
-        # Real implementation for production use
-        query = f'site:{url}'
-        encoded_query = quote_plus(query)
-        search_url = f"{self.search_url}?q={encoded_query}"
+        Args:
+            query: The search query
+            start: Offset of the first result (for pagination)
+            num: Number of results per page (search engine default if None)
+        
+        Returns:
+            The response, or None if the request failed
+        """
+        search_url = f"{self.search_url}?q={quote_plus(query)}"
+        if num:
+            search_url += f"&num={num}"
+        if start:
+            search_url += f"&start={start}"
         
         headers = {
             'User-Agent': self._get_next_user_agent(),
@@ -124,54 +235,298 @@ class IndexingChecker:
             'Upgrade-Insecure-Requests': '1'
         }
         
+        with self._search_requests_lock:
+            self._search_requests += 1
+        
         # Make the request using the proxy manager
-        response = self.proxy_manager.make_request(search_url, headers=headers)
+        return self.proxy_manager.make_request(search_url, timeout=self.request_timeout,
+                                               headers=headers, stream=True)
+    
+    def _report_blocked(self, result: SerpResult) -> None:
+        """Let proxy selection back off from the proxy that got a block page."""
+        logger.warning(f"Search returned a block page via {result.proxy or 'direct connection'}")
+        self.proxy_manager.report_blocked(result.proxy)
+    
+    def check_url(self, url: str) -> SerpResult:
+        """
+        Check if a URL is indexed on Google, with a structured outcome.
+        
+        The results page is streamed through the result-link parser, which
+        stops as soon as the URL shows up as a result link (a URL that only
+        appears in the echoed query does not count) and recognises CAPTCHA
+        pages, which are reported to the proxy manager.
+        
+        Args:
+            url: The URL to check
+        
+        Returns:
+            SerpResult with status indexed, not_indexed, blocked or error
+        """
+        # In demo mode, use our simulated indexing check
+        if self.demo_mode:
+            return SerpResult(INDEXED if self._is_likely_indexed(url) else NOT_INDEXED)
+        
+        # Real implementation for production use
+        response = self._search(f'site:{url}')
         
         if not response:
             logger.warning(f"Failed to check indexing for {url}")
-            return False
+            return SerpResult(ERROR)
         
-        # Check if the URL appears in the search results
-        return url.lower() in response.text.lower()
+        result = parse_result_page(response, targets=[link_key(url) or url])
+        if result.status == BLOCKED:
+            self._report_blocked(result)
+        return result
     
-    def check_urls(self, urls: List[str]) -> Dict[str, bool]:
+    def is_url_indexed(self, url: str) -> bool:
+        """
+        Check if a URL is indexed on Google.
+        
+        Args:
+            url: The URL to check
+        
+        Returns:
+            True if the URL is indexed, False otherwise (including blocked
+            and failed checks)
+        """
+        return self.check_url(url).is_indexed
+    
+    @staticmethod
+    def _site_scope(host: str, urls: List[str]) -> str:
+        """
+        The narrowest site: scope covering all URLs of one host: the host
+        plus the longest directory prefix their paths share.
+        """
+        paths = [_URL_PARTS_RE.match(url).group(2) or '/' for url in urls]
+        prefix = os.path.commonprefix(paths)
+        prefix = prefix[:prefix.rfind('/') + 1]
+        return host + prefix if len(prefix) > 1 else host
+    
+    def _query_group(self, host: str, urls: List[str]) -> Tuple[Set[str], Set[str], bool]:
+        """
+        Resolve URLs of one host with paginated site: queries for the whole
+        group. A URL is indexed if it appears among the results. Only when
+        the whole listing fits on its first page (the page has no link to a
+        next page) are the URLs not in it known not to be indexed. Search
+        engines cap and thin out site: listings of larger sites, so
+        otherwise the URLs not found are left for per-URL queries.
+        
+        Pages are followed through the offset of each page's next-page
+        link, since engines may serve fewer results per page than asked.
+        
+        Args:
+            host: Host shared by the URLs
+            urls: URLs of that host (scheme already added)
+        
+        Returns:
+            Tuple of (URLs found indexed, URLs known not to be indexed,
+            whether a block page stopped the query), URLs as given
+        """
+        pending = {link_key(url) or url: url for url in urls}
+        found = set()
+        seen = set()
+        complete = False
+        blocked = False
+        query = f'site:{self._site_scope(host, urls)}'
+        
+        start = 0
+        
+        try:
+            for page in range(self.group_max_pages):
+                response = self._search(query, start=start, num=self.results_per_page)
+                if not response:
+                    break
+                
+                # Grouped pages are read in full to collect every result link
+                result = parse_result_page(response)
+                if result.status == BLOCKED:
+                    self._report_blocked(result)
+                    blocked = True
+                    break
+                if result.status == ERROR:
+                    break
+                
+                links = result.links
+                complete = page == 0 and not result.has_next
+                for link in links & pending.keys():
+                    found.add(pending.pop(link))
+                
+                new_links = links - seen
+                seen |= links
+                # A page without new links means the listing stopped, not
+                # that it was complete
+                if not pending or not result.has_next or not new_links:
+                    break
+                start = result.next_start if result.next_start is not None else start + len(links)
+        except Exception as e:
+            logger.error(f"Error running grouped query {query}: {str(e)}")
+            complete = False
+        
+        not_found = set(pending.values()) if complete else set()
+        logger.debug(f"Grouped query {query}: {len(found)} indexed, {len(not_found)} not indexed, "
+                     f"{len(urls) - len(found) - len(not_found)} unresolved")
+        return found, not_found, blocked
+    
+    def _resolve_by_domain(self, urls: List[str], executor: ThreadPoolExecutor) -> Tuple[Set[str], Set[str], List[str], int]:
+        """
+        Run grouped queries for every host with at least group_min_urls
+        pending URLs.
+        
+        Args:
+            urls: Pending URLs (scheme already added)
+            executor: Pool to run the grouped queries on
+        
+        Returns:
+            Tuple of (URLs found indexed, URLs known not to be indexed,
+            URLs still needing a per-URL query, number of blocked groups)
+        """
+        groups = defaultdict(list)
+        for url in urls:
+            host = _URL_PARTS_RE.match(url).group(1) or ''
+            groups[host.lower()].append(url)
+        
+        futures = [
+            executor.submit(self._query_group, host, group)
+            for host, group in groups.items()
+            if host and len(group) >= self.group_min_urls
+        ]
+        found, not_found = set(), set()
+        blocked = 0
+        for future in futures:
+            group_found, group_not_found, group_blocked = future.result()
+            found |= group_found
+            not_found |= group_not_found
+            blocked += group_blocked
+        
+        unresolved = [url for url in urls if url not in found and url not in not_found]
+        return found, not_found, unresolved, blocked
+    
+    def _check_one(self, url: str) -> SerpResult:
+        """
+        Check a single URL on a worker thread.
+        
+        Args:
+            url: The URL to check (scheme already added)
+        
+        Returns:
+            SerpResult of the check (status error if it raised)
+        """
+        try:
+            return self.check_url(url)
+        except Exception as e:
+            logger.error(f"Error checking URL {url}: {str(e)}")
+            return SerpResult(ERROR)
+    
+    def check_urls(self, urls: List[str], stale_only: bool = False,
+                   cached_urls: Optional[Set[str]] = None) -> Dict[str, bool]:
         """
         Check if multiple URLs are indexed on Google.
         
+        In real mode up to ``max_concurrency`` checks are kept in flight on a
+        bounded thread pool; the proxy manager additionally limits how many of
+        them may use the same proxy at once, and its rate scheduler paces the
+        requests. With grouped_queries, hosts with several pending URLs are
+        first resolved with paginated site: queries (see _query_group), so
+        only the URLs those miss need a query of their own. Demo mode scores
+        the whole batch inline with score_urls since the simulation makes no
+        network calls.
+        
         Args:
             urls: List of URLs to check
-            
+            stale_only: Answer URLs checked within the freshness cache's TTL
+                from the cache instead of querying them again
+            cached_urls: Optional set that receives the URLs (as given)
+                answered from the cache
+        
         Returns:
-            Dictionary mapping URLs to their indexing status
+            Dictionary mapping URLs to their indexing status. URLs whose
+            check hit a block page or failed are left out, so callers do
+            not record them as not indexed and they are checked again later
         """
-        results = {}
         total_urls = len(urls)
+        started = time.monotonic()
+        search_requests_before = self._search_requests
+        blocked = errors = 0
+        # URLs whose check hit a block page or failed: no answer to remember
+        failed = set()
         
-        # Use a smaller delay for very large batches
-        check_delay = 0.1 if total_urls > 1000 else 0.5
+        # Add scheme if missing
+        prepared = {url: self.prepare_url(url) for url in urls}
         
-        for i, url in enumerate(urls):
-            try:
-                # Add scheme if missing
-                if not url.startswith('http'):
-                    url = 'https://' + url
-                
-                is_indexed = self.is_url_indexed(url)
-                results[url] = is_indexed
-                
-                # Log less frequently for large batches
-                if total_urls <= 100 or i % 100 == 0:
-                    logger.info(f"URL {i+1}/{total_urls}: {url} is {'indexed' if is_indexed else 'not indexed'}")
+        # Pre-fill so the result keeps the input order regardless of completion order
+        results = dict.fromkeys(prepared.values(), False)
+        
+        # Answer recently checked URLs from the freshness cache
+        fresh = {}
+        if stale_only and self.freshness_cache is not None:
+            fresh = self.freshness_cache.get_fresh(urls)
+            for url, is_indexed in fresh.items():
+                results[prepared[url]] = is_indexed
+            if cached_urls is not None:
+                cached_urls.update(fresh)
+        pending = [prepared[url] for url in urls if url not in fresh]
+        
+        if self.demo_mode:
+            # Score the whole batch at once
+            results.update(zip(pending, self.score_urls(pending)))
+            
+            # Per-URL logs only for small batches
+            if total_urls <= 100 and logger.isEnabledFor(logging.DEBUG):
+                for i, url in enumerate(pending):
+                    logger.debug(f"URL {i+1}/{total_urls}: {url} is {'indexed' if results[url] else 'not indexed'}")
+        else:
+            workers = min(self.max_concurrency, len(pending)) or 1
+            
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='index-check') as executor:
+                unresolved = pending
+                if self.grouped_queries:
+                    found, not_found, unresolved, blocked = self._resolve_by_domain(pending, executor)
+                    results.update(dict.fromkeys(found, True))
+                    results.update(dict.fromkeys(not_found, False))
+                    logger.info(f"Grouped queries resolved {len(found) + len(not_found)}/{len(pending)} URLs")
                 
-                # Small delay between checks - reduce for large batches
-                if not self.demo_mode or i % 10 == 0:  # In demo mode, only delay occasionally
-                    time.sleep(check_delay)
-            except Exception as e:
-                logger.error(f"Error checking URL {url}: {str(e)}")
-                results[url] = False
+                futures = {url: executor.submit(self._check_one, url) for url in unresolved}
+                for i, (url, future) in enumerate(futures.items()):
+                    result = future.result()
+                    results[url] = result.is_indexed
+                    if result.status == BLOCKED:
+                        blocked += 1
+                        failed.add(url)
+                    elif result.status == ERROR:
+                        errors += 1
+                        failed.add(url)
+                    
+                    # Log less frequently for large batches
+                    if total_urls <= 100 or i % 100 == 0:
+                        logger.info(f"URL {i+1}/{total_urls}: {url} is {result.status}")
+        
+        # Remember what was just checked for later submissions; failed
+        # checks are no answer and must be queried again next time
+        if self.freshness_cache is not None:
+            self.freshness_cache.put_many({url: results[prepared[url]] for url in urls
+                                           if url not in fresh and prepared[url] not in failed})
+        
+        elapsed = time.monotonic() - started
+        self._run_stats.stats = {
+            'total_urls': total_urls,
+            'elapsed_seconds': elapsed,
+            'checks_per_second': (len(pending) / elapsed) if elapsed > 0 else 0.0,
+            'cache_hits': len(fresh),
+            'search_requests': self._search_requests - search_requests_before,
+            'blocked': blocked,
+            'errors': errors
+        }
+        
+        metrics.observe_check_batch(len(pending), len(fresh), blocked, errors, elapsed)
+        
+        # A failed check is no answer
+        for url in failed:
+            del results[url]
         
         # Summary log
         indexed_count = sum(1 for is_indexed in results.values() if is_indexed)
-        logger.info(f"Completed batch of {total_urls} URLs: {indexed_count} indexed, {total_urls - indexed_count} not indexed")
+        logger.info(f"Completed batch of {total_urls} URLs: {indexed_count} indexed, "
+                    f"{len(results) - indexed_count} not indexed, {len(failed)} unanswered, "
+                    f"{len(fresh)} from cache ({self.last_run_stats['checks_per_second']:.1f} checks/sec)")
         
         return results
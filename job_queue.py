@@ -0,0 +1,390 @@
+"""
+Database-backed job queue for large URL checks.
+
+Jobs live in the jobs table, so any web or worker process sees the same
+state. A worker claims a job by taking a time-limited lease and renews it
+with every committed batch; if the worker dies, the lease expires and
+another worker resumes the job from its last checkpoint.
+
+Storing a job's URLs is a single sequential pass. Once it is done the job
+is split into shards of job URL positions, which are leased the same way,
+so any number of worker processes and nodes can check one job in parallel.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, and_, update, exists
+from app import db
+from models import Job, JobShard
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed job stays reserved without a checkpoint
+LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+
+# How often a shard lease is renewed while a batch is being checked
+HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', LEASE_SECONDS / 3))
+
+# Number of job URLs per shard
+SHARD_SIZE = int(os.environ.get('JOB_SHARD_SIZE', 10000))
+
+# Claims of a shard before its job is given up on; a failed attempt keeps
+# the lease until it expires, so attempts are retried LEASE_SECONDS apart
+SHARD_MAX_ATTEMPTS = int(os.environ.get('JOB_SHARD_MAX_ATTEMPTS', 5))
+
+class LeaseLostError(Exception):
+    """Raised when a worker finds that another worker has taken over its job."""
+
+def make_worker_id():
+    """Build a worker id that is unique across hosts and processes."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def enqueue_job(total_urls, source_path=None, source_text=None, recheck_stale_only=False):
+    """
+    Queue a new check job.
+    
+    Args:
+        total_urls: Estimated number of URLs in the job
+        source_path: Path of the spooled upload, if any
+        source_text: URLs pasted into the form, if any
+        recheck_stale_only: Answer recently checked URLs from the freshness cache
+    
+    Returns:
+        The committed Job
+    """
+    job = Job(
+        status=Job.QUEUED,
+        source_path=source_path,
+        source_text=source_text,
+        total_urls=total_urls,
+        recheck_stale_only=recheck_stale_only
+    )
+    db.session.add(job)
+    db.session.commit()
+    logger.info(f"Queued job {job.id} with about {total_urls} URLs")
+    return job
+
+def _claimable(model=Job):
+    """Filter for jobs (or shards) that are queued or whose lease has expired."""
+    now = datetime.utcnow()
+    return or_(
+        model.status == model.QUEUED,
+        and_(model.status == model.RUNNING, model.lease_expires_at < now)
+    )
+
+def claim_next_job(worker_id):
+    """
+    Claim the oldest claimable job for a worker.
+    
+    The claim is a conditional UPDATE, so when several workers race for the
+    same job only one of them succeeds.
+    
+    Args:
+        worker_id: Id of the claiming worker
+    
+    Returns:
+        Id of the claimed job, or None if there is nothing to do
+    """
+    candidates = db.session.query(Job.id).filter(_claimable()).order_by(Job.id).limit(5).all()
+    
+    for (job_id,) in candidates:
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, _claimable())
+            .values(
+                status=Job.RUNNING,
+                worker_id=worker_id,
+                lease_expires_at=now + timedelta(seconds=LEASE_SECONDS),
+                started_at=db.func.coalesce(Job.started_at, now),
+                updated_at=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            logger.info(f"Worker {worker_id} claimed job {job_id}")
+            return job_id
+    
+    return None
+
+def checkpoint_job(job_id, worker_id, release=False, **values):
+    """
+    Record job progress and renew the worker's lease, as part of the
+    caller's transaction (the caller commits).
+    
+    Args:
+        job_id: Id of the job
+        worker_id: Id of the worker that must still hold the lease
+        release: Give up the lease instead of renewing it
+        **values: Job columns to update
+    
+    Raises:
+        LeaseLostError: If another worker has taken over the job
+    """
+    now = datetime.utcnow()
+    fields = {'lease_expires_at': now + timedelta(seconds=LEASE_SECONDS), 'updated_at': now}
+    if release:
+        fields.update(worker_id=None, lease_expires_at=None)
+    fields.update(values)
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.worker_id == worker_id, Job.status == Job.RUNNING)
+        .values(**fields)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise LeaseLostError(f"Worker {worker_id} no longer holds job {job_id}")
+
+def finish_job(job_id, worker_id, status, error=None):
+    """
+    Mark a job completed or failed and release its lease.
+    
+    Args:
+        job_id: Id of the job
+        worker_id: Id of the worker holding the lease
+        status: Job.COMPLETED or Job.FAILED
+        error: Error message for failed jobs
+    """
+    now = datetime.utcnow()
+    checkpoint_job(job_id, worker_id, release=True, status=status, error=error, finished_at=now)
+    db.session.commit()
+    logger.info(f"Job {job_id} {status}")
+
+def fail_job(job_id, error):
+    """
+    Mark a running job failed, whichever worker finds the error. Used for
+    sharded jobs, whose shards are held by several workers at once.
+    """
+    now = datetime.utcnow()
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == Job.RUNNING)
+        .values(status=Job.FAILED, error=error, finished_at=now, updated_at=now,
+                worker_id=None, lease_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    logger.info(f"Job {job_id} {Job.FAILED}")
+
+def split_job(job_id, worker_id, total_urls, shard_size=SHARD_SIZE):
+    """
+    Split a stored job into shards and release the job's own lease, as part
+    of the caller's transaction (the caller commits).
+    
+    Args:
+        job_id: Id of the job
+        worker_id: Id of the worker holding the job's lease
+        total_urls: Number of URLs stored for the job
+        shard_size: Number of job URLs per shard
+    
+    Raises:
+        LeaseLostError: If another worker has taken over the job
+    """
+    # Release the lease first so a stale worker cannot create a second set of shards
+    checkpoint_job(job_id, worker_id, release=True, check_started_at=datetime.utcnow())
+    
+    shard_size = max(1, shard_size)
+    shards = [
+        {
+            'job_id': job_id,
+            'start_position': start,
+            'end_position': min(start + shard_size, total_urls),
+            'next_position': start,
+            'status': JobShard.QUEUED,
+            'updated_at': datetime.utcnow()
+        }
+        for start in range(0, total_urls, shard_size)
+    ]
+    if shards:
+        db.session.execute(JobShard.__table__.insert(), shards)
+    logger.info(f"Split job {job_id} into {-(-total_urls // shard_size)} shards")
+
+def claim_next_shard(worker_id):
+    """
+    Claim the oldest claimable shard of a running job for a worker, using
+    the same conditional UPDATE as claim_next_job. Every claim counts as an
+    attempt.
+    
+    Args:
+        worker_id: Id of the claiming worker
+    
+    Returns:
+        Id of the claimed shard, or None if there is nothing to do
+    """
+    candidates = db.session.query(JobShard.id) \
+        .join(Job, Job.id == JobShard.job_id) \
+        .filter(Job.status == Job.RUNNING, _claimable(JobShard)) \
+        .order_by(JobShard.job_id, JobShard.id).limit(5).all()
+    
+    for (shard_id,) in candidates:
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(JobShard)
+            .where(JobShard.id == shard_id, _claimable(JobShard))
+            .values(
+                status=JobShard.RUNNING,
+                worker_id=worker_id,
+                lease_expires_at=now + timedelta(seconds=LEASE_SECONDS),
+                attempts=JobShard.attempts + 1,
+                updated_at=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            logger.debug(f"Worker {worker_id} claimed shard {shard_id}")
+            return shard_id
+    
+    return None
+
+def checkpoint_shard(shard_id, worker_id, **values):
+    """
+    Record shard progress and renew the worker's lease, as part of the
+    caller's transaction (the caller commits).
+    
+    Args:
+        shard_id: Id of the shard
+        worker_id: Id of the worker that must still hold the lease
+        **values: JobShard columns to update
+    
+    Raises:
+        LeaseLostError: If another worker has taken over the shard
+    """
+    now = datetime.utcnow()
+    fields = {'lease_expires_at': now + timedelta(seconds=LEASE_SECONDS), 'updated_at': now}
+    fields.update(values)
+    result = db.session.execute(
+        update(JobShard)
+        .where(JobShard.id == shard_id, JobShard.worker_id == worker_id,
+               JobShard.status == JobShard.RUNNING)
+        .values(**fields)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise LeaseLostError(f"Worker {worker_id} no longer holds shard {shard_id}")
+
+def renew_shard_lease(shard_id, worker_id):
+    """
+    Extend a worker's shard lease in a transaction of its own.
+    
+    Returns:
+        False if another worker has taken over the shard
+    """
+    try:
+        checkpoint_shard(shard_id, worker_id)
+        db.session.commit()
+        return True
+    except LeaseLostError:
+        db.session.rollback()
+        return False
+
+class LeaseHeartbeat:
+    """
+    Renews a shard lease every HEARTBEAT_SECONDS from a background thread
+    for as long as the context is open, so checking a batch that takes
+    longer than LEASE_SECONDS does not lose the shard. The batch itself
+    runs outside any transaction; ``lost`` is set if the shard was taken
+    over anyway.
+    """
+    
+    def __init__(self, shard_id, worker_id, interval=HEARTBEAT_SECONDS):
+        self.shard_id = shard_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.lost = False
+        self._app = current_app._get_current_object()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f'lease-heartbeat-{self.shard_id}', daemon=True)
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+    
+    def _run(self):
+        # A separate app context gives the thread its own database session
+        with self._app.app_context():
+            try:
+                while not self._stop.wait(self.interval):
+                    try:
+                        if not renew_shard_lease(self.shard_id, self.worker_id):
+                            self.lost = True
+                            logger.warning(f"Worker {self.worker_id} lost shard {self.shard_id} during a batch")
+                            return
+                    except Exception as e:
+                        # Try again at the next beat, while the lease still holds
+                        db.session.rollback()
+                        logger.error(f"Could not renew the lease on shard {self.shard_id}: {str(e)}")
+            finally:
+                db.session.remove()
+
+def record_shard_error(shard_id, worker_id, error):
+    """
+    Record why an attempt at a shard failed, keeping the worker's lease.
+    The shard is retried by whichever worker claims it after the lease
+    expires. Commits.
+    """
+    db.session.execute(
+        update(JobShard)
+        .where(JobShard.id == shard_id, JobShard.worker_id == worker_id)
+        .values(error=error, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def add_job_progress(job_id, checked, indexed, blocked=0, errors=0):
+    """
+    Add a batch's counts to a job, as part of the caller's transaction.
+    The increments happen in the database, so concurrent shards of the
+    same job do not overwrite each other.
+    """
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(
+            checked_urls=Job.checked_urls + checked,
+            indexed_urls=Job.indexed_urls + indexed,
+            blocked_checks=Job.blocked_checks + blocked,
+            error_checks=Job.error_checks + errors,
+            updated_at=datetime.utcnow()
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def complete_job_if_done(job_id):
+    """
+    Mark a sharded job completed once none of its shards is left.
+    
+    Args:
+        job_id: Id of the job
+    
+    Returns:
+        True if this call completed the job
+    """
+    now = datetime.utcnow()
+    pending_shards = exists().where(
+        JobShard.job_id == job_id,
+        JobShard.status != JobShard.COMPLETED
+    )
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == Job.RUNNING,
+               Job.storage_complete.is_(True), ~pending_shards)
+        .values(status=Job.COMPLETED, finished_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if result.rowcount == 1:
+        logger.info(f"Job {job_id} {Job.COMPLETED}")
+        return True
+    return False
@@ -0,0 +1,186 @@
+"""
+Prometheus metrics for the check pipeline, served at /metrics.
+
+prometheus_client is optional: without it every metric is a no-op and
+/metrics answers 503. Under Gunicorn, or with separate worker processes,
+set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by all processes
+(before they start), so a scrape of any web process aggregates the
+metrics of every process on the node.
+"""
+import logging
+import os
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Use try/except for prometheus_client import in case it's not available
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry
+    from prometheus_client.core import GaugeMetricFamily
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST if prometheus_client else 'text/plain; charset=utf-8'
+
+# Gauges computed at scrape time, as (name, documentation, label name,
+# {label value: value}) tuples
+GaugeSamples = Iterable[Tuple[str, str, str, Dict[str, float]]]
+
+class _NoOpMetric:
+    """Stands in for a metric when prometheus_client is not installed."""
+    
+    def labels(self, *args, **kwargs):
+        return self
+    
+    def inc(self, amount=1):
+        pass
+    
+    def observe(self, value):
+        pass
+    
+    def set(self, value):
+        pass
+
+def _counter(name, documentation, labelnames=()):
+    if prometheus_client is None:
+        return _NoOpMetric()
+    return Counter(name, documentation, labelnames)
+
+def _histogram(name, documentation, labelnames=(), buckets=None):
+    if prometheus_client is None:
+        return _NoOpMetric()
+    return Histogram(name, documentation, labelnames, buckets=buckets or Histogram.DEFAULT_BUCKETS)
+
+def _gauge(name, documentation, labelnames=()):
+    if prometheus_client is None:
+        return _NoOpMetric()
+    # One series per live process; dead processes drop out
+    return Gauge(name, documentation, labelnames, multiprocess_mode='liveall')
+
+# Requests to the search engine, per route (proxy address or "direct")
+REQUEST_SECONDS = _histogram(
+    'indexing_request_seconds', 'Latency of search requests by route and outcome',
+    ('route', 'outcome'),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+)
+REQUEST_RETRIES = _counter(
+    'indexing_request_retries_total', 'Search request attempts that were retried', ('route',)
+)
+DIRECT_FALLBACKS = _counter(
+    'indexing_direct_fallbacks_total',
+    'Requests sent directly because every proxy circuit was open'
+)
+
+# check_urls batches; checks/sec is rate(indexing_url_checks_total)
+URL_CHECKS = _counter(
+    'indexing_url_checks_total', 'URLs checked, by where the answer came from', ('source',)
+)
+CHECK_FAILURES = _counter(
+    'indexing_check_failures_total', 'Checks that hit a block page or failed', ('reason',)
+)
+CHECK_BATCH_SECONDS = _histogram(
+    'indexing_check_batch_seconds', 'Duration of check_urls calls',
+    buckets=(0.01, 0.1, 0.5, 1, 5, 15, 30, 60, 120, 300)
+)
+
+# Database batches: storing URLs and persisting results, up to the commit
+DB_BATCH_SECONDS = _histogram(
+    'indexing_db_batch_seconds', 'Duration of committed database batches', ('operation',),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+DB_BATCH_ROWS = _histogram(
+    'indexing_db_batch_rows', 'Rows written per committed database batch', ('operation',),
+    buckets=(10, 100, 500, 1000, 2500, 5000, 10000, 50000)
+)
+
+# Current size chosen by each AdaptiveBatcher
+BATCH_SIZE = _gauge(
+    'indexing_batch_size', 'Current adaptive batch size by pipeline phase', ('phase',)
+)
+
+RESIDENT_MEMORY = _gauge(
+    'indexing_resident_memory_bytes', 'Resident memory of app and worker processes'
+)
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident memory of this process, or None where it cannot be read."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def record_memory() -> None:
+    """Update this process's resident memory gauge."""
+    rss = current_rss_bytes()
+    if rss is not None:
+        RESIDENT_MEMORY.set(rss)
+
+def observe_request(route: str, outcome: str, seconds: float) -> None:
+    """Record one search request attempt (outcome: ok, http_error, rate_limited, timeout, error)."""
+    REQUEST_SECONDS.labels(route, outcome).observe(seconds)
+
+def observe_check_batch(checked: int, cached: int, blocked: int, errors: int, seconds: float) -> None:
+    """Record one check_urls call."""
+    URL_CHECKS.labels('query').inc(checked)
+    URL_CHECKS.labels('cache').inc(cached)
+    CHECK_FAILURES.labels('blocked').inc(blocked)
+    CHECK_FAILURES.labels('error').inc(errors)
+    CHECK_BATCH_SECONDS.observe(seconds)
+
+def observe_db_batch(operation: str, rows: int, seconds: float) -> None:
+    """Record one committed database batch (operation: store_urls or save_results)."""
+    DB_BATCH_SECONDS.labels(operation).observe(seconds)
+    DB_BATCH_ROWS.labels(operation).observe(rows)
+
+class ScrapeTimeCollector:
+    """Exposes gauges that are computed when scraped, e.g. from the database."""
+    
+    def __init__(self, read_gauges: Callable[[], GaugeSamples]):
+        self.read_gauges = read_gauges
+    
+    def collect(self):
+        for name, documentation, label, values in self.read_gauges():
+            family = GaugeMetricFamily(name, documentation, labels=[label])
+            for label_value, value in values.items():
+                family.add_metric([label_value], value)
+            yield family
+
+def generate_latest(read_gauges: Optional[Callable[[], GaugeSamples]] = None) -> Optional[bytes]:
+    """
+    Render all metrics in the Prometheus text format.
+    
+    Args:
+        read_gauges: Callable returning gauges computed at scrape time,
+            such as queue depth, as (name, documentation, label name,
+            {label value: value}) tuples
+    
+    Returns:
+        The exposition text, or None if prometheus_client is not installed
+    """
+    if prometheus_client is None:
+        return None
+    
+    record_memory()
+    if MULTIPROC_DIR:
+        # Aggregate the metric files written by every process
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    output = prometheus_client.generate_latest(registry)
+    
+    if read_gauges is not None:
+        scrape_registry = CollectorRegistry()
+        scrape_registry.register(ScrapeTimeCollector(read_gauges))
+        output += prometheus_client.generate_latest(scrape_registry)
+    return output
+
+def mark_process_dead(pid: int) -> None:
+    """Drop a dead process's live gauges (call from Gunicorn's child_exit hook)."""
+    if prometheus_client is not None and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
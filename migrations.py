@@ -0,0 +1,226 @@
+"""
+Lightweight, idempotent schema migrations applied at startup.
+
+db.create_all() only creates missing tables, so columns and indexes added
+to existing tables are applied here. Each migration checks the live schema
+before changing it and can safely run on every start.
+"""
+import logging
+from sqlalchemy import inspect, literal, text, select, bindparam, func, case
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import URL, URLCounters, CheckResult, Report, Job, JobShard
+from url_ingest import url_host
+
+logger = logging.getLogger(__name__)
+
+def _add_missing_columns(table, column_names):
+    """
+    Add model columns that are missing from an existing table.
+    
+    Args:
+        table: SQLAlchemy Table of the model
+        column_names: Names of the model columns that must exist
+    
+    Returns:
+        List of column names that were added
+    """
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    added = []
+    
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        ddl = f'ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=db.engine.dialect)}'
+        # Fill existing rows with a scalar model default, if there is one
+        if column.default is not None and column.default.is_scalar:
+            default = literal(column.default.arg, column.type).compile(
+                dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+            ddl += f' DEFAULT {default}'
+        for foreign_key in column.foreign_keys:
+            ddl += f' REFERENCES {foreign_key.column.table.name}({foreign_key.column.name})'
+        db.session.execute(text(ddl))
+        added.append(name)
+    
+    if added:
+        db.session.commit()
+        logger.info(f"Added columns {', '.join(added)} to {table.name}")
+    return added
+
+def _create_missing_indexes(table):
+    """
+    Create any index declared on the model that does not exist yet. Indexes
+    over columns a later migration adds are left to that migration.
+    """
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    for index in table.indexes:
+        if all(column.name in existing for column in index.columns):
+            index.create(db.engine, checkfirst=True)
+
+def migrate_latest_result_state():
+    """Add the materialized latest-result columns to urls and backfill them."""
+    added = _add_missing_columns(URL.__table__, ['last_is_indexed', 'last_checked_at', 'latest_result_id'])
+    _create_missing_indexes(URL.__table__)
+    
+    if not added:
+        return
+    
+    db.session.execute(text('''
+        UPDATE urls SET latest_result_id = (
+            SELECT cr.id FROM check_results cr
+            WHERE cr.url_id = urls.id
+            ORDER BY cr.checked_at DESC, cr.id DESC
+            LIMIT 1
+        )
+        WHERE latest_result_id IS NULL
+    '''))
+    db.session.execute(text('''
+        UPDATE urls SET
+            last_is_indexed = (SELECT cr.is_indexed FROM check_results cr WHERE cr.id = urls.latest_result_id),
+            last_checked_at = (SELECT cr.checked_at FROM check_results cr WHERE cr.id = urls.latest_result_id)
+        WHERE latest_result_id IS NOT NULL
+    '''))
+    db.session.commit()
+    logger.info("Backfilled latest check state on urls")
+
+def migrate_check_result_reports():
+    """
+    Link check results to the report that produced them. Existing rows are
+    assigned to the first report created at or after they were checked,
+    since reports used to be created right after their run finished.
+    """
+    added = _add_missing_columns(CheckResult.__table__, ['report_id'])
+    _create_missing_indexes(CheckResult.__table__)
+    
+    if not added:
+        return
+    
+    db.session.execute(text('''
+        UPDATE check_results SET report_id = (
+            SELECT r.id FROM reports r
+            WHERE r.created_at >= check_results.checked_at
+            ORDER BY r.created_at, r.id
+            LIMIT 1
+        )
+        WHERE report_id IS NULL
+    '''))
+    db.session.commit()
+    logger.info("Backfilled report ids on check_results")
+
+def migrate_freshness_cache():
+    """Add the cache-hit columns used by "recheck stale only" runs."""
+    _add_missing_columns(CheckResult.__table__, ['cached'])
+    _add_missing_columns(Report.__table__, ['cache_hits'])
+    _add_missing_columns(Job.__table__, ['recheck_stale_only'])
+
+def migrate_job_progress():
+    """Add the counters behind job throughput, error/block rates and ETA."""
+    _add_missing_columns(Job.__table__, ['blocked_checks', 'error_checks', 'check_started_at'])
+
+def migrate_shard_attempts():
+    """Add the attempt counter and last error used to retry failed shards."""
+    _add_missing_columns(JobShard.__table__, ['attempts', 'error'])
+
+# URLs read and updated per transaction by the host backfill
+HOST_BACKFILL_BATCH = 5000
+
+def migrate_drop_job_batch_size():
+    """
+    Drop jobs.batch_size: job batches are sized by the adaptive batchers,
+    and the NOT NULL column would reject jobs queued without it.
+    """
+    existing = {column['name'] for column in inspect(db.engine).get_columns(Job.__tablename__)}
+    if 'batch_size' in existing:
+        db.session.execute(text(f'ALTER TABLE {Job.__tablename__} DROP COLUMN batch_size'))
+        db.session.commit()
+        logger.info(f"Dropped column batch_size from {Job.__tablename__}")
+
+def migrate_url_host():
+    """
+    Add the indexed host column to urls and fill it for existing rows.
+    
+    Hosts are parsed in Python, so the backfill walks the table in id
+    order and commits one batch at a time; an interrupted backfill picks
+    up the remaining rows on the next start.
+    """
+    _add_missing_columns(URL.__table__, ['host'])
+    _create_missing_indexes(URL.__table__)
+    
+    urls_table = URL.__table__
+    update_hosts = urls_table.update() \
+        .where(urls_table.c.id == bindparam('b_id')) \
+        .values(host=bindparam('b_host'))
+    last_id = 0
+    filled = 0
+    
+    while True:
+        batch = db.session.execute(
+            select(urls_table.c.id, urls_table.c.url)
+            .where(urls_table.c.host.is_(None), urls_table.c.id > last_id)
+            .order_by(urls_table.c.id)
+            .limit(HOST_BACKFILL_BATCH)
+        ).all()
+        if not batch:
+            break
+        
+        last_id = batch[-1].id
+        rows = [{'b_id': url_id, 'b_host': url_host(url_str)} for url_id, url_str in batch]
+        rows = [row for row in rows if row['b_host']]
+        if rows:
+            db.session.execute(update_hosts, rows)
+        db.session.commit()
+        filled += len(rows)
+    
+    if filled:
+        logger.info(f"Backfilled hosts on {filled} urls")
+
+def migrate_url_counters():
+    """
+    Create the url_counters row from the current urls table. From then on
+    it is kept up to date by every batch that writes URLs or results.
+    """
+    if db.session.get(URLCounters, URLCounters.SINGLETON_ID) is not None:
+        return
+    
+    total, indexed, not_indexed = db.session.execute(
+        select(func.count(URL.id),
+               func.sum(case((URL.last_is_indexed.is_(True), 1), else_=0)),
+               func.sum(case((URL.last_is_indexed.is_(False), 1), else_=0)))
+    ).one()
+    indexed, not_indexed = indexed or 0, not_indexed or 0
+    db.session.add(URLCounters(
+        id=URLCounters.SINGLETON_ID,
+        total_urls=total,
+        indexed=indexed,
+        not_indexed=not_indexed,
+        never_checked=total - indexed - not_indexed
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process created the row first
+        db.session.rollback()
+        return
+    logger.info(f"Initialized url_counters with {total} URLs")
+
+# Applied in order on every start
+MIGRATIONS = [
+    migrate_latest_result_state,
+    migrate_check_result_reports,
+    migrate_freshness_cache,
+    migrate_job_progress,
+    migrate_url_host,
+    migrate_url_counters,
+    migrate_shard_attempts,
+    migrate_drop_job_batch_size,
+]
+
+def run_migrations():
+    """Apply all migrations; failures are logged and do not stop the app."""
+    for migration in MIGRATIONS:
+        try:
+            migration()
+        except Exception as e:
+            logger.error(f"Migration {migration.__name__} failed: {str(e)}")
+            db.session.rollback()
@@ -10,9 +10,47 @@ class URL(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     results = db.relationship('CheckResult', backref='url_ref', lazy=True)
     
+    # Latest check state, kept up to date whenever check results are written
+    # so read paths don't need a per-URL "latest CheckResult" query.
+    # latest_result_id has no FK constraint to avoid a cycle with check_results.
+    last_is_indexed = db.Column(db.Boolean, nullable=True)
+    last_checked_at = db.Column(db.DateTime, nullable=True)
+    latest_result_id = db.Column(db.Integer, nullable=True)
+    
+    # Host name, set at ingest, for per-domain aggregates
+    host = db.Column(db.String(255), nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_urls_last_status', 'last_is_indexed', 'id'),
+        db.Index('ix_urls_host', 'host'),
+        # Sort key of the keyset-paginated results page
+        db.Index('ix_urls_created_id', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<URL {self.url}>'
 
+class URLCounters(db.Model):
+    """
+    Single-row summary of all URLs by their latest check state. It is
+    updated in the same transaction as every batch of new URLs or check
+    results, so the summary is one row read.
+    """
+    __tablename__ = 'url_counters'
+    
+    # The one row of the table
+    SINGLETON_ID = 1
+    
+    id = db.Column(db.Integer, primary_key=True)
+    total_urls = db.Column(db.BigInteger, nullable=False, default=0)
+    indexed = db.Column(db.BigInteger, nullable=False, default=0)
+    not_indexed = db.Column(db.BigInteger, nullable=False, default=0)
+    never_checked = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<URLCounters {self.total_urls} URLs>'
+
 class CheckResult(db.Model):
     """Model for storing the results of indexing checks."""
     __tablename__ = 'check_results'
@@ -22,6 +60,17 @@ class CheckResult(db.Model):
     is_indexed = db.Column(db.Boolean, nullable=False)
     checked_at = db.Column(db.DateTime, default=datetime.utcnow)
     proxy_used = db.Column(db.String(100), nullable=True)
+    # The report (check run) that produced this result
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=True)
+    # Answered from the freshness cache instead of a new query
+    cached = db.Column(db.Boolean, nullable=False, default=False)
+    
+    __table_args__ = (
+        db.Index('ix_check_results_report_url', 'report_id', 'url_id'),
+        db.Index('ix_check_results_url_checked', 'url_id', 'checked_at'),
+        # Sort key of the keyset-paginated report page
+        db.Index('ix_check_results_report_checked', 'report_id', 'checked_at', 'id'),
+    )
     
     def __repr__(self):
         return f'<CheckResult {self.id} for URL {self.url_id}>'
@@ -35,6 +84,9 @@ class Report(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     total_urls = db.Column(db.Integer, default=0)
     indexed_urls = db.Column(db.Integer, default=0)
+    # URLs answered from the freshness cache instead of being checked again
+    cache_hits = db.Column(db.Integer, default=0)
+    results = db.relationship('CheckResult', backref='report_ref', lazy=True)
     
     def __repr__(self):
         return f'<Report {self.name}>'
@@ -44,3 +96,114 @@ class Report(db.Model):
         if self.total_urls == 0:
             return 0
         return round((self.indexed_urls / self.total_urls) * 100, 2)
+
+class ReportStats(db.Model):
+    """
+    Snapshot of a finished report's aggregates (counts, domains, status
+    changes, checked_at histogram), stored as zlib-compressed JSON so the
+    report page does not aggregate check_results on every view.
+    """
+    __tablename__ = 'report_stats'
+    
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), primary_key=True)
+    # Layout of the payload, so older snapshots can be recomputed
+    version = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReportStats for report {self.report_id}>'
+
+class Job(db.Model):
+    """Model for a durable background check job with per-batch checkpoints."""
+    __tablename__ = 'jobs'
+    
+    # Job statuses
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    # Only query URLs whose latest result is older than the freshness TTL
+    recheck_stale_only = db.Column(db.Boolean, nullable=False, default=False)
+    # Where the submitted URLs are read from: a spooled upload and/or pasted text
+    source_path = db.Column(db.String(1024), nullable=True)
+    source_text = db.Column(db.Text, nullable=True)
+    # Estimated until the storage phase has read the whole source, then exact
+    total_urls = db.Column(db.Integer, default=0)
+    # Checkpoints: URLs stored from the source, and job URLs checked so far
+    # (summed over all shards once checking is split across workers)
+    stored_urls = db.Column(db.Integer, default=0)
+    storage_complete = db.Column(db.Boolean, default=False)
+    checked_urls = db.Column(db.Integer, default=0)
+    indexed_urls = db.Column(db.Integer, default=0)
+    # Checks that hit a block page or failed, for progress error/block rates
+    blocked_checks = db.Column(db.Integer, default=0)
+    error_checks = db.Column(db.Integer, default=0)
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=True)
+    # Lease held by the worker running the storage phase; released once
+    # the job is split into shards
+    worker_id = db.Column(db.String(255), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    # When the job was split into shards, i.e. when checking started
+    check_started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.status}>'
+    
+    @property
+    def is_active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+    
+    @property
+    def stage(self):
+        """Current stage: queued, storing, checking, completed or failed."""
+        if self.status == self.RUNNING:
+            return 'checking' if self.storage_complete else 'storing'
+        return self.status
+
+class JobURL(db.Model):
+    """Model for the ordered list of URLs belonging to a job."""
+    __tablename__ = 'job_urls'
+    
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    url_id = db.Column(db.Integer, db.ForeignKey('urls.id'), nullable=False)
+    
+    def __repr__(self):
+        return f'<JobURL {self.job_id}:{self.position}>'
+
+class JobShard(db.Model):
+    """Model for a contiguous range of job URL positions checked by one worker at a time."""
+    __tablename__ = 'job_shards'
+    
+    # Shard statuses
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False, index=True)
+    # Positions [start_position, end_position) of the job's URLs
+    start_position = db.Column(db.Integer, nullable=False)
+    end_position = db.Column(db.Integer, nullable=False)
+    # Checkpoint: first position not yet checked
+    next_position = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    # Lease held by the worker currently checking the shard
+    worker_id = db.Column(db.String(255), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    # Times the shard was claimed, and the error of its last failed attempt
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<JobShard {self.job_id}:{self.start_position}-{self.end_position} {self.status}>'
@@ -0,0 +1,153 @@
+"""
+Keyset (cursor) pagination for the results and report pages.
+
+OFFSET pagination makes the database read and throw away every row before
+the requested page, and needs a COUNT(*) on every request. Here a page is
+instead located by the sort key of the row next to it: the next page
+starts after the last row shown and the previous page ends before the
+first one, so with an index on the sort columns a deep page costs the same
+as the first. The position travels in an opaque, URL-safe token.
+"""
+import base64
+import binascii
+import json
+import logging
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+from sqlalchemy import literal, tuple_
+from sqlalchemy.sql import Select
+from app import db
+
+logger = logging.getLogger(__name__)
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+def encode_cursor(key: Sequence[Any], direction: str) -> str:
+    """
+    Build the token for the page after (NEXT) or before (PREVIOUS) the row
+    with the given sort key.
+    """
+    payload = json.dumps({'k': [_encode_value(value) for value in key], 'd': direction},
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token: Optional[str], key_length: int) -> Optional[Tuple[Tuple[Any, ...], str]]:
+    """
+    Read a token built by encode_cursor.
+    
+    Returns:
+        Tuple of (sort key, direction), or None for a missing or invalid
+        token, which means the first page
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        key = tuple(_decode_value(value) for value in payload['k'])
+        direction = payload['d']
+    except (ValueError, KeyError, TypeError, binascii.Error) as e:
+        logger.debug(f"Ignoring invalid page token {token[:50]!r}: {str(e)}")
+        return None
+    if len(key) != key_length or direction not in (NEXT, PREVIOUS):
+        return None
+    return key, direction
+
+class KeysetPage:
+    """
+    One page of rows, with the tokens of its neighbouring pages.
+    
+    Attributes:
+        items: Rows of this page, in display order
+        next_token / prev_token: Tokens of the following and preceding
+            pages (None on the last or first page)
+        total: Approximate number of rows overall, if known
+        per_page: Maximum number of rows on a page
+        is_first: Whether this is the first page
+    """
+    
+    def __init__(self, items: List[Any], next_token: Optional[str], prev_token: Optional[str],
+                 total: Optional[int], per_page: int, is_first: bool = True):
+        self.items = items
+        self.next_token = next_token
+        self.prev_token = prev_token
+        self.total = total
+        self.per_page = per_page
+        self.is_first = is_first
+    
+    @property
+    def has_next(self) -> bool:
+        return self.next_token is not None
+    
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_token is not None
+    
+    @property
+    def pages(self) -> Optional[int]:
+        """Approximate number of pages, if the total is known."""
+        if self.total is None:
+            return None
+        return max(1, -(-self.total // self.per_page))
+
+def keyset_paginate(stmt: Select, key_columns: Sequence[Any], token: Optional[str], per_page: int,
+                    descending: bool = False, total: Optional[int] = None) -> KeysetPage:
+    """
+    Fetch one page of a query ordered by key_columns.
+    
+    Args:
+        stmt: Select of the rows; it must include every key column, under
+            the column's own name, and have no ORDER BY or LIMIT
+        key_columns: Columns that together identify a row and define the
+            order, e.g. (created_at, id); an index on them keeps every
+            page equally cheap
+        token: Token from a previous page (None for the first page)
+        per_page: Maximum number of rows on the page
+        descending: Show the largest keys first
+        total: Approximate number of rows, shown as is (no COUNT is run)
+    
+    Returns:
+        The KeysetPage
+    """
+    cursor = decode_cursor(token, len(key_columns))
+    backwards = cursor is not None and cursor[1] == PREVIOUS
+    # Walk in display order for the next page and against it for the previous one
+    ascending = descending == backwards
+    
+    if cursor is not None:
+        key = tuple_(*key_columns)
+        bound = tuple_(*[literal(value, column.type) for value, column in zip(cursor[0], key_columns)])
+        stmt = stmt.where(key > bound if ascending else key < bound)
+    order = [column.asc() if ascending else column.desc() for column in key_columns]
+    
+    # One extra row tells whether there is another page in this direction
+    rows = db.session.execute(stmt.order_by(*order).limit(per_page + 1)).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    
+    def row_key(row):
+        return [getattr(row, column.key) for column in key_columns]
+    
+    next_token = prev_token = None
+    if rows:
+        # Coming from the neighbouring page means that page exists
+        if more or backwards:
+            next_token = encode_cursor(row_key(rows[-1]), NEXT)
+        if (more and backwards) or (cursor is not None and not backwards):
+            prev_token = encode_cursor(row_key(rows[0]), PREVIOUS)
+    
+    is_first = cursor is None or (backwards and not more)
+    return KeysetPage(rows, next_token, prev_token, total, per_page, is_first=is_first)
@@ -2,22 +2,165 @@ import random
 import logging
 import requests
 import time
+import threading
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Optional
+from rate_limiter import RateScheduler
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Circuit breaker states for a proxy
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+class ProxyHealth:
+    """
+    Live health record for a single proxy.
+    
+    Latency and success rate are exponentially weighted moving averages, so
+    recent behaviour counts the most. The record also carries the proxy's
+    circuit breaker: it opens after repeated failures and, once cooled down,
+    half-opens to let a single trial request through.
+    """
+    
+    def __init__(self, address: str, smoothing: float = 0.2):
+        self.address = address
+        self.smoothing = smoothing
+        self.ewma_latency = None
+        self.success_rate = 1.0
+        self.last_blocked_at = 0.0
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+    
+    def record_success(self, latency: float) -> None:
+        """Record a successful request and close the circuit if it was testing."""
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency += self.smoothing * (latency - self.ewma_latency)
+        self.success_rate += self.smoothing * (1.0 - self.success_rate)
+        self.total_requests += 1
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+        
+        if self.state != CIRCUIT_CLOSED:
+            logger.info(f"Proxy {self.address} recovered, closing circuit")
+            self.state = CIRCUIT_CLOSED
+    
+    def record_failure(self, failure_threshold: int, blocked: bool = False) -> None:
+        """
+        Record a failed request, opening the circuit once the proxy has failed
+        failure_threshold times in a row or its half-open trial failed.
+        """
+        self.success_rate -= self.smoothing * self.success_rate
+        self.total_requests += 1
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if blocked:
+            self.last_blocked_at = time.time()
+        
+        if self.state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= failure_threshold:
+            if self.state != CIRCUIT_OPEN:
+                logger.warning(f"Opening circuit for proxy {self.address} after "
+                               f"{self.consecutive_failures} consecutive failures")
+            self.state = CIRCUIT_OPEN
+            self.opened_at = time.time()
+    
+    def is_available(self, now: float, reset_timeout: float) -> bool:
+        """
+        Whether the proxy may take a request now. An open circuit moves to
+        half-open once reset_timeout has passed.
+        """
+        if self.state == CIRCUIT_OPEN:
+            if now - self.opened_at < reset_timeout:
+                return False
+            self.state = CIRCUIT_HALF_OPEN
+            self.trial_in_flight = False
+        
+        if self.state == CIRCUIT_HALF_OPEN:
+            return not self.trial_in_flight
+        
+        return True
+    
+    def weight(self, now: float, block_cooldown: float) -> float:
+        """
+        Selection weight: favours proxies that succeed often and answer fast,
+        and backs off proxies that were recently blocked (CAPTCHA or 429).
+        """
+        latency = self.ewma_latency if self.ewma_latency is not None else 1.0
+        weight = max(self.success_rate, 0.01) ** 2 / max(latency, 0.05)
+        
+        since_block = now - self.last_blocked_at
+        if self.last_blocked_at and since_block < block_cooldown:
+            weight *= max(0.05, since_block / block_cooldown)
+        
+        return weight
+    
+    def to_dict(self) -> Dict:
+        """Snapshot of the health record for reporting."""
+        return {
+            'proxy': self.address,
+            'state': self.state,
+            'ewma_latency': self.ewma_latency,
+            'success_rate': round(self.success_rate, 4),
+            'last_blocked_at': self.last_blocked_at or None,
+            'consecutive_failures': self.consecutive_failures,
+            'total_requests': self.total_requests,
+            'total_failures': self.total_failures
+        }
+
 class ProxyManager:
     """
-    Manages a list of proxy servers and rotates them for making requests.
-    In demo mode, it will make direct requests without proxies.
+    Manages a list of proxy servers and picks one for each request, weighted
+    by each proxy's live health. In demo mode, it will make direct requests
+    without proxies.
     """
     
-    def __init__(self, use_direct_connection=True):
+    def __init__(self, use_direct_connection=True, max_concurrent_per_proxy=4,
+                 pool_connections=10, pool_maxsize=None, session_idle_timeout=300,
+                 failure_threshold=3, circuit_reset_timeout=60, block_cooldown=300,
+                 rate_scheduler=None):
         self.proxies = []
-        self.current_index = 0
         self.last_update = 0
         self.use_direct_connection = use_direct_connection
         
+        # Per-proxy health records and circuit breaker settings
+        self.proxy_health = {}
+        self.failure_threshold = failure_threshold
+        self.circuit_reset_timeout = circuit_reset_timeout
+        self.block_cooldown = block_cooldown
+        
+        # Token buckets pacing requests globally and per proxy route
+        self.rate_scheduler = rate_scheduler or RateScheduler()
+        
+        # Cap on requests in flight through any single proxy (or the direct route)
+        self.max_concurrent_per_proxy = max(1, max_concurrent_per_proxy)
+        self._proxy_slots = {}
+        self._lock = threading.Lock()
+        
+        # One pooled session per proxy (plus one for direct mode) so connections
+        # to the search host are kept alive between checks instead of paying a
+        # new TCP+TLS handshake on every request
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize or self.max_concurrent_per_proxy
+        self.session_idle_timeout = session_idle_timeout
+        self._sessions = {}
+        self._last_eviction = time.monotonic()
+        self.session_stats = {
+            'requests': 0,
+            'session_reuses': 0,
+            'sessions_created': 0,
+            'sessions_evicted': 0,
+            'evicted_connections': 0
+        }
+        
         # Default free proxies for demo purposes
         # In production, you'd use a paid proxy service or your own proxy list
         self.default_proxies = [
@@ -57,33 +200,106 @@ class ProxyManager:
             if not self.proxies:
                 self.proxies = self.default_proxies.copy()
     
-    def get_next_proxy(self) -> Dict[str, str]:
+    def _select_proxy(self) -> Optional[str]:
         """
-        Returns the next proxy in the rotation, or empty dict for direct connection.
+        Picks a proxy address at random, weighted by health. Proxies whose
+        circuit is open are skipped; a half-open proxy gets one trial request.
+        
+        Returns:
+            Proxy address, or None when in direct mode or no proxy is available
         """
         if self.use_direct_connection:
-            # In direct connection mode, return empty dict (no proxy)
-            return {}
-            
+            return None
+        
         if not self.proxies:
             self.update_proxies()
         
         if not self.proxies:
             logger.warning("No proxies available")
-            return {}
+            return None
         
-        # Rotate through proxies
-        self.current_index = (self.current_index + 1) % len(self.proxies)
-        proxy = self.proxies[self.current_index]
+        now = time.time()
+        with self._lock:
+            candidates = []
+            weights = []
+            for address in self.proxies:
+                health = self.proxy_health.get(address)
+                if health is None:
+                    health = self.proxy_health[address] = ProxyHealth(address)
+                if health.is_available(now, self.circuit_reset_timeout):
+                    candidates.append(health)
+                    weights.append(health.weight(now, self.block_cooldown))
+            
+            if not candidates:
+                return None
+            
+            health = random.choices(candidates, weights=weights)[0]
+            if health.state == CIRCUIT_HALF_OPEN:
+                health.trial_in_flight = True
         
-        # Format proxy for requests library
-        proxy_dict = {
-            'http': f'http://{proxy}',
-            'https': f'http://{proxy}'
+        return health.address
+    
+    @staticmethod
+    def _format_proxy(address: Optional[str]) -> Dict[str, str]:
+        """Formats a proxy address for the requests library ({} for direct)."""
+        if not address:
+            return {}
+        return {
+            'http': f'http://{address}',
+            'https': f'http://{address}'
         }
+    
+    def get_next_proxy(self) -> Dict[str, str]:
+        """
+        Returns the next proxy to use, chosen by health-weighted selection,
+        or empty dict for direct connection.
+        """
+        if self.use_direct_connection:
+            # In direct connection mode, return empty dict (no proxy)
+            return {}
         
-        logger.debug(f"Using proxy: {proxy}")
-        return proxy_dict
+        address = self._select_proxy()
+        if address is None:
+            logger.warning("No healthy proxies available")
+            return {}
+        
+        logger.debug(f"Using proxy: {address}")
+        return self._format_proxy(address)
+    
+    def record_result(self, address: Optional[str], latency: float, success: bool,
+                      blocked: bool = False) -> None:
+        """
+        Updates a proxy's health record with the outcome of a request.
+        
+        Args:
+            address: Proxy address (None for direct connections, which are not tracked)
+            latency: Request latency in seconds
+            success: Whether the request succeeded
+            blocked: Whether the search engine blocked the request (CAPTCHA or 429)
+        """
+        if not address:
+            return
+        with self._lock:
+            health = self.proxy_health.get(address)
+            if health is None:
+                health = self.proxy_health[address] = ProxyHealth(address)
+            if success:
+                health.record_success(latency)
+            else:
+                health.record_failure(self.failure_threshold, blocked=blocked)
+    
+    def report_blocked(self, address: Optional[str]) -> None:
+        """
+        Marks a proxy as blocked after a response turned out to be a block
+        page, so selection backs off from it.
+        """
+        self.record_result(address, 0.0, success=False, blocked=True)
+        self.rate_scheduler.penalize(self._route_key(self._format_proxy(address)))
+    
+    def get_proxy_health(self) -> List[Dict]:
+        """Returns a snapshot of every proxy's health record."""
+        with self._lock:
+            return [health.to_dict() for health in self.proxy_health.values()]
     
     def get_random_proxy(self) -> Dict[str, str]:
         """
@@ -92,7 +308,7 @@ class ProxyManager:
         if self.use_direct_connection:
             # In direct connection mode, return empty dict (no proxy)
             return {}
-            
+        
         if not self.proxies:
             self.update_proxies()
         
@@ -111,10 +327,139 @@ class ProxyManager:
         logger.debug(f"Using random proxy: {proxy}")
         return proxy_dict
     
+    @staticmethod
+    def _route_key(proxy: Dict[str, str]) -> str:
+        """Returns the key identifying a proxy route, or 'direct' for no proxy."""
+        return proxy.get('http', 'direct') if proxy else 'direct'
+    
+    def _get_proxy_slot(self, proxy: Dict[str, str]) -> threading.BoundedSemaphore:
+        """
+        Returns the semaphore limiting concurrent requests through a proxy.
+        Direct connections share a single slot pool.
+        """
+        key = self._route_key(proxy)
+        with self._lock:
+            slot = self._proxy_slots.get(key)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_concurrent_per_proxy)
+                self._proxy_slots[key] = slot
+        return slot
+    
+    def _get_session(self, proxy: Dict[str, str]) -> requests.Session:
+        """
+        Returns the pooled session for a proxy route, creating it on first use.
+        """
+        key = self._route_key(proxy)
+        
+        # Opportunistically drop sessions nobody has used for a while
+        if time.monotonic() - self._last_eviction > min(60, self.session_idle_timeout):
+            self.evict_idle_sessions()
+        
+        with self._lock:
+            self.session_stats['requests'] += 1
+            entry = self._sessions.get(key)
+            if entry is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                      pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if proxy:
+                    session.proxies.update(proxy)
+                entry = {'session': session, 'last_used': time.monotonic()}
+                self._sessions[key] = entry
+                self.session_stats['sessions_created'] += 1
+                logger.debug(f"Opened pooled session for {key}")
+            else:
+                self.session_stats['session_reuses'] += 1
+            entry['last_used'] = time.monotonic()
+            return entry['session']
+    
+    @staticmethod
+    def _count_connections(session: requests.Session) -> int:
+        """Returns how many connections a session's pools have opened so far."""
+        opened = 0
+        for adapter in session.adapters.values():
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                for pool_key in manager.pools.keys():
+                    pool = manager.pools.get(pool_key)
+                    if pool is not None:
+                        opened += pool.num_connections
+        return opened
+    
+    def evict_idle_sessions(self, max_idle: Optional[float] = None) -> int:
+        """
+        Closes sessions that have not been used recently.
+        
+        Args:
+            max_idle: Idle time in seconds after which a session is closed
+                      (defaults to session_idle_timeout)
+        
+        Returns:
+            Number of sessions closed
+        """
+        max_idle = self.session_idle_timeout if max_idle is None else max_idle
+        now = time.monotonic()
+        
+        with self._lock:
+            self._last_eviction = now
+            idle_keys = [key for key, entry in self._sessions.items()
+                         if now - entry['last_used'] > max_idle]
+            evicted = [self._sessions.pop(key)['session'] for key in idle_keys]
+            for session in evicted:
+                self.session_stats['evicted_connections'] += self._count_connections(session)
+            self.session_stats['sessions_evicted'] += len(evicted)
+        
+        for session in evicted:
+            session.close()
+        
+        if evicted:
+            logger.debug(f"Evicted {len(evicted)} idle proxy sessions")
+        return len(evicted)
+    
+    def get_session_stats(self) -> Dict[str, int]:
+        """
+        Returns session pool statistics, including how many requests were
+        served over an already-open connection.
+        """
+        with self._lock:
+            stats = dict(self.session_stats)
+            sessions = [entry['session'] for entry in self._sessions.values()]
+        
+        connections = stats['evicted_connections'] + sum(self._count_connections(s) for s in sessions)
+        stats['active_sessions'] = len(sessions)
+        stats['connections_opened'] = connections
+        stats['connection_reuses'] = max(0, stats['requests'] - connections)
+        return stats
+    
+    def close(self) -> None:
+        """Closes all pooled sessions."""
+        self.evict_idle_sessions(max_idle=-1)
+    
+    @staticmethod
+    def _release_slot_on_close(response: requests.Response, slot: threading.BoundedSemaphore) -> None:
+        """Release a proxy slot when a streamed response is closed (once)."""
+        close = response.close
+        released = []
+        
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    slot.release()
+        
+        response.close = close_and_release
+    
     def make_request(self, url: str, method: str = 'GET', max_retries: int = 3, 
                      timeout: int = 10, **kwargs) -> Optional[requests.Response]:
         """
-        Makes a request using a rotating proxy or direct connection.
+        Makes a request through a health-selected proxy or direct connection.
+        Every attempt waits for a slot from the rate scheduler and updates the
+        chosen proxy's health record; if every proxy's circuit is open, that
+        attempt falls back to a direct connection.
         
         Args:
             url: The URL to request
@@ -122,62 +467,83 @@ class ProxyManager:
             max_retries: Maximum number of retries on failure
             timeout: Request timeout in seconds
             **kwargs: Additional arguments to pass to requests
-            
+        
         Returns:
-            Response object or None if all retries fail
+            Response object or None if all retries fail. The response's
+            ``proxy_used`` attribute holds the proxy address it went through
+            (None for direct connections). With stream=True the proxy's
+            concurrency slot stays taken until the response is closed.
         """
+        if method.upper() not in ('GET', 'POST'):
+            logger.error(f"Unsupported method: {method}")
+            return None
+        
         retries = 0
-        max_timeouts = 0  # Track consecutive timeouts
-        while retries < max_retries and max_timeouts < 2:  # Limit consecutive timeouts
-            # Get proxy configuration (empty dict for direct connection)
-            proxy = self.get_next_proxy()
+        while retries < max_retries:
+            # Pick a proxy (None for direct connection)
+            address = self._select_proxy()
+            if address is None and not self.use_direct_connection:
+                logger.warning("No healthy proxies available, using direct connection for this attempt")
+                metrics.DIRECT_FALLBACKS.inc()
+            proxy = self._format_proxy(address)
+            route = self._route_key(proxy)
+            
+            # Wait for a request slot on this route instead of sleeping blindly
+            self.rate_scheduler.acquire(route)
+            slot = self._get_proxy_slot(proxy)
+            slot.acquire()
+            hold_slot = False
+            started = time.monotonic()
             
             try:
+                # The session for this route already carries its proxy settings
+                session = self._get_session(proxy)
                 if method.upper() == 'GET':
-                    # If in direct connection mode, proxies will be empty dict
-                    response = requests.get(
-                        url, 
-                        proxies=proxy if not self.use_direct_connection else None,
-                        timeout=timeout,
-                        **kwargs
-                    )
-                elif method.upper() == 'POST':
-                    response = requests.post(
-                        url,
-                        proxies=proxy if not self.use_direct_connection else None,
-                        timeout=timeout,
-                        **kwargs
-                    )
+                    response = session.get(url, timeout=timeout, **kwargs)
                 else:
-                    logger.error(f"Unsupported method: {method}")
-                    return None
+                    response = session.post(url, timeout=timeout, **kwargs)
                 
+                latency = time.monotonic() - started
                 if response.status_code < 400:
+                    metrics.observe_request(route, 'ok', latency)
+                    self.record_result(address, latency, success=True)
+                    self.rate_scheduler.reward(route)
+                    # Lets callers report a block page back against this proxy
+                    response.proxy_used = address
+                    if kwargs.get('stream'):
+                        # A streamed body keeps its connection busy until the caller closes it
+                        self._release_slot_on_close(response, slot)
+                        hold_slot = True
                     return response
                 else:
+                    # Release the connection of a streamed response we won't read
+                    response.close()
+                    # 429 means the search engine is rate limiting this route
+                    rate_limited = response.status_code == 429
+                    metrics.observe_request(route, 'rate_limited' if rate_limited else 'http_error', latency)
+                    self.record_result(address, latency, success=False, blocked=rate_limited)
+                    if rate_limited:
+                        self.rate_scheduler.penalize(route)
                     logger.warning(f"Request failed with status {response.status_code}, retrying...")
-                    max_timeouts = 0  # Reset timeout counter on different error
             except requests.exceptions.ConnectTimeout as e:
                 logger.warning(f"Connection timeout: {str(e)}, retrying...")
-                max_timeouts += 1
-                if max_timeouts >= 2:
-                    # If we get multiple timeouts, switch to direct connection
-                    logger.warning("Multiple timeouts detected, switching to direct connection")
-                    self.use_direct_connection = True
+                metrics.observe_request(route, 'timeout', time.monotonic() - started)
+                self.record_result(address, time.monotonic() - started, success=False)
             except requests.exceptions.ReadTimeout as e:
                 logger.warning(f"Read timeout: {str(e)}, retrying...")
-                max_timeouts += 1
-                if max_timeouts >= 2:
-                    # If we get multiple timeouts, switch to direct connection
-                    logger.warning("Multiple timeouts detected, switching to direct connection")
-                    self.use_direct_connection = True
+                metrics.observe_request(route, 'timeout', time.monotonic() - started)
+                self.record_result(address, time.monotonic() - started, success=False)
             except requests.exceptions.RequestException as e:
                 logger.warning(f"Request failed: {str(e)}, retrying...")
-                max_timeouts = 0  # Reset timeout counter on different error
+                metrics.observe_request(route, 'error', time.monotonic() - started)
+                self.record_result(address, time.monotonic() - started, success=False)
+            finally:
+                if not hold_slot:
+                    slot.release()
             
             retries += 1
-            # Exponential backoff
-            time.sleep(0.5)  # Reduced delay for faster response
+            if retries < max_retries:
+                metrics.REQUEST_RETRIES.labels(route).inc()
         
         logger.error(f"Failed to make request to {url} after {max_retries} retries")
         return None
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Classic token bucket: tokens refill continuously at `rate` per second up
+    to `capacity`, and each request consumes one token.
+    
+    The rate adapts AIMD-style: it is cut multiplicatively when the remote
+    side pushes back (429 or block page) and recovers additively on success.
+    """
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 min_rate: float = 0.05, recovery_step: float = 0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.min_rate = min(min_rate, rate)
+        self.recovery_step = recovery_step
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+    
+    def _refill(self, now: float) -> None:
+        """Add the tokens accumulated since the last update."""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+    
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def consume(self) -> None:
+        """Take one token; callers must check wait_time first."""
+        self.tokens -= 1
+    
+    def penalize(self, factor: float = 0.5) -> None:
+        """Cut the refill rate after the remote side pushed back."""
+        self.rate = max(self.min_rate, self.rate * factor)
+        self.tokens = min(self.tokens, 0.0)
+    
+    def reward(self) -> None:
+        """Recover the refill rate towards its configured maximum."""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.recovery_step * self.max_rate)
+
+class RateScheduler:
+    """
+    Hands out request slots from one global token bucket plus one bucket per
+    proxy route. A request only proceeds once both buckets have a token, so
+    pacing follows each route's actual quota instead of fixed sleeps.
+    """
+    
+    def __init__(self, global_rate: float = 10.0, per_proxy_rate: float = 2.0,
+                 burst: Optional[float] = None, min_rate: float = 0.05,
+                 recovery_step: float = 0.05):
+        self.per_proxy_rate = per_proxy_rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.recovery_step = recovery_step
+        self.global_bucket = TokenBucket(global_rate, burst, min_rate, recovery_step)
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def _bucket(self, key: str) -> TokenBucket:
+        """Returns the bucket for a route, creating it on first use (lock held)."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.per_proxy_rate, self.burst, self.min_rate, self.recovery_step)
+            self._buckets[key] = bucket
+        return bucket
+    
+    def acquire(self, key: str, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until a request slot is available for a route.
+        
+        Args:
+            key: Proxy route key ('direct' for direct connections)
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+        
+        Returns:
+            True if a slot was granted, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                bucket = self._bucket(key)
+                wait = max(bucket.wait_time(now), self.global_bucket.wait_time(now))
+                if wait == 0:
+                    # Take both tokens together so neither is held while waiting on the other
+                    bucket.consume()
+                    self.global_bucket.consume()
+                    return True
+            
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+    
+    def penalize(self, key: str) -> None:
+        """Slow down a route (and the global rate) after a 429 or block page."""
+        with self._lock:
+            bucket = self._bucket(key)
+            bucket.penalize()
+            self.global_bucket.penalize(factor=0.9)
+            logger.debug(f"Rate for {key} reduced to {bucket.rate:.2f}/s")
+    
+    def reward(self, key: str) -> None:
+        """Let a route's rate recover after a successful request."""
+        with self._lock:
+            self._bucket(key).reward()
+            self.global_bucket.reward()
+    
+    def get_rates(self) -> Dict[str, float]:
+        """Current refill rate per route, plus the global rate."""
+        with self._lock:
+            rates = {key: bucket.rate for key, bucket in self._buckets.items()}
+            rates['global'] = self.global_bucket.rate
+        return rates
@@ -1,7 +1,7 @@
 import io
 import csv
 import logging
-from typing import List, Dict
+from typing import List, Dict, Iterable, Tuple
 from datetime import datetime
 
 # Use try/except for pandas import in case it's not available
@@ -20,14 +20,16 @@ class ReportGenerator:
     def __init__(self):
         pass
     
-    def generate_report(self, report, results: List[Dict]) -> Dict:
+    def generate_report(self, report, results: List[Dict], domain_rows: Iterable[Tuple[str, int, int]] = ()) -> Dict:
         """
         Generate a report from check results.
         
         Args:
             report: Report database model
             results: List of dictionaries containing check results
-            
+            domain_rows: Per-domain counts for the whole report, as
+                (domain, total, indexed) tuples aggregated by the database
+        
         Returns:
             Dictionary with report metrics and visualizations
         """
@@ -46,46 +48,19 @@ class ReportGenerator:
             'colors': ['#28a745', '#dc3545']
         }
         
-        # Generate domain-level statistics
-        domains = {}
-        for r in results:
-            try:
-                # Extract domain from URL safely
-                url = r['url']
-                if '//' in url:
-                    domain = url.split('//', 1)[-1].split('/', 1)[0]
-                else:
-                    # Handle URLs without protocol
-                    domain = url.split('/', 1)[0]
-                
-                # Skip empty domains
-                if not domain:
-                    continue
-                    
-                if domain not in domains:
-                    domains[domain] = {'total': 0, 'indexed': 0}
-                
-                domains[domain]['total'] += 1
-                if r['is_indexed']:
-                    domains[domain]['indexed'] += 1
-            except Exception as e:
-                logger.warning(f"Error extracting domain from URL {r.get('url', 'unknown')}: {str(e)}")
-                continue
-        
-        # Calculate domain indexing rates
+        # Calculate domain indexing rates, keeping the order of the rows
         domain_stats = []
-        for domain, stats in domains.items():
-            indexing_rate = (stats['indexed'] / stats['total'] * 100) if stats['total'] > 0 else 0
+        for domain, total, indexed in domain_rows:
+            indexed = indexed or 0
+            indexing_rate = (indexed / total * 100) if total else 0
             domain_stats.append({
                 'domain': domain,
-                'total': stats['total'],
-                'indexed': stats['indexed'],
+                'total': total,
+                'indexed': indexed,
+                'not_indexed': total - indexed,
                 'indexing_rate': round(indexing_rate, 2)
             })
         
-        # Sort domain stats by indexing rate descending
-        domain_stats.sort(key=lambda x: x['indexing_rate'], reverse=True)
-        
         return {
             'indexed_count': indexed_count,
             'total_count': total_count,
@@ -102,7 +77,7 @@ class ReportGenerator:
         Args:
             report: Report database model
             results: List of dictionaries containing check results
-            
+        
         Returns:
             CSV data as a string
         """
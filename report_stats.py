@@ -0,0 +1,233 @@
+"""
+Report snapshots: the aggregates shown on a report page, computed once
+when the report's run finishes and stored in report_stats.
+
+A report no longer changes once its run is over, so its counts, domain
+breakdown, status changes and checked_at histogram are aggregated over
+check_results a single time and every later view reads one row.
+"""
+import json
+import logging
+import os
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from app import db
+from models import URL, CheckResult, Report, ReportStats, Job
+
+logger = logging.getLogger(__name__)
+
+# Bump when the snapshot layout changes; older snapshots are recomputed
+SNAPSHOT_VERSION = 1
+
+# Largest domains kept in a snapshot; pages past them are aggregated live
+SNAPSHOT_MAX_DOMAINS = int(os.environ.get('REPORT_SNAPSHOT_DOMAINS', 1000))
+
+# Number of equal-width buckets in the checked_at histogram
+HISTOGRAM_BUCKETS = 24
+
+def report_domain_stats(report_id: int, limit: int, offset: int = 0) -> Tuple[List[Tuple[str, int, int]], int]:
+    """
+    Per-domain counts over all results of a report, aggregated in the
+    database with a GROUP BY on the stored host, largest domains first.
+    
+    Args:
+        report_id: Id of the report
+        limit: Number of domains to return (top-N)
+        offset: Number of domains to skip, for paging
+    
+    Returns:
+        Tuple of (list of (domain, total, indexed) rows, number of domains)
+    """
+    scope = select(URL.host) \
+        .select_from(CheckResult) \
+        .join(URL, URL.id == CheckResult.url_id) \
+        .where(CheckResult.report_id == report_id, URL.host.is_not(None))
+    
+    total = func.count(CheckResult.id)
+    rows = db.session.execute(
+        scope.add_columns(total, func.sum(case((CheckResult.is_indexed, 1), else_=0)))
+        .group_by(URL.host)
+        .order_by(total.desc(), URL.host)
+        .limit(limit)
+        .offset(offset)
+    ).tuples().all()
+    
+    domain_count = db.session.execute(
+        select(func.count()).select_from(scope.group_by(URL.host).subquery())
+    ).scalar()
+    return [(domain, total, indexed or 0) for domain, total, indexed in rows], domain_count
+
+def _result_counts(report_id: int) -> Dict[str, int]:
+    """Total, indexed and cached results of a report, in one aggregate."""
+    total, indexed, cached = db.session.execute(
+        select(func.count(CheckResult.id),
+               func.sum(case((CheckResult.is_indexed, 1), else_=0)),
+               func.sum(case((CheckResult.cached, 1), else_=0)))
+        .where(CheckResult.report_id == report_id)
+    ).one()
+    return {'total': total or 0, 'indexed': indexed or 0, 'cached': cached or 0}
+
+def _status_changes(report_id: int) -> Dict[str, int]:
+    """
+    Compare each result of a report with the URL's previous result, as
+    counts of first checks, newly indexed, deindexed and unchanged URLs.
+    """
+    previous = aliased(CheckResult)
+    previous_is_indexed = select(previous.is_indexed) \
+        .where(previous.url_id == CheckResult.url_id, previous.id < CheckResult.id) \
+        .order_by(previous.id.desc()) \
+        .limit(1) \
+        .scalar_subquery()
+    
+    pairs = select(CheckResult.is_indexed.label('is_indexed'), previous_is_indexed.label('was_indexed')) \
+        .where(CheckResult.report_id == report_id) \
+        .subquery()
+    rows = db.session.execute(
+        select(pairs.c.is_indexed, pairs.c.was_indexed, func.count())
+        .group_by(pairs.c.is_indexed, pairs.c.was_indexed)
+    ).all()
+    
+    changes = {'first_check': 0, 'newly_indexed': 0, 'deindexed': 0,
+               'still_indexed': 0, 'still_not_indexed': 0}
+    for is_indexed, was_indexed, count in rows:
+        if was_indexed is None:
+            key = 'first_check'
+        elif is_indexed and not was_indexed:
+            key = 'newly_indexed'
+        elif was_indexed and not is_indexed:
+            key = 'deindexed'
+        else:
+            key = 'still_indexed' if is_indexed else 'still_not_indexed'
+        changes[key] += count
+    return changes
+
+def _checked_at_histogram(report_id: int, buckets: int = HISTOGRAM_BUCKETS) -> List[Dict]:
+    """
+    Results of a report per equal-width checked_at bucket, between its
+    first and last check. Counts below every bucket edge are summed in a
+    single pass, which works the same on every database.
+    """
+    in_report = CheckResult.report_id == report_id
+    first, last, counted = db.session.execute(
+        select(func.min(CheckResult.checked_at), func.max(CheckResult.checked_at),
+               func.count(CheckResult.checked_at))
+        .where(in_report)
+    ).one()
+    if not counted:
+        return []
+    
+    span = last - first
+    if not span:
+        buckets = 1
+    width = span / buckets
+    edges = [first + width * i for i in range(1, buckets)]
+    
+    below = []
+    if edges:
+        below = list(db.session.execute(
+            select(*[func.sum(case((CheckResult.checked_at < edge, 1), else_=0)) for edge in edges])
+            .where(in_report)
+        ).one())
+    cumulative = [0] + [count or 0 for count in below] + [counted]
+    
+    starts = [first] + edges
+    ends = edges + [last]
+    return [
+        {'start': start.isoformat(), 'end': end.isoformat(), 'count': cumulative[i + 1] - cumulative[i]}
+        for i, (start, end) in enumerate(zip(starts, ends))
+    ]
+
+def build_report_snapshot(report_id: int) -> Dict:
+    """
+    Aggregate a report's results into a snapshot.
+    
+    Args:
+        report_id: Id of the report
+    
+    Returns:
+        Dictionary with the result counts, index rate, the largest
+        domains as (domain, total, indexed) rows plus the number of
+        domains, status-change counts and the checked_at histogram
+    """
+    counts = _result_counts(report_id)
+    domains, domain_count = report_domain_stats(report_id, limit=SNAPSHOT_MAX_DOMAINS)
+    total = counts['total']
+    
+    return {
+        'version': SNAPSHOT_VERSION,
+        'created_at': datetime.utcnow().isoformat(),
+        'total': total,
+        'indexed': counts['indexed'],
+        'not_indexed': total - counts['indexed'],
+        'cached': counts['cached'],
+        'index_rate': (counts['indexed'] / total * 100) if total > 0 else 0,
+        'domain_count': domain_count,
+        'domains': [list(row) for row in domains],
+        'status_changes': _status_changes(report_id),
+        'checked_at_histogram': _checked_at_histogram(report_id)
+    }
+
+def save_report_snapshot(report_id: int, snapshot: Optional[Dict] = None) -> Dict:
+    """
+    Store the snapshot of a finished report, replacing any older one.
+    
+    Args:
+        report_id: Id of the report
+        snapshot: Snapshot already built by build_report_snapshot
+            (computed here when not given)
+    
+    Returns:
+        The stored snapshot
+    """
+    if snapshot is None:
+        snapshot = build_report_snapshot(report_id)
+    payload = zlib.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+    db.session.merge(ReportStats(report_id=report_id, version=SNAPSHOT_VERSION, payload=payload,
+                                 created_at=datetime.utcnow()))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process stored the same snapshot first
+        db.session.rollback()
+    logger.info(f"Stored snapshot of report {report_id} ({snapshot['total']} results, {len(payload)} bytes)")
+    return snapshot
+
+def load_report_snapshot(report_id: int) -> Optional[Dict]:
+    """The stored snapshot of a report, or None if it has none (or an outdated one)."""
+    stats = db.session.get(ReportStats, report_id)
+    if stats is None or stats.version != SNAPSHOT_VERSION:
+        return None
+    return json.loads(zlib.decompress(stats.payload))
+
+def is_report_final(report: Report, result_count: int) -> bool:
+    """
+    Whether a report's run is over: its job has finished or, for runs
+    checked inline, a result exists for every submitted URL.
+    """
+    job = Job.query.filter_by(report_id=report.id).first()
+    if job is not None:
+        return not job.is_active
+    return result_count >= (report.total_urls or 0)
+
+def get_report_snapshot(report: Report) -> Dict:
+    """
+    The snapshot of a report. Reports without a stored snapshot (still
+    running, or finished before snapshots existed) are aggregated live,
+    and the snapshot is stored once the run is over.
+    """
+    snapshot = load_report_snapshot(report.id)
+    if snapshot is not None:
+        return snapshot
+    
+    snapshot = build_report_snapshot(report.id)
+    if is_report_final(report, snapshot['total']):
+        try:
+            save_report_snapshot(report.id, snapshot)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Could not store snapshot of report {report.id}: {str(e)}")
+    return snapshot
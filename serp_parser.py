@@ -0,0 +1,180 @@
+import logging
+from html.parser import HTMLParser
+from typing import Iterable, Optional, Set
+from urllib.parse import parse_qs, urlsplit
+from url_ingest import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of checking one results page
+INDEXED = 'indexed'
+NOT_INDEXED = 'not_indexed'
+BLOCKED = 'blocked'
+ERROR = 'error'
+
+# Text that only appears on CAPTCHA / "unusual traffic" interstitials
+BLOCK_PHRASES = (
+    'unusual traffic from your computer network',
+    'our systems have detected unusual traffic',
+    "to continue, please type the characters",
+    "i'm not a robot",
+)
+MIN_BLOCK_PHRASE_LENGTH = min(len(phrase) for phrase in BLOCK_PHRASES)
+
+# Size of the decoded chunks fed to the parser
+PARSE_CHUNK_SIZE = 16 * 1024
+
+# id of the "next page" link under the results
+NEXT_PAGE_ID = 'pnnext'
+
+def link_key(url: str) -> Optional[str]:
+    """
+    Key used to compare result links with checked URLs: the canonical URL
+    without its scheme, since results may list the http or https variant.
+    """
+    canonical = canonicalize_url(url)
+    return canonical.split('://', 1)[1] if canonical else None
+
+def _unwrap_href(href: str) -> str:
+    """Return the target of a search engine /url?q= redirect link."""
+    if href.startswith('/url?'):
+        params = parse_qs(urlsplit(href).query)
+        return (params.get('q') or params.get('url') or [''])[0]
+    return href
+
+class SerpResult:
+    """Structured outcome of checking a results page."""
+    
+    def __init__(self, status: str, links: Optional[Set[str]] = None, proxy: Optional[str] = None,
+                 has_next: bool = False, next_start: Optional[int] = None):
+        self.status = status
+        # Link keys seen on the page (possibly partial after an early exit)
+        self.links = links if links is not None else set()
+        # Proxy the page was fetched through (None for direct connections)
+        self.proxy = proxy
+        # Whether the page links to a next page, and the start offset that
+        # link asks for (None if it does not say)
+        self.has_next = has_next
+        self.next_start = next_start
+    
+    @property
+    def is_indexed(self) -> bool:
+        return self.status == INDEXED
+    
+    def __repr__(self):
+        return f'<SerpResult {self.status}>'
+
+class ResultPageParser(HTMLParser):
+    """
+    Incremental parser that collects result links, notes the link to the
+    next results page and watches for block pages. Feed it decoded chunks;
+    it can be abandoned as soon as ``matched`` or ``blocked`` is set.
+    """
+    
+    def __init__(self, targets: Optional[Iterable[str]] = None):
+        super().__init__(convert_charrefs=True)
+        self.targets = set(targets or ())
+        self.links = set()
+        self.matched = None
+        self.blocked = False
+        self.has_next = False
+        self.next_start = None
+        self._skip_data = 0
+    
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        
+        if tag == 'a':
+            href = attrs.get('href')
+            if not href:
+                return
+            if attrs.get('id') == NEXT_PAGE_ID:
+                self.has_next = True
+                start = parse_qs(urlsplit(href).query).get('start', [''])[0]
+                self.next_start = int(start) if start.isdigit() else None
+                return
+            # Attribute values arrive with entities already decoded
+            href = _unwrap_href(href)
+            if href.startswith(('http://', 'https://')):
+                key = link_key(href)
+                if key:
+                    self.links.add(key)
+                    if key in self.targets:
+                        self.matched = key
+        elif tag == 'form':
+            # The CAPTCHA interstitial posts to /sorry/
+            if '/sorry' in (attrs.get('action') or '') or attrs.get('id') == 'captcha-form':
+                self.blocked = True
+        elif tag in ('div', 'script'):
+            if 'g-recaptcha' in (attrs.get('class') or '') or 'recaptcha' in (attrs.get('src') or ''):
+                self.blocked = True
+        
+        if tag in ('script', 'style'):
+            self._skip_data += 1
+    
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self._skip_data:
+            self._skip_data -= 1
+    
+    def handle_data(self, data):
+        # Only visible text is scanned, one text node at a time; nodes
+        # shorter than the shortest phrase cannot hold one
+        if self.blocked or self._skip_data or len(data) < MIN_BLOCK_PHRASE_LENGTH:
+            return
+        text = data.lower()
+        if any(phrase in text for phrase in BLOCK_PHRASES):
+            self.blocked = True
+
+def parse_result_page(response, targets: Optional[Iterable[str]] = None,
+                      chunk_size: int = PARSE_CHUNK_SIZE) -> SerpResult:
+    """
+    Stream a results page through ResultPageParser, stopping as soon as one
+    of the targets is found or the page turns out to be a block page. The
+    response is closed either way.
+    
+    Args:
+        response: A requests.Response, ideally requested with stream=True
+        targets: Link keys (see link_key) to look for
+        chunk_size: Size of the decoded chunks fed to the parser
+    
+    Returns:
+        SerpResult: INDEXED if a target was found, BLOCKED for CAPTCHA
+        pages, ERROR if the body could not be read, NOT_INDEXED otherwise
+    """
+    proxy = getattr(response, 'proxy_used', None)
+    
+    # Redirects to the CAPTCHA interstitial end up under /sorry/
+    if '/sorry/' in (response.url or ''):
+        response.close()
+        return SerpResult(BLOCKED, proxy=proxy)
+    
+    parser = ResultPageParser(targets)
+    response.encoding = response.encoding or 'utf-8'
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size, decode_unicode=True):
+            parser.feed(chunk)
+            if parser.matched or parser.blocked:
+                break
+    except Exception as e:
+        logger.warning(f"Error reading results page: {str(e)}")
+        return SerpResult(ERROR, parser.links, proxy)
+    finally:
+        response.close()
+    
+    if parser.blocked:
+        status = BLOCKED
+    elif parser.matched:
+        status = INDEXED
+    else:
+        status = NOT_INDEXED
+    return SerpResult(status, parser.links, proxy, parser.has_next, parser.next_start)
+
+def parse_result_html(html: str, targets: Optional[Iterable[str]] = None) -> SerpResult:
+    """Parse an already downloaded results page (see parse_result_page)."""
+    parser = ResultPageParser(targets)
+    parser.feed(html)
+    parser.close()
+    if parser.blocked:
+        return SerpResult(BLOCKED, parser.links)
+    return SerpResult(INDEXED if parser.matched else NOT_INDEXED, parser.links,
+                      has_next=parser.has_next, next_start=parser.next_start)
@@ -169,25 +169,41 @@ class IndexyMascot {
             this.setState('working');
             this.showMessage("I'm checking your URLs now. This might take a moment for large batches.", 5000);
             
-            // Set up progress tracking animations
-            const progressCheck = () => {
-                const progressElement = document.getElementById('progress-bar');
-                if (progressElement) {
-                    const progress = parseInt(progressElement.style.width || '0');
-                    if (progress < 30) {
-                        this.showMessage("Starting to crawl through your URLs...", 3000);
-                    } else if (progress < 70) {
-                        this.showMessage("Making good progress! Keep waiting...", 3000);
-                    } else if (progress < 100) {
-                        this.showMessage("Almost done with your batch!", 3000);
-                    } else {
-                        this.setState('happy');
-                        this.showMessage("All done! Your results will be displayed shortly.", 3000);
-                    }
+            // Follow the progress updates pushed to the page, speaking up
+            // only when the job reaches a new milestone
+            let lastMilestone = null;
+            document.addEventListener('indexing-progress', (event) => {
+                const data = event.detail;
+                let milestone;
+                if (data.done) {
+                    milestone = 'done';
+                } else if (data.stage !== 'checking') {
+                    milestone = 'storing';
+                } else if (data.percentage < 30) {
+                    milestone = 'start';
+                } else if (data.percentage < 70) {
+                    milestone = 'middle';
+                } else {
+                    milestone = 'end';
                 }
-            };
-            
-            setInterval(progressCheck, 5000);
+                if (milestone === lastMilestone) {
+                    return;
+                }
+                lastMilestone = milestone;
+                
+                if (milestone === 'storing') {
+                    this.showMessage("Adding your URLs to the database first...", 3000);
+                } else if (milestone === 'start') {
+                    this.showMessage("Starting to crawl through your URLs...", 3000);
+                } else if (milestone === 'middle') {
+                    this.showMessage("Making good progress! Keep waiting...", 3000);
+                } else if (milestone === 'end') {
+                    this.showMessage("Almost done with your batch!", 3000);
+                } else {
+                    this.setState('happy');
+                    this.showMessage("All done! Your results will be displayed shortly.", 3000);
+                }
+            });
         } else if (pathname.includes('/reports')) {
             // Reports page
             this.setState('happy');
@@ -0,0 +1,7 @@
+"""Shared test setup: the app is imported against a throwaway SQLite database."""
+import os
+import tempfile
+
+os.environ.setdefault('SESSION_SECRET', 'test')
+os.environ.setdefault('EMBEDDED_WORKER', '0')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
@@ -0,0 +1,53 @@
+"""Adaptive batch sizing."""
+import metrics
+from adaptive_batcher import AdaptiveBatcher
+
+def make_batcher(**kwargs):
+    options = dict(initial_size=1000, min_size=100, max_size=10000, target_commit_seconds=1.0)
+    options.update(kwargs)
+    return AdaptiveBatcher('test', **options)
+
+def test_short_batches_are_ignored():
+    batcher = make_batcher()
+    assert batcher.record(400, 60.0) == 1000
+
+def test_fast_batches_grow():
+    batcher = make_batcher()
+    assert batcher.record(1000, 1.0, commit_seconds=0.1) == 1500
+
+def test_growth_is_capped_by_commit_headroom():
+    batcher = make_batcher()
+    # 0.8s commits leave room for 1250 rows, less 10%
+    assert batcher.record(1000, 1.0, commit_seconds=0.8) == 1125
+
+def test_slow_commits_shrink_toward_target():
+    batcher = make_batcher()
+    assert batcher.record(1000, 3.0, commit_seconds=1.25) == 720
+
+def test_shrink_is_at_most_half():
+    batcher = make_batcher()
+    assert batcher.record(1000, 60.0) == 500
+
+def test_max_batch_seconds_shrinks_long_batches():
+    batcher = make_batcher(max_batch_seconds=10.0)
+    # Commits are quick but the whole batch took twice the limit
+    assert batcher.record(1000, 20.0, commit_seconds=0.1) == 500
+
+def test_size_stays_within_bounds():
+    batcher = make_batcher(initial_size=150, max_size=2000)
+    assert batcher.record(150, 60.0) == 100
+    
+    batcher = make_batcher(initial_size=1800, max_size=2000)
+    assert batcher.record(1800, 1.0, commit_seconds=0.01) == 2000
+
+def test_memory_limit_halves_size(monkeypatch):
+    monkeypatch.setattr(metrics, 'current_rss_bytes', lambda: 2 * 1024 ** 3)
+    batcher = make_batcher(max_rss_bytes=1024 ** 3)
+    assert batcher.record(1000, 1.0, commit_seconds=0.1) == 500
+
+def test_climb_turns_back_when_throughput_drops():
+    batcher = make_batcher()
+    batcher.record(1000, 1.0, commit_seconds=0.1)
+    # 1500 rows at a much lower rate: the next probe goes below the best size
+    size = batcher.record(1500, 3.0, commit_seconds=0.1)
+    assert size < 1000
@@ -0,0 +1,75 @@
+"""Grouped site: queries against the local fake search engine."""
+import pytest
+
+from benchmarks.fake_servers import Corpus, FakeSearchServer, ServerProfile
+from indexing_checker import IndexingChecker
+from proxy_manager import ProxyManager
+from rate_limiter import RateScheduler
+
+RESULTS_PER_PAGE = 10
+
+@pytest.fixture
+def make_checker():
+    """Start a fake search engine over a corpus and return a checker using it."""
+    servers = []
+    
+    def factory(corpus, max_listing=None, page_size=None, results_per_page=RESULTS_PER_PAGE):
+        server = FakeSearchServer(corpus, ServerProfile(median_ms=0), page_bytes=0,
+                                  max_listing=max_listing, page_size=page_size).start()
+        servers.append(server)
+        manager = ProxyManager(use_direct_connection=True,
+                               rate_scheduler=RateScheduler(global_rate=10000, per_proxy_rate=10000))
+        checker = IndexingChecker(manager, demo_mode=False, search_url=server.search_url,
+                                  results_per_page=results_per_page, request_timeout=5)
+        return checker, server
+    
+    yield factory
+    for server in servers:
+        server.stop()
+
+def test_small_hosts_are_resolved_by_one_query_each(make_checker):
+    # 8 URLs per host: every listing fits on its first page
+    corpus = Corpus(40, urls_per_host=8, indexed_ratio=0.5, namespace='small')
+    checker, server = make_checker(corpus)
+    
+    results = checker.check_urls(list(corpus))
+    
+    assert results == {url: corpus.is_indexed(url) for url in corpus}
+    assert server.stats['requests'] == 5
+
+def test_capped_listing_falls_back_to_per_url_queries(make_checker):
+    # The listing stops after 15 results, like a search engine thinning out
+    # the site: listing of a large site; URLs past it must not be reported
+    # as not indexed without a query of their own
+    corpus = Corpus(60, urls_per_host=60, indexed_ratio=0.8, namespace='large')
+    checker, server = make_checker(corpus, max_listing=15)
+    
+    results = checker.check_urls(list(corpus))
+    
+    assert results == {url: corpus.is_indexed(url) for url in corpus}
+    listed = set(corpus.search(corpus.host(0))[:15])
+    grouped_pages = 2
+    assert server.stats['requests'] == grouped_pages + len(set(corpus) - listed)
+
+def test_engine_ignoring_page_size_is_followed_by_next_links(make_checker):
+    # The engine serves 10 results per page although 100 are asked for; a
+    # short first page with a next-page link is not the whole listing
+    corpus = Corpus(50, urls_per_host=50, indexed_ratio=0.6, namespace='paged')
+    checker, server = make_checker(corpus, page_size=10, results_per_page=100)
+    
+    results = checker.check_urls(list(corpus))
+    
+    assert results == {url: corpus.is_indexed(url) for url in corpus}
+    listed = corpus.search(corpus.host(0))
+    grouped_pages = -(-len(listed) // 10)
+    assert server.stats['requests'] == grouped_pages + len(corpus) - len(listed)
+
+def test_grouped_queries_can_be_disabled(make_checker):
+    corpus = Corpus(12, urls_per_host=6, indexed_ratio=0.5, namespace='plain')
+    checker, server = make_checker(corpus)
+    checker.grouped_queries = False
+    
+    results = checker.check_urls(list(corpus))
+    
+    assert results == {url: corpus.is_indexed(url) for url in corpus}
+    assert server.stats['requests'] == len(corpus)
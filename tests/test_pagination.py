@@ -0,0 +1,89 @@
+"""Keyset pagination of the results pages."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+
+from app import app, db
+from models import URL
+from pagination import NEXT, decode_cursor, encode_cursor, keyset_paginate
+
+PER_PAGE = 4
+KEY = (URL.created_at, URL.id)
+
+@pytest.fixture
+def urls():
+    """25 URLs whose creation times repeat, so pages split ties on id."""
+    with app.app_context():
+        db.session.execute(delete(URL))
+        start = datetime(2024, 1, 1)
+        db.session.add_all(URL(url=f'https://example.com/{i}', created_at=start + timedelta(minutes=i // 3))
+                           for i in range(25))
+        db.session.commit()
+        yield
+        db.session.execute(delete(URL))
+        db.session.commit()
+
+def all_keys(descending):
+    ordered = [column.desc() if descending else column.asc() for column in KEY]
+    return [tuple(row) for row in db.session.execute(select(*KEY).order_by(*ordered))]
+
+def walk(descending):
+    """Follow next tokens to the end, then prev tokens back to the start."""
+    stmt = select(URL.id, URL.created_at, URL.url)
+    forward, pages = [], []
+    page = keyset_paginate(stmt, KEY, None, PER_PAGE, descending=descending)
+    pages.append(page)
+    while page.has_next:
+        page = keyset_paginate(stmt, KEY, page.next_token, PER_PAGE, descending=descending)
+        pages.append(page)
+    for page in pages:
+        forward.extend((row.created_at, row.id) for row in page.items)
+    
+    backward = []
+    while page.has_prev:
+        page = keyset_paginate(stmt, KEY, page.prev_token, PER_PAGE, descending=descending)
+        backward.insert(0, [(row.created_at, row.id) for row in page.items])
+    return forward, pages, backward, page
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_cover_every_row_once_in_order(urls, descending):
+    with app.app_context():
+        forward, pages, backward, first = walk(descending)
+        
+        assert forward == all_keys(descending)
+        assert [len(page.items) for page in pages] == [4, 4, 4, 4, 4, 4, 1]
+        assert pages[0].is_first and not pages[0].has_prev
+        assert not pages[-1].has_next
+        # Walking back gives the same pages and ends on the first one
+        assert backward == [[(row.created_at, row.id) for row in page.items] for page in pages[:-1]]
+        assert first.is_first and not first.has_prev
+
+def test_empty_query(urls):
+    with app.app_context():
+        page = keyset_paginate(select(URL.id, URL.created_at).where(URL.id < 0), KEY, None, PER_PAGE)
+        
+        assert page.items == []
+        assert not page.has_next and not page.has_prev
+        assert page.is_first
+
+def test_invalid_token_gives_first_page(urls):
+    with app.app_context():
+        stmt = select(URL.id, URL.created_at)
+        first = keyset_paginate(stmt, KEY, None, PER_PAGE)
+        
+        for token in ('not-a-token', encode_cursor([1], NEXT)):
+            page = keyset_paginate(stmt, KEY, token, PER_PAGE)
+            assert [row.id for row in page.items] == [row.id for row in first.items]
+            assert page.is_first
+
+def test_cursor_round_trip():
+    key = (datetime(2024, 1, 1, 12, 30), 42)
+    assert decode_cursor(encode_cursor(key, NEXT), 2) == (key, NEXT)
+    assert decode_cursor(encode_cursor(key, NEXT), 3) is None
+    assert decode_cursor(None, 2) is None
+
+def test_page_count():
+    with app.app_context():
+        page = keyset_paginate(select(URL.id, URL.created_at).where(URL.id < 0), KEY, None, 10, total=25)
+        assert page.pages == 3
@@ -0,0 +1,60 @@
+"""Token bucket pacing."""
+import pytest
+
+from rate_limiter import RateScheduler, TokenBucket
+
+def test_bucket_starts_full_and_empties():
+    bucket = TokenBucket(rate=2.0, capacity=2)
+    now = bucket.updated_at
+    
+    for _ in range(2):
+        assert bucket.wait_time(now) == 0
+        bucket.consume()
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+
+def test_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(rate=2.0, capacity=2)
+    now = bucket.updated_at
+    bucket.consume()
+    bucket.consume()
+    
+    assert bucket.wait_time(now + 0.25) == pytest.approx(0.25)
+    assert bucket.wait_time(now + 0.5) == 0
+    bucket.wait_time(now + 60)
+    assert bucket.tokens == 2
+
+def test_penalize_cuts_rate_and_drains_tokens():
+    bucket = TokenBucket(rate=4.0, min_rate=1.0)
+    
+    bucket.penalize()
+    assert bucket.rate == 2.0
+    assert bucket.tokens == 0
+    for _ in range(5):
+        bucket.penalize()
+    assert bucket.rate == 1.0
+
+def test_reward_recovers_to_max_rate():
+    bucket = TokenBucket(rate=10.0, recovery_step=0.25)
+    bucket.penalize(factor=0.1)
+    
+    bucket.reward()
+    assert bucket.rate == pytest.approx(3.5)
+    for _ in range(10):
+        bucket.reward()
+    assert bucket.rate == 10.0
+
+def test_scheduler_times_out_when_route_is_exhausted():
+    scheduler = RateScheduler(global_rate=100, per_proxy_rate=1, burst=1)
+    
+    assert scheduler.acquire('direct', timeout=0)
+    assert not scheduler.acquire('direct', timeout=0.01)
+    # Other routes have their own bucket
+    assert scheduler.acquire('proxy-1', timeout=0)
+
+def test_scheduler_penalize_slows_route_and_global_rate():
+    scheduler = RateScheduler(global_rate=10, per_proxy_rate=2)
+    scheduler.penalize('direct')
+    
+    rates = scheduler.get_rates()
+    assert rates['direct'] == 1.0
+    assert rates['global'] == 9.0
@@ -0,0 +1,68 @@
+"""Results page parsing."""
+from serp_parser import (BLOCKED, INDEXED, NOT_INDEXED, ResultPageParser, link_key,
+                         parse_result_html)
+
+RESULTS_PAGE = """
+<html><body>
+<div class="g"><a href="/url?q=https://example.com/a&amp;sa=U">Result A</a></div>
+<div class="g"><a href="http://Example.com/b/?utm_source=serp">Result B</a></div>
+<a href="/search?q=next">Next page</a>
+<a href="#">Top</a>
+</body></html>
+"""
+
+def test_link_key_ignores_scheme_and_canonicalizes():
+    assert link_key('http://Example.com/b/') == link_key('https://example.com/b') == 'example.com/b'
+    assert link_key('ftp://example.com/') is None
+
+def test_parser_collects_result_links():
+    parser = ResultPageParser()
+    parser.feed(RESULTS_PAGE)
+    
+    assert parser.links == {'example.com/a', 'example.com/b'}
+    assert parser.matched is None
+    assert not parser.blocked
+
+def test_parser_matches_targets_across_chunks():
+    parser = ResultPageParser(targets={'example.com/b'})
+    split = RESULTS_PAGE.index('Example.com/b')
+    parser.feed(RESULTS_PAGE[:split])
+    assert parser.matched is None
+    parser.feed(RESULTS_PAGE[split:])
+    
+    assert parser.matched == 'example.com/b'
+
+def test_parse_result_html_statuses():
+    assert parse_result_html(RESULTS_PAGE, targets={'example.com/a'}).status == INDEXED
+    assert parse_result_html(RESULTS_PAGE, targets={'example.com/c'}).status == NOT_INDEXED
+    assert parse_result_html('<html><body>No results</body></html>').status == NOT_INDEXED
+
+def test_captcha_form_is_blocked():
+    html = '<html><body><form id="captcha-form" action="/sorry/index"></form></body></html>'
+    assert parse_result_html(html, targets={'example.com/a'}).status == BLOCKED
+
+def test_recaptcha_widget_is_blocked():
+    html = '<div class="g-recaptcha" data-sitekey="x"></div>'
+    assert parse_result_html(html).status == BLOCKED
+
+def test_unusual_traffic_text_is_blocked():
+    html = ('<html><body><p>Our systems have detected unusual traffic from your computer network.</p>'
+            '<a href="https://example.com/a">x</a></body></html>')
+    assert parse_result_html(html, targets={'example.com/a'}).status == BLOCKED
+
+def test_short_block_phrase_is_blocked():
+    html = "<html><body><label>I'm not a robot</label></body></html>"
+    assert parse_result_html(html).status == BLOCKED
+
+def test_block_phrases_in_scripts_are_ignored():
+    html = ('<html><script>var msg = "our systems have detected unusual traffic";</script>'
+            '<body><a href="https://example.com/a">x</a></body></html>')
+    assert parse_result_html(html, targets={'example.com/a'}).status == INDEXED
+
+def test_next_page_link_is_noted():
+    html = RESULTS_PAGE.replace('</body>', '<a id="pnnext" href="/search?q=site:example.com&amp;start=10">Next</a></body>')
+    result = parse_result_html(html)
+    
+    assert result.has_next and result.next_start == 10
+    assert result.links == {'example.com/a', 'example.com/b'}
+    assert not parse_result_html(RESULTS_PAGE).has_next
@@ -0,0 +1,268 @@
+import gzip
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import IO, FrozenSet, Iterable, Iterator, Optional
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Uploaded files may be plain text/CSV or gzip-compressed text/CSV
+ALLOWED_UPLOAD_EXTENSIONS = ('.txt', '.csv', '.txt.gz', '.csv.gz')
+
+# First bytes of every gzip stream
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Size of the chunks copied from the request stream to disk
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+# Scheme assumed for URLs submitted without one
+DEFAULT_SCHEME = 'https'
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# A URL that starts with a scheme; '://' later on (e.g. in the query) is no scheme
+SCHEME_PREFIX = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*://')
+
+# Query parameters that only track the visit and never change the page;
+# any parameter starting with utm_ is stripped as well. Override with a
+# comma-separated list in URL_TRACKING_PARAMS.
+DEFAULT_TRACKING_PARAMS = (
+    'gclid', 'gclsrc', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_gl', 'ref_src'
+)
+TRACKING_PARAMS = frozenset(
+    param.strip().lower()
+    for param in os.environ.get('URL_TRACKING_PARAMS', ','.join(DEFAULT_TRACKING_PARAMS)).split(',')
+    if param.strip()
+)
+
+def _with_scheme(url_str: str) -> str:
+    """Prefix a URL with the default scheme unless it starts with one."""
+    return url_str if SCHEME_PREFIX.match(url_str) else f'{DEFAULT_SCHEME}://{url_str}'
+
+def is_allowed_upload(filename: str) -> bool:
+    """Check whether an uploaded file name has a supported extension."""
+    return bool(filename) and filename.lower().endswith(ALLOWED_UPLOAD_EXTENSIONS)
+
+def sanitize_url(url_str):
+    """
+    Sanitize a URL string to prevent encoding issues.
+    
+    Args:
+        url_str: The URL string to sanitize
+    
+    Returns:
+        Sanitized URL string or None if the URL has encoding issues
+    """
+    try:
+        # Skip empty URLs
+        if not url_str or not url_str.strip():
+            return None
+        
+        # Basic sanitization
+        sanitized_url = url_str.strip()
+        
+        # Test that URL can be properly encoded/decoded
+        sanitized_url.encode('utf-8').decode('utf-8')
+        
+        return sanitized_url
+    except (UnicodeError, UnicodeDecodeError, UnicodeEncodeError) as e:
+        # Log URLs with encoding issues
+        logger.warning(f"URL encoding issue: {repr(url_str)[:100]}... Error: {str(e)}")
+        return None
+
+def _is_tracking_param(name: str, tracking_params: FrozenSet[str]) -> bool:
+    """Check whether a query parameter name only tracks the visit."""
+    name = unquote_plus(name).lower()
+    return name.startswith('utm_') or name in tracking_params
+
+def canonicalize_url(url_str: str, tracking_params: FrozenSet[str] = TRACKING_PARAMS) -> Optional[str]:
+    """
+    Reduce a URL to the one form it is stored and checked under, so that
+    spellings of the same page collapse into a single URL:
+    
+    - a missing scheme becomes https, and the scheme and host are lowercased
+    - default ports (80 for http, 443 for https) are dropped
+    - an empty path becomes "/" and a trailing slash on other paths is removed
+    - tracking query parameters and the fragment are removed
+    
+    Args:
+        url_str: A sanitized URL string
+        tracking_params: Lowercase names of query parameters to strip
+    
+    Returns:
+        The canonical URL, or None if it is not a valid http(s) URL
+    """
+    url_str = _with_scheme(url_str)
+    
+    try:
+        parts = urlsplit(url_str)
+        port = parts.port
+    except ValueError:
+        return None
+    
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if scheme not in DEFAULT_PORTS or not host:
+        return None
+    
+    # hostname is already lowercased; IPv6 addresses need their brackets back
+    netloc = f'[{host}]' if ':' in host else host
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc = f'{netloc}:{port}'
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f'{parts.username}:{parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+    
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+    
+    # Filter the raw query so the remaining parameters keep their exact encoding
+    query = '&'.join(
+        param for param in parts.query.split('&')
+        if param and not _is_tracking_param(param.split('=', 1)[0], tracking_params)
+    )
+    
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+def normalize_url(line: str) -> Optional[str]:
+    """Sanitize and canonicalize one candidate URL; None if it is invalid."""
+    url_str = sanitize_url(line)
+    return canonicalize_url(url_str) if url_str else None
+
+def url_host(url_str: str) -> Optional[str]:
+    """
+    Host name of a URL, lowercased and without port or credentials; used
+    to group results by domain. URLs stored without a scheme are read as
+    if they had one.
+    """
+    url_str = _with_scheme(url_str)
+    try:
+        host = urlsplit(url_str).hostname
+    except ValueError:
+        return None
+    host = (host or '').rstrip('.')
+    return host[:255] or None
+
+def spool_upload(stream: IO[bytes], max_bytes: int, directory: Optional[str] = None) -> str:
+    """
+    Copy an upload stream to a temporary file on disk in fixed-size chunks,
+    so the request worker never holds the whole file in memory.
+    
+    Args:
+        stream: Binary stream of the uploaded file
+        max_bytes: Maximum accepted upload size in bytes
+        directory: Directory for the spooled file (system temp dir by default)
+    
+    Returns:
+        Path of the spooled file; the caller is responsible for removing it
+    
+    Raises:
+        ValueError: If the upload exceeds max_bytes
+    """
+    fd, path = tempfile.mkstemp(prefix='urls-', suffix='.upload', dir=directory)
+    total_size = 0
+    
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            while True:
+                chunk = stream.read(SPOOL_CHUNK_SIZE)
+                if not chunk:
+                    break
+                total_size += len(chunk)
+                if total_size > max_bytes:
+                    raise ValueError(f'File size exceeds maximum limit of {max_bytes // (1024 * 1024)}MB')
+                spool.write(chunk)
+    except Exception:
+        remove_spooled_file(path)
+        raise
+    
+    logger.debug(f"Spooled {total_size} bytes of uploaded URLs to {path}")
+    return path
+
+def remove_spooled_file(path: Optional[str]) -> None:
+    """Delete a spooled upload, ignoring files that are already gone."""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove spooled upload {path}: {str(e)}")
+
+def _open_binary(path: str) -> IO[bytes]:
+    """Open a spooled file, transparently decompressing gzip content."""
+    with open(path, 'rb') as probe:
+        is_gzip = probe.read(2) == GZIP_MAGIC
+    return gzip.open(path, 'rb') if is_gzip else open(path, 'rb')
+
+def iter_url_lines(path: str) -> Iterator[str]:
+    """
+    Lazily yield the stripped, non-empty lines of a spooled upload.
+    
+    Args:
+        path: Path returned by spool_upload
+    
+    Yields:
+        One candidate URL per line
+    """
+    with _open_binary(path) as raw:
+        for raw_line in raw:
+            line = raw_line.decode('utf-8', errors='ignore').strip()
+            if line:
+                yield line
+
+def count_lines(path: str, limit: Optional[int] = None) -> int:
+    """
+    Count the lines of a spooled upload without decoding it, used as a
+    cheap estimate of how many URLs it holds.
+    
+    Args:
+        path: Path of the spooled upload
+        limit: Stop reading once this many lines are counted, so a large
+            upload is not decompressed just to be estimated
+    
+    Returns:
+        The number of lines, or at least limit if the upload has more
+    """
+    count = 0
+    last_chunk = b''
+    with _open_binary(path) as raw:
+        for chunk in iter(lambda: raw.read(SPOOL_CHUNK_SIZE), b''):
+            count += chunk.count(b'\n')
+            last_chunk = chunk
+            if limit is not None and count >= limit:
+                return count
+    # A final line without a trailing newline still holds a URL
+    if last_chunk and not last_chunk.endswith(b'\n'):
+        count += 1
+    return count
+
+def iter_unique_urls(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Sanitize, canonicalize and de-duplicate URLs as they stream past, so
+    duplicates never reach the database or the network.
+    
+    Only a short digest of each canonical URL is remembered, which keeps
+    the de-duplication set far smaller than the URLs themselves.
+    
+    Args:
+        lines: Candidate URLs, e.g. from iter_url_lines
+    
+    Yields:
+        Each valid URL in canonical form, the first time it is seen
+    """
+    seen = set()
+    for line in lines:
+        url_str = normalize_url(line)
+        if not url_str:
+            continue
+        digest = hashlib.blake2b(url_str.encode('utf-8'), digest_size=16).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        yield url_str
@@ -0,0 +1,64 @@
+"""
+Standalone job worker.
+
+Run one or more of these next to the web processes (which then do not need
+their embedded worker, see EMBEDDED_WORKER) to process queued URL checks.
+Workers on any number of nodes share work through leases in the database:
+
+    python worker.py --processes 4
+"""
+import os
+import argparse
+import logging
+import multiprocessing
+
+# The web app must not start its own worker thread inside this process
+os.environ['EMBEDDED_WORKER'] = '0'
+
+logger = logging.getLogger(__name__)
+
+def worker_process():
+    """
+    Entry point of one worker process. Importing the app here gives every
+    process its own database connections, ProxyManager and IndexingChecker.
+    """
+    from app import app, run_worker
+    
+    with app.app_context():
+        try:
+            run_worker()
+        except KeyboardInterrupt:
+            logger.info("Job worker stopped")
+
+def main():
+    """Start the requested number of worker processes."""
+    parser = argparse.ArgumentParser(description='URL Indexing Checker job worker')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Number of worker processes to run on this node (default: 1)')
+    args = parser.parse_args()
+    
+    if args.processes <= 1:
+        worker_process()
+        return
+    
+    # Spawn fresh interpreters so no database connection is shared across a fork
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=worker_process, name=f'job-worker-{i}')
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Unfinished batches are not lost: their leases expire and another worker resumes them
+        logger.info("Stopping job workers")
+        for process in processes:
+            process.terminate()
+            process.join()
+
+if __name__ == '__main__':
+    main()